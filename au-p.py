@@ -3,47 +3,171 @@ import feedparser
 import os
 import json
 import requests
+import requests.adapters
 import re
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Comment
 import time
 import base64
 from urllib.parse import urlparse, unquote, parse_qs
 import sys
 import uuid
 import traceback
+import contextlib
+import copy
+import collections
+import atexit
+import argparse
+import signal
+import queue
+import threading
+import sqlite3
+import hashlib
+import heapq
+import random
+import email.utils
+import html
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # --- کلاس مدیریت لاگ ---
+_log_context = threading.local()
+
+def current_log_context():
+    """زمینه لاگ Thread جاری (مثل مرحله و شناسه مقاله) که به رکوردهای JSONL اضافه می‌شود."""
+    return dict(getattr(_log_context, "fields", {}))
+
+@contextlib.contextmanager
+def log_context(**fields):
+    previous_fields = getattr(_log_context, "fields", {})
+    _log_context.fields = {**previous_fields, **{key: value for key, value in fields.items() if value is not None}}
+    try:
+        yield
+    finally:
+        _log_context.fields = previous_fields
+
 class Logger:
-    def __init__(self, log_file="master_log.txt"):
+    """
+    جایگزین sys.stdout: هر خط کامل print به یک صف محدود اضافه می‌شود و یک Thread پس‌زمینه آن را هم به صورت متن
+    (کنسول و master_log.txt) و هم به صورت رکورد JSONL با مرحله و شناسه مقاله می‌نویسد. نوشتن روی دیسک با رسیدن خطا،
+    گذشت LOG_FLUSH_INTERVAL ثانیه یا جمع شدن LOG_FLUSH_MAX_RECORDS رکورد انجام می‌شود، نه پس از هر خط.
+    close در atexit هم ثبت می‌شود تا با sys.exit یا خطای کنترل‌نشده هیچ خطی از دست نرود.
+    """
+    _STOP = object()
+
+    def __init__(self, log_file="master_log.txt", jsonl_file=None):
         self.log_file_path = log_file
         self.terminal = sys.stdout
         self.log_file = open(self.log_file_path, "a", encoding='utf-8')
+        self.jsonl_file = open(jsonl_file, "a", encoding='utf-8') if jsonl_file else None
+        self._partial_lines = threading.local()
+        self._records = queue.Queue(maxsize=LOG_BUFFER_MAX_RECORDS)
+        self._flush_requested = threading.Event()
+        self._closed = False
+        self._close_lock = threading.Lock()
         separator = f"\n\n-------------------- شروع اجرای جدید: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} --------------------\n"
         self.log_file.write(separator)
-        self.flush()
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="log-writer", daemon=True)
+        self._writer_thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _level_of(line):
+        stripped_line = line.lstrip()
+        if stripped_line.startswith("!!!"): return "error"
+        if stripped_line.startswith("--- هشدار") or "هشدار:" in stripped_line[:20]: return "warning"
+        return "info"
 
     def write(self, message):
-        if message.strip() != "":
-            self.terminal.write(message)
-            self.log_file.write(message)
-            self.flush()
-        else:
+        if self._closed:
             self.terminal.write(message)
+            return len(message)
+        # print متن و "\n" را جداگانه می‌نویسد؛ خط هر Thread جداگانه کامل می‌شود تا خطوط Threadها در هم نروند
+        pending_text = getattr(self._partial_lines, "text", "") + message
+        *complete_lines, pending_text = pending_text.split("\n")
+        self._partial_lines.text = pending_text
+        for line in complete_lines:
+            record = {"ts": time.time(), "level": self._level_of(line), "thread": threading.current_thread().name, "msg": line}
+            record.update(current_log_context())
+            # صف محدود است؛ اگر Thread نویسنده عقب بماند تولیدکننده منتظر می‌ماند (هیچ خطی دور ریخته نمی‌شود)
+            self._records.put(record)
+        return len(message)
 
     def flush(self):
+        # فقط درخواست نوشتن فوری به Thread نویسنده؛ فراخواننده منتظر دیسک نمی‌ماند
+        self._flush_requested.set()
+
+    def _writer_loop(self):
+        pending_records = []
+        last_flush_time = time.monotonic()
+        while True:
+            try:
+                record = self._records.get(timeout=LOG_FLUSH_INTERVAL)
+            except queue.Empty:
+                record = None
+            stop_requested = record is self._STOP
+            if record is not None and not stop_requested:
+                # خطای نوشتن (دیسک پر، encoding و ...) نباید Thread را از کار بیندازد؛ وگرنه صف پر و هر print قفل می‌شود
+                try: self._write_record(record)
+                except Exception as e_write: self._report_write_failure(e_write, record["msg"])
+                pending_records.append(record)
+            flush_due = (
+                stop_requested
+                or self._flush_requested.is_set()
+                or (record is not None and not stop_requested and record["level"] == "error")
+                or len(pending_records) >= LOG_FLUSH_MAX_RECORDS
+                or time.monotonic() - last_flush_time >= LOG_FLUSH_INTERVAL
+            )
+            if flush_due and (pending_records or stop_requested or self._flush_requested.is_set()):
+                try: self._flush_files()
+                except Exception as e_flush: self._report_write_failure(e_flush)
+                self._flush_requested.clear()
+                pending_records = []
+                last_flush_time = time.monotonic()
+            if stop_requested: return
+
+    def _write_record(self, record):
+        line = record["msg"] + "\n"
+        self.terminal.write(line)
+        if line.strip(): self.log_file.write(line)
+        if self.jsonl_file:
+            json_record = dict(record)
+            json_record["ts"] = datetime.fromtimestamp(record["ts"]).isoformat(timespec="milliseconds")
+            self.jsonl_file.write(json.dumps(json_record, ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def _report_write_failure(error, message=None):
+        try:
+            sys.__stdout__.write(f"!!! خطا در نوشتن لاگ ({type(error).__name__}: {error})\n" + (message + "\n" if message is not None else ""))
+            sys.__stdout__.flush()
+        except Exception:
+            pass
+
+    def _flush_files(self):
         self.terminal.flush()
         self.log_file.flush()
+        if self.jsonl_file: self.jsonl_file.flush()
 
     def close(self):
+        with self._close_lock:
+            if self._closed: return
+            self._closed = True
+        remaining_text = getattr(self._partial_lines, "text", "")
+        if remaining_text: self._records.put({"ts": time.time(), "level": "info", "thread": threading.current_thread().name, "msg": remaining_text})
+        self._records.put(self._STOP)
+        self._writer_thread.join(timeout=30)
         end_separator = f"\n-------------------- پایان اجرا: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} --------------------\n"
         self.log_file.write(end_separator)
         self.log_file.close()
+        if self.jsonl_file: self.jsonl_file.close()
+        self.terminal.flush()
 
 # --- تنظیمات اصلی ---
-RSS_FEED_URL = "https://www.newsbtc.com/feed/"
+# آدرس فید و API Gemini برای اجرای آفلاین (bench_pipeline.py) قابل تغییر است
+RSS_FEED_URL = os.environ.get("RSS_FEED_URL", "https://www.newsbtc.com/feed/")
 GEMINI_MODEL_NAME = "gemini-2.5-pro"
-GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL_NAME}:generateContent"
+GEMINI_API_BASE_URL = os.environ.get("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+# مدل ارزان‌تر برای ترجمه خبرهای تقریباً تکراری در مسیر "update"
+GEMINI_UPDATE_MODEL_NAME = os.environ.get("GEMINI_UPDATE_MODEL_NAME", "gemini-2.5-flash")
 GEMINI_API_KEY = os.environ.get("GEMAPI")
 
 # --- تنظیمات API وردپرس (به‌روزرسانی شده) ---
@@ -55,13 +179,1284 @@ WORDPRESS_PASS = os.environ.get("WORDPRESS_PASS")
 WORDPRESS_CUSTOM_POST_API_ENDPOINT = f"{WORDPRESS_MAIN_URL}/wp-json/my-poster/v1/create"
 WORDPRESS_PROCESSED_LINKS_GET_API_ENDPOINT = f"{WORDPRESS_MAIN_URL}/wp-json/my-poster/v1/processed-links"
 WORDPRESS_PROCESSED_LINKS_ADD_API_ENDPOINT = f"{WORDPRESS_MAIN_URL}/wp-json/my-poster/v1/processed-links"
+WORDPRESS_PROCESSED_LINKS_CHECK_API_ENDPOINT = f"{WORDPRESS_MAIN_URL}/wp-json/my-poster/v1/processed-links/check"
+WORDPRESS_MEDIA_API_ENDPOINT = f"{WORDPRESS_MAIN_URL}/wp-json/wp/v2/media"
 
 REQUEST_TIMEOUT = 60
 GEMINI_TIMEOUT = 150
+# ترجمه محتوا به صورت استریم؛ اگر بین دو بخش پاسخ بیش از این مدت داده‌ای نرسد درخواست قطع و دوباره ارسال می‌شود
+GEMINI_STREAMING = os.environ.get("GEMINI_STREAMING", "1") == "1"
+GEMINI_STREAM_IDLE_TIMEOUT = float(os.environ.get("GEMINI_STREAM_IDLE_TIMEOUT", "30"))
 MASTER_LOG_FILE = "master_log.txt"
+# نسخه ساخت‌یافته لاگ (هر خط یک رکورد JSON با سطح، مرحله و مقاله) و تنظیمات بافر نویسنده لاگ
+MASTER_LOG_JSONL_FILE = os.environ.get("MASTER_LOG_JSONL_FILE", "master_log.jsonl")
+LOG_BUFFER_MAX_RECORDS = int(os.environ.get("LOG_BUFFER_MAX_RECORDS", "10000"))
+LOG_FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", "1.0"))
+LOG_FLUSH_MAX_RECORDS = int(os.environ.get("LOG_FLUSH_MAX_RECORDS", "200"))
+
+# سهمیه Gemini در دقیقه (درخواست و توکن) و مدت توقف صف پس از 429 بدون Retry-After.
+# پیش‌فرض‌ها سهمیه رایگان gemini-2.5-pro هستند (5 درخواست و 250 هزار توکن در دقیقه)؛ برای کلید پولی (Tier 1: 150 و 2 میلیون) افزایش دهید
+GEMINI_RPM_LIMIT = int(os.environ.get("GEMINI_RPM_LIMIT", "5"))
+GEMINI_TPM_LIMIT = int(os.environ.get("GEMINI_TPM_LIMIT", "250000"))
+GEMINI_RATE_LIMIT_PAUSE_SECONDS = float(os.environ.get("GEMINI_RATE_LIMIT_PAUSE_SECONDS", "30"))
+
+# --- تنظیمات حالت بک‌لاگ (پردازش تمام ورودی‌های جدید فید در هر اجرا) ---
+BACKLOG_MODE = os.environ.get("BACKLOG_MODE", "0") == "1"
+# هر Worker مشغول تقریباً 3 درخواست Gemini در دقیقه می‌فرستد (ترجمه متن کندترین مرحله است)؛ Worker بیشتر از آنچه سهمیه RPM
+# تغذیه می‌کند فقط در صف gemini_scheduler منتظر می‌ماند، پس تعداد پیش‌فرض از GEMINI_RPM_LIMIT محاسبه می‌شود (5 ← 2 Worker)
+BACKLOG_MAX_WORKERS = int(os.environ.get("BACKLOG_MAX_WORKERS", str(max(1, min(8, -(-GEMINI_RPM_LIMIT // 3))))))
+BACKLOG_MAX_ENTRIES = int(os.environ.get("BACKLOG_MAX_ENTRIES", "0")) # 0 یعنی بدون محدودیت
+
+# --- تنظیمات وضعیت پایدار و حافظه ترجمه ---
+STATE_DIR = os.environ.get("STATE_DIR", ".state")
+TRANSLATION_MEMORY_ENABLED = os.environ.get("TRANSLATION_MEMORY_ENABLED", "1") == "1"
+TRANSLATION_MEMORY_MAX_ENTRIES = int(os.environ.get("TRANSLATION_MEMORY_MAX_ENTRIES", "5000"))
+# با هر تغییر در پرامپت‌ها نسخه مربوطه را بالا ببرید تا ترجمه‌های قدیمی از حافظه استفاده نشوند
+TITLE_PROMPT_VERSION = "title-v1"
+BODY_PROMPT_VERSION = "body-v2"
+# ترجمه بخش‌بخش و موازی مقاله‌های طولانی (پیش‌فرض خاموش)
+GEMINI_CHUNKED_TRANSLATION = os.environ.get("GEMINI_CHUNKED_TRANSLATION", "0") == "1"
+GEMINI_CHUNK_MAX_TOKENS = int(os.environ.get("GEMINI_CHUNK_MAX_TOKENS", "3000"))
+GEMINI_CHUNK_MAX_WORKERS = int(os.environ.get("GEMINI_CHUNK_MAX_WORKERS", "4"))
+# پیش از ارسال به Gemini بلوک‌های دست‌نخوردنی و ویژگی‌های حجیم HTML با توکن کوتاه جایگزین و پس از ترجمه بازگردانده می‌شوند
+PROMPT_MINIMIZER_ENABLED = os.environ.get("PROMPT_MINIMIZER_ENABLED", "1") == "1"
+# اعتبارسنجی خروجی Gemini در برابر متن مبدأ (Placeholder و توکن‌ها، div خلاصه و نتیجه‌گیری، اسکلت تگ‌ها، نسبت حروف لاتین)؛
+# هر بخش خراب جداگانه و با درخواست کوچک ترمیم می‌شود. حداکثر OUTPUT_REPAIR_MAX_FRAGMENTS عنصر ترجمه‌نشده در هر مقاله دوباره درخواست می‌شود
+OUTPUT_VALIDATION_ENABLED = os.environ.get("OUTPUT_VALIDATION_ENABLED", "1") == "1"
+OUTPUT_MAX_LATIN_RATIO = float(os.environ.get("OUTPUT_MAX_LATIN_RATIO", "0.3"))
+OUTPUT_REPAIR_MAX_FRAGMENTS = int(os.environ.get("OUTPUT_REPAIR_MAX_FRAGMENTS", "4"))
+REPAIR_PROMPT_VERSION = "repair-v1"
+CAPTION_PROMPT_VERSION = "caption-v1"
+TRADINGVIEW_PER_HOST_LIMIT = int(os.environ.get("TRADINGVIEW_PER_HOST_LIMIT", "4"))
+# بررسی عکس‌ها پیش از پراکسی: فقط چند KB اول هر عکس (Range) برای ابعاد خوانده می‌شود.
+# عکس‌های خراب حذف یا (اگر IMAGE_PROBE_FALLBACK_URL تنظیم شده باشد) با آن جایگزین می‌شوند
+IMAGE_PROBE_ENABLED = os.environ.get("IMAGE_PROBE_ENABLED", "1") == "1"
+IMAGE_PROBE_RANGE_BYTES = int(os.environ.get("IMAGE_PROBE_RANGE_BYTES", "16384"))
+IMAGE_PROBE_TIMEOUT = float(os.environ.get("IMAGE_PROBE_TIMEOUT", "15"))
+IMAGE_PROBE_MAX_WORKERS = int(os.environ.get("IMAGE_PROBE_MAX_WORKERS", "8"))
+IMAGE_PROBE_PER_HOST_LIMIT = int(os.environ.get("IMAGE_PROBE_PER_HOST_LIMIT", "4"))
+# نتیجه عکس‌های سالم دائمی کش می‌شود؛ عکس خراب فقط این مدت (ثانیه) در کش می‌ماند تا دوباره بررسی شود
+IMAGE_PROBE_DEAD_TTL = float(os.environ.get("IMAGE_PROBE_DEAD_TTL", "21600"))
+IMAGE_PROBE_FALLBACK_URL = os.environ.get("IMAGE_PROBE_FALLBACK_URL", "")
+# آپلود عکس‌های مقاله و تصویر شاخص در کتابخانه رسانه وردپرس به جای پراکسی (پیش‌فرض خاموش)؛
+# عکس تکراری بر اساس SHA-256 محتوا شناخته می‌شود و دوباره آپلود نمی‌شود
+SIDELOAD_IMAGES = os.environ.get("SIDELOAD_IMAGES", "0") == "1"
+SIDELOAD_MAX_WORKERS = int(os.environ.get("SIDELOAD_MAX_WORKERS", "4"))
+SIDELOAD_MAX_BYTES = int(os.environ.get("SIDELOAD_MAX_BYTES", str(15 * 1024 * 1024)))
+# backend پارسر صفحه‌های کامل کرال‌شده و متن‌هایی که فقط get_text می‌شوند: auto (lxml در صورت نصب بودن) یا html.parser.
+# قطعه‌هایی که در پست منتشر می‌شوند همیشه با html.parser parse می‌شوند (tests/test_html_parser_equivalence.py)
+HTML_PARSER_BACKEND = os.environ.get("HTML_PARSER_BACKEND", "auto")
+FEED_STATE_FILE = "feed_state.json"
+# تشخیص خبر تقریباً تکراری (SimHash متن انگلیسی) پیش از ترجمه: شباهت حداقل NEAR_DUPLICATE_THRESHOLD با مقاله‌های
+# چند ساعت اخیر یعنی تکراری. NEAR_DUPLICATE_ACTION: update (پیش‌فرض؛ انتشار با ترجمه GEMINI_UPDATE_MODEL_NAME) یا skip (ثبت لینک بدون ارسال پست)
+NEAR_DUPLICATE_ENABLED = os.environ.get("NEAR_DUPLICATE_ENABLED", "1") == "1"
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.9"))
+NEAR_DUPLICATE_WINDOW_HOURS = float(os.environ.get("NEAR_DUPLICATE_WINDOW_HOURS", "48"))
+NEAR_DUPLICATE_ACTION = os.environ.get("NEAR_DUPLICATE_ACTION", "update").strip().lower()
+# ذخیره خروجی هر مرحله هر مقاله تا اجرای بعدی پس از خطا از آخرین مرحله کامل‌شده ادامه دهد
+CHECKPOINTS_ENABLED = os.environ.get("CHECKPOINTS_ENABLED", "1") == "1"
+# متریک‌های هر اجرا (یک خط JSON برای هر اجرا) و textfile اختیاری پرومتئوس
+METRICS_FILE = "metrics.jsonl"
+METRICS_MAX_RUNS = int(os.environ.get("METRICS_MAX_RUNS", "2000"))
+METRICS_PROMETHEUS_FILE = os.environ.get("METRICS_PROMETHEUS_FILE", "")
+# حالت daemon: بازه نظرسنجی تطبیقی فید (ثانیه) و فایل وضعیت سلامت در STATE_DIR
+DAEMON_MIN_POLL_INTERVAL = float(os.environ.get("DAEMON_MIN_POLL_INTERVAL", "60"))
+DAEMON_MAX_POLL_INTERVAL = float(os.environ.get("DAEMON_MAX_POLL_INTERVAL", "900"))
+DAEMON_BACKOFF_FACTOR = float(os.environ.get("DAEMON_BACKOFF_FACTOR", "2"))
+DAEMON_HEALTH_FILE = "daemon_health.json"
+# منابع فید: فایل JSON اختیاری با لیست پروفایل‌ها (در غیر این صورت فقط NewsBTC) و تعداد دریافت هم‌زمان فیدها
+FEED_SOURCES_FILE = os.environ.get("FEED_SOURCES_FILE", "")
+FEED_FETCH_MAX_WORKERS = int(os.environ.get("FEED_FETCH_MAX_WORKERS", "4"))
+# سقف مجموع زمان انتظار برای تلاش‌های مجدد در کل یک اجرا
+RETRY_BUDGET_SECONDS = float(os.environ.get("RETRY_BUDGET_SECONDS", "600"))
+# اندازه Pool اتصال هر سرویس؛ باید برای تمام Workerها و مراحل هم‌زمان کافی باشد
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", str(max(10, BACKLOG_MAX_WORKERS * 4))))
 
 if not all([GEMINI_API_KEY, WORDPRESS_MAIN_URL, WORDPRESS_USER, WORDPRESS_PASS]):
     raise ValueError("یکی از متغیرهای محیطی ضروری (GEMAPI, WORDPRESS_URL, WORDPRESS_USER, WORDPRESS_PASS) تنظیم نشده است.")
+# مقدار اشتباه (مثل updte) نباید بی‌صدا به مسیر skip برود؛ آن مسیر مقاله را بدون انتشار پردازش‌شده ثبت می‌کند
+if NEAR_DUPLICATE_ACTION not in ("update", "skip"):
+    raise ValueError(f"مقدار NEAR_DUPLICATE_ACTION نامعتبر است ({NEAR_DUPLICATE_ACTION!r})؛ فقط update یا skip مجاز است.")
+
+# --- رجیستری منابع فید: قواعد پردازش هر منبع (حذف لینک، بخش‌های اضافی، دسته، منبع و فاصله نظرسنجی) ---
+DEFAULT_FEED_SOURCE = {
+    "name": "newsbtc",
+    "feed_url": RSS_FEED_URL,
+    # لینک‌های این دامنه‌ها (و زیردامنه‌هایشان) از متن حذف و فقط متن لینک حفظ می‌شود
+    "strip_link_domains": ["newsbtc.com"],
+    # پاراگراف‌ها و تیترهایی که با این عبارت‌ها شروع شوند حذف می‌شوند
+    "boilerplate_keywords": ["related reading", "read also", "see also", "featured image from", "disclaimer:"],
+    "category_id": 69,
+    "attribution": "منبع: NewsBTC",
+    # کمترین فاصله نظرسنجی این منبع در حالت daemon (None یعنی DAEMON_MIN_POLL_INTERVAL)
+    "poll_interval": None,
+}
+
+def load_feed_sources():
+    """پروفایل‌ها از FEED_SOURCES_FILE خوانده می‌شوند؛ کلیدهای ناموجود از DEFAULT_FEED_SOURCE (به جز name و feed_url) پر می‌شوند."""
+    if not FEED_SOURCES_FILE: return [dict(DEFAULT_FEED_SOURCE)]
+    with open(FEED_SOURCES_FILE, "r", encoding="utf-8") as sources_file:
+        configured_sources = json.load(sources_file)
+    if not isinstance(configured_sources, list) or not configured_sources:
+        raise ValueError(f"فایل منابع فید ({FEED_SOURCES_FILE}) باید یک لیست JSON غیرخالی از پروفایل‌ها باشد.")
+    feed_sources, seen_names = [], set()
+    for configured_source in configured_sources:
+        if not isinstance(configured_source, dict) or not configured_source.get("name") or not configured_source.get("feed_url"):
+            raise ValueError(f"پروفایل منبع فید نامعتبر است (name و feed_url الزامی‌اند): {configured_source}")
+        if configured_source["name"] in seen_names:
+            raise ValueError(f"نام منبع فید تکراری است: {configured_source['name']}")
+        seen_names.add(configured_source["name"])
+        feed_source = {key: value for key, value in DEFAULT_FEED_SOURCE.items() if key not in ("name", "feed_url")}
+        feed_source.update(configured_source)
+        feed_sources.append(feed_source)
+    return feed_sources
+
+FEED_SOURCES = load_feed_sources()
+FEED_SOURCES_BY_NAME = {feed_source["name"]: feed_source for feed_source in FEED_SOURCES}
+
+def get_feed_source(source_name):
+    return FEED_SOURCES_BY_NAME.get(source_name) or FEED_SOURCES[0]
+
+# --- متریک‌های اجرا: زمان هر مرحله، درخواست‌های HTTP، تلاش‌های مجدد و مصرف توکن Gemini ---
+class RunMetrics:
+    """
+    متریک‌های یک اجرا را (بین تمام Threadها) جمع می‌کند و در پایان یک خط JSON به STATE_DIR/METRICS_FILE اضافه می‌کند
+    تا روند تأخیر و مصرف سهمیه بین اجراهای ساعتی قابل مقایسه باشد. در صورت تنظیم METRICS_PROMETHEUS_FILE
+    همان مقادیر در قالب textfile پرومتئوس هم نوشته می‌شوند.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.run_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.started_at = time.time()
+        self.stages = {}
+        self.http = {}
+        self.retries = {}
+        self.gemini_usage = {}
+        self.articles = []
+
+    @contextlib.contextmanager
+    def timed(self, stage_name):
+        stage_start_time = time.perf_counter()
+        stage_failed = False
+        try:
+            with log_context(stage=stage_name):
+                yield
+        except BaseException:
+            stage_failed = True
+            raise
+        finally:
+            self.record_stage(stage_name, time.perf_counter() - stage_start_time, stage_failed)
+
+    def record_stage(self, stage_name, duration_seconds, failed=False):
+        with self._lock:
+            stage_stats = self.stages.setdefault(stage_name, {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stage_stats["count"] += 1
+            stage_stats["errors"] += 1 if failed else 0
+            stage_stats["total_seconds"] += duration_seconds
+            stage_stats["max_seconds"] = max(stage_stats["max_seconds"], duration_seconds)
+
+    def record_http(self, host, status_code, duration_seconds, bytes_sent, bytes_received):
+        with self._lock:
+            host_stats = self.http.setdefault(host or "unknown", {"requests": 0, "errors": 0, "bytes_sent": 0, "bytes_received": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            host_stats["requests"] += 1
+            host_stats["errors"] += 1 if status_code >= 400 else 0
+            host_stats["bytes_sent"] += bytes_sent
+            host_stats["bytes_received"] += bytes_received
+            host_stats["total_seconds"] += duration_seconds
+            host_stats["max_seconds"] = max(host_stats["max_seconds"], duration_seconds)
+
+    def add_http_bytes_received(self, host, bytes_received):
+        # برای پاسخ‌های استریمی که حجمشان در زمان دریافت هدرها معلوم نیست
+        with self._lock:
+            host_stats = self.http.setdefault(host or "unknown", {"requests": 0, "errors": 0, "bytes_sent": 0, "bytes_received": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            host_stats["bytes_received"] += bytes_received
+
+    def record_retry_event(self, policy_name, event_name):
+        # event_name: attempts، retries، exhausted، circuit_open یا budget_exhausted
+        with self._lock:
+            policy_stats = self.retries.setdefault(policy_name, {})
+            policy_stats[event_name] = policy_stats.get(event_name, 0) + 1
+
+    def record_gemini_usage(self, label, usage_metadata):
+        if not usage_metadata: return
+        # برچسب‌های بخش‌بخش (مثل «ترجمه محتوا (بخش ۲/۴)») در یک گروه جمع می‌شوند
+        usage_group = label.split(" (")[0]
+        with self._lock:
+            usage_stats = self.gemini_usage.setdefault(usage_group, {"requests": 0, "prompt_tokens": 0, "output_tokens": 0, "total_tokens": 0})
+            usage_stats["requests"] += 1
+            usage_stats["prompt_tokens"] += usage_metadata.get("promptTokenCount", 0) or 0
+            usage_stats["output_tokens"] += usage_metadata.get("candidatesTokenCount", 0) or 0
+            usage_stats["total_tokens"] += usage_metadata.get("totalTokenCount", 0) or 0
+
+    def record_article(self, progress):
+        with self._lock:
+            self.articles.append({key: progress.get(key) for key in ("link", "status", "duration", "error")})
+
+    def reset(self):
+        # در حالت daemon پس از ثبت متریک‌های هر چرخه، شمارنده‌ها برای چرخه بعد صفر می‌شوند
+        with self._lock:
+            self.run_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+            self.started_at = time.time()
+            self.stages, self.http, self.retries, self.gemini_usage, self.articles = {}, {}, {}, {}, []
+
+    def snapshot(self, exit_code):
+        with self._lock:
+            return {
+                "run_id": self.run_id,
+                "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+                "duration_seconds": round(time.time() - self.started_at, 3),
+                "exit_code": exit_code,
+                "stages": json.loads(json.dumps(self.stages)),
+                "http": json.loads(json.dumps(self.http)),
+                "retries": json.loads(json.dumps(self.retries)),
+                "gemini_usage": json.loads(json.dumps(self.gemini_usage)),
+                "articles": list(self.articles),
+            }
+
+    def write(self, exit_code):
+        run_snapshot = self.snapshot(exit_code)
+        os.makedirs(STATE_DIR, exist_ok=True)
+        metrics_path = os.path.join(STATE_DIR, METRICS_FILE)
+        previous_lines = []
+        if os.path.exists(metrics_path):
+            with open(metrics_path, "r", encoding="utf-8") as metrics_file:
+                previous_lines = metrics_file.readlines()
+        kept_lines = previous_lines[-(METRICS_MAX_RUNS - 1):] if METRICS_MAX_RUNS > 1 else []
+        with open(metrics_path + ".tmp", "w", encoding="utf-8") as metrics_file:
+            metrics_file.writelines(kept_lines)
+            metrics_file.write(json.dumps(run_snapshot, ensure_ascii=False) + "\n")
+        os.replace(metrics_path + ".tmp", metrics_path)
+        print(f"--- [Metrics] متریک‌های اجرا {self.run_id} در {metrics_path} ثبت شد.")
+        if METRICS_PROMETHEUS_FILE: self.write_prometheus(run_snapshot, METRICS_PROMETHEUS_FILE)
+
+    @staticmethod
+    def write_prometheus(run_snapshot, textfile_path):
+        def escape_label(label_value): return str(label_value).replace("\\", "\\\\").replace('"', '\\"')
+        metric_lines = [
+            f"rss_pipeline_run_duration_seconds {run_snapshot['duration_seconds']}",
+            f"rss_pipeline_run_exit_code {run_snapshot['exit_code']}",
+            f"rss_pipeline_run_timestamp_seconds {int(time.time())}",
+        ]
+        for stage_name, stage_stats in run_snapshot["stages"].items():
+            metric_lines.append(f'rss_pipeline_stage_seconds_total{{stage="{escape_label(stage_name)}"}} {stage_stats["total_seconds"]:.6f}')
+            metric_lines.append(f'rss_pipeline_stage_runs_total{{stage="{escape_label(stage_name)}"}} {stage_stats["count"]}')
+            metric_lines.append(f'rss_pipeline_stage_errors_total{{stage="{escape_label(stage_name)}"}} {stage_stats["errors"]}')
+        for host, host_stats in run_snapshot["http"].items():
+            for stat_name in ("requests", "errors", "bytes_sent", "bytes_received"):
+                metric_lines.append(f'rss_pipeline_http_{stat_name}_total{{host="{escape_label(host)}"}} {host_stats[stat_name]}')
+            metric_lines.append(f'rss_pipeline_http_seconds_total{{host="{escape_label(host)}"}} {host_stats["total_seconds"]:.6f}')
+        for policy_name, policy_stats in run_snapshot["retries"].items():
+            for event_name, event_count in policy_stats.items():
+                metric_lines.append(f'rss_pipeline_retry_events_total{{policy="{escape_label(policy_name)}",event="{escape_label(event_name)}"}} {event_count}')
+        for usage_group, usage_stats in run_snapshot["gemini_usage"].items():
+            for token_kind in ("prompt_tokens", "output_tokens", "total_tokens"):
+                metric_lines.append(f'rss_pipeline_gemini_{token_kind}_total{{call="{escape_label(usage_group)}"}} {usage_stats[token_kind]}')
+        with open(textfile_path + ".tmp", "w", encoding="utf-8") as textfile:
+            textfile.write("\n".join(metric_lines) + "\n")
+        os.replace(textfile_path + ".tmp", textfile_path)
+
+run_metrics = RunMetrics()
+
+# --- لایه HTTP مشترک: یک Session با Pool اتصال Keep-Alive برای هر سرویس ---
+class HttpClient:
+    """
+    برای هر سرویس (gemini، wordpress، scraper) یک requests.Session جداگانه با هدرها، احراز هویت و timeout پیش‌فرض می‌سازد
+    تا اتصال‌های TCP/TLS بین درخواست‌ها دوباره استفاده شوند. آمار تأخیر و استفاده مجدد از اتصال به تفکیک host ثبت می‌شود.
+    """
+
+    def __init__(self, pool_size=10):
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._latency_stats = {}
+        self.service_settings = {
+            "gemini": {"timeout": GEMINI_TIMEOUT, "headers": {"x-goog-api-key": GEMINI_API_KEY or ""}},
+            "wordpress": {"timeout": REQUEST_TIMEOUT, "headers": {"User-Agent": "Python-Rss-To-WordPress-Script/3.4-Proxy"}, "auth": (WORDPRESS_USER, WORDPRESS_PASS)},
+            "scraper": {"timeout": REQUEST_TIMEOUT, "headers": {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36"}},
+        }
+
+    def session(self, service):
+        with self._lock:
+            if service not in self._sessions:
+                settings = self.service_settings[service]
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter); session.mount("http://", adapter)
+                session.headers.update(settings.get("headers", {}))
+                if settings.get("auth"): session.auth = settings["auth"]
+                session.hooks["response"].append(self._record_response)
+                self._sessions[service] = session
+            return self._sessions[service]
+
+    def request(self, service, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.service_settings[service]["timeout"])
+        return self.session(service).request(method, url, **kwargs)
+
+    def get(self, service, url, **kwargs):
+        return self.request(service, "GET", url, **kwargs)
+
+    def post(self, service, url, **kwargs):
+        return self.request(service, "POST", url, **kwargs)
+
+    def _record_response(self, response, *args, **kwargs):
+        host = urlparse(response.url).hostname
+        elapsed_seconds = response.elapsed.total_seconds()
+        request_body = response.request.body or b""
+        # بدنه پاسخ‌های استریمی هنوز خوانده نشده است؛ برای آن‌ها فقط Content-Length (در صورت وجود) شمرده می‌شود
+        if kwargs.get("stream"): received_bytes = int(response.headers.get("Content-Length") or 0)
+        else: received_bytes = len(response.content or b"")
+        run_metrics.record_http(host, response.status_code, elapsed_seconds, len(request_body), received_bytes)
+        with self._lock:
+            host_stats = self._latency_stats.setdefault(host, {"requests": 0, "total_latency": 0.0, "max_latency": 0.0})
+            host_stats["requests"] += 1
+            host_stats["total_latency"] += elapsed_seconds
+            host_stats["max_latency"] = max(host_stats["max_latency"], elapsed_seconds)
+
+    def connection_stats(self):
+        """تعداد درخواست و اتصال جدید هر host را از Poolهای urllib3 جمع می‌کند (اتصال مجدد = درخواست - اتصال جدید)."""
+        per_host = {}
+        with self._lock:
+            sessions = list(self._sessions.values())
+        # یک adapter برای http و https مشترک mount شده است؛ هر adapter فقط یک‌بار شمرده می‌شود
+        adapters = {id(adapter): adapter for session in sessions for adapter in session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools.get(pool_key)
+                if pool is None: continue
+                host_stats = per_host.setdefault(pool.host, {"requests": 0, "connections": 0})
+                host_stats["requests"] += pool.num_requests
+                host_stats["connections"] += pool.num_connections
+        return per_host
+
+    def log_stats(self):
+        connection_stats = self.connection_stats()
+        with self._lock:
+            latency_stats = {host: dict(host_stats) for host, host_stats in self._latency_stats.items()}
+        if not latency_stats: return
+        print("--- [HTTP] آمار اتصال‌ها به تفکیک host:")
+        for host, host_stats in sorted(latency_stats.items()):
+            pool_stats = connection_stats.get(host, {"requests": 0, "connections": 0})
+            reused_count = max(0, pool_stats["requests"] - pool_stats["connections"])
+            print(f"      {host}: {host_stats['requests']} درخواست، {pool_stats['connections']} اتصال جدید، {reused_count} استفاده مجدد، "
+                  f"تأخیر میانگین {host_stats['total_latency'] / host_stats['requests']:.2f} ثانیه، بیشینه {host_stats['max_latency']:.2f} ثانیه")
+
+http_client = HttpClient(pool_size=HTTP_POOL_SIZE)
+
+# --- موتور یکپارچه تلاش مجدد: سیاست هر endpoint، Retry-After، jitter، بودجه زمانی اجرا و Circuit Breaker ---
+class RetryableError(ValueError):
+    """خطایی که تلاش مجدد برایش معنا دارد (مثلاً پاسخ ناقص یا JSON نامعتبر) ولی نشانه قطعی سرویس نیست."""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitOpenError(ValueError):
+    pass
+
+class RetryPolicy:
+    def __init__(self, service, max_attempts, base_delay, max_delay, retry_statuses=(408, 429, 500, 502, 503, 504)):
+        self.service = service
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+
+class CircuitBreaker:
+    """
+    پس از failure_threshold خطای زیرساختی پیاپی (Timeout، قطع اتصال، 5xx) باز می‌شود و تا reset_timeout ثانیه
+    هر درخواست را بلافاصله رد می‌کند. پس از آن یک درخواست آزمایشی (half-open) اجازه عبور دارد.
+    """
+    def __init__(self, name, failure_threshold=4, reset_timeout=300):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._half_open_trial_running = False
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None: return
+            if time.time() - self._opened_at < self.reset_timeout or self._half_open_trial_running:
+                raise CircuitOpenError(f"Circuit سرویس {self.name} باز است؛ درخواست بدون ارسال رد شد.")
+            self._half_open_trial_running = True
+            print(f"--- [Circuit:{self.name}] حالت half-open: یک درخواست آزمایشی ارسال می‌شود.")
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None: print(f"--- [Circuit:{self.name}] سرویس دوباره در دسترس است؛ Circuit بسته شد.")
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._half_open_trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            self._half_open_trial_running = False
+            if self._opened_at is not None or self._consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.time()
+                print(f"!!! [Circuit:{self.name}] پس از {self._consecutive_failures} خطای پیاپی باز شد؛ تا {self.reset_timeout} ثانیه درخواستی ارسال نمی‌شود.")
+
+class RetryBudget:
+    """سقف مجموع زمان انتظار بین تلاش‌ها در کل یک اجرا یا یک چرخه daemon (بین تمام Threadها مشترک است)."""
+    def __init__(self, total_seconds):
+        self.total_seconds = total_seconds
+        self._spent_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, delay_seconds):
+        with self._lock:
+            if self._spent_seconds + delay_seconds > self.total_seconds: return False
+            self._spent_seconds += delay_seconds
+            return True
+
+    def reset(self):
+        with self._lock:
+            self._spent_seconds = 0.0
+
+RETRY_POLICIES = {
+    "gemini_title": RetryPolicy("gemini", max_attempts=3, base_delay=5, max_delay=60),
+    "gemini_caption": RetryPolicy("gemini", max_attempts=3, base_delay=5, max_delay=60),
+    "gemini_body": RetryPolicy("gemini", max_attempts=3, base_delay=10, max_delay=120),
+    "wordpress_post": RetryPolicy("wordpress", max_attempts=3, base_delay=10, max_delay=90),
+    "wordpress_media": RetryPolicy("wordpress", max_attempts=2, base_delay=5, max_delay=30),
+}
+CIRCUIT_BREAKERS = {
+    "gemini": CircuitBreaker("gemini", failure_threshold=4, reset_timeout=300),
+    "wordpress": CircuitBreaker("wordpress", failure_threshold=3, reset_timeout=300),
+}
+retry_budget = RetryBudget(RETRY_BUDGET_SECONDS)
+
+def parse_retry_after(response):
+    """مقدار هدر Retry-After (ثانیه یا تاریخ HTTP) را به ثانیه تبدیل می‌کند."""
+    if response is None: return None
+    retry_after_value = response.headers.get("Retry-After")
+    if not retry_after_value: return None
+    try:
+        return max(0.0, float(retry_after_value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(retry_after_value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _classify_failure(error, policy):
+    """خروجی: (قابل تلاش مجدد؟، خطای زیرساختی برای Circuit Breaker؟، Retry-After)"""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status_code = error.response.status_code
+        return status_code in policy.retry_statuses, status_code >= 500, parse_retry_after(error.response)
+    if isinstance(error, requests.exceptions.RequestException):
+        return True, True, None
+    if isinstance(error, RetryableError):
+        return True, False, error.retry_after
+    return False, False, None
+
+def call_with_retry(policy_name, attempt_func, label):
+    """
+    attempt_func را طبق سیاست policy_name اجرا می‌کند. فاصله تلاش‌ها با decorrelated jitter محاسبه می‌شود و
+    Retry-After سرور (برای 429/503) را رعایت می‌کند. اگر Circuit سرویس باز باشد یا بودجه زمانی اجرا تمام شود بلافاصله خطا می‌دهد.
+    """
+    policy = RETRY_POLICIES[policy_name]
+    circuit_breaker = CIRCUIT_BREAKERS[policy.service]
+    previous_delay = policy.base_delay
+    for attempt in range(1, policy.max_attempts + 1):
+        try:
+            circuit_breaker.before_call()
+        except CircuitOpenError:
+            run_metrics.record_retry_event(policy_name, "circuit_open")
+            raise
+        run_metrics.record_retry_event(policy_name, "attempts")
+        print(f"--- تلاش {attempt}/{policy.max_attempts} برای {label}...")
+        try:
+            result = attempt_func()
+        except Exception as error:
+            is_retryable, is_infrastructure_failure, retry_after = _classify_failure(error, policy)
+            # خطای غیرزیرساختی (مثل 400 یا پاسخ نامعتبر) یعنی سرویس در دسترس است
+            if is_infrastructure_failure: circuit_breaker.record_failure()
+            else: circuit_breaker.record_success()
+            if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+                print(f"!!! خطا در {label} (تلاش {attempt}): {error.response.status_code} - {error.response.text[:300]}")
+            else:
+                print(f"!!! خطا در {label} (تلاش {attempt}): {type(error).__name__} - {error}")
+            if not is_retryable:
+                if isinstance(error, ValueError): raise
+                raise ValueError(f"{label} با خطای غیرقابل تکرار ناموفق بود: {error}") from error
+            if attempt >= policy.max_attempts:
+                run_metrics.record_retry_event(policy_name, "exhausted")
+                raise ValueError(f"{label} پس از {policy.max_attempts} تلاش ناموفق بود: {error}") from error
+            # decorrelated jitter: فاصله بعدی تصادفی بین تأخیر پایه و سه برابر تأخیر قبلی است
+            delay_seconds = min(policy.max_delay, random.uniform(policy.base_delay, previous_delay * 3))
+            if retry_after is not None: delay_seconds = max(delay_seconds, retry_after)
+            previous_delay = delay_seconds
+            if not retry_budget.reserve(delay_seconds):
+                run_metrics.record_retry_event(policy_name, "budget_exhausted")
+                raise ValueError(f"{label} ناموفق بود و بودجه زمانی تلاش مجدد این اجرا ({retry_budget.total_seconds} ثانیه) تمام شده است: {error}") from error
+            print(f"--- منتظر {delay_seconds:.1f} ثانیه قبل از تلاش مجدد برای {label}{' (طبق Retry-After)' if retry_after is not None and delay_seconds == retry_after else ''}...")
+            run_metrics.record_retry_event(policy_name, "retries")
+            time.sleep(delay_seconds)
+            continue
+        circuit_breaker.record_success()
+        return result
+
+# --- زمان‌بند درخواست‌های Gemini: سهمیه RPM/TPM با token bucket و صف اولویت‌دار ---
+GEMINI_PRIORITY_BODY = 0
+GEMINI_PRIORITY_TITLE = 1
+GEMINI_PRIORITY_CAPTION = 2
+
+class TokenBucket:
+    """سطل توکن با ظرفیت capacity که در هر دقیقه به اندازه capacity پر می‌شود (مقدار می‌تواند موقتاً منفی شود)."""
+    def __init__(self, capacity_per_minute):
+        self.capacity = float(capacity_per_minute)
+        self.available = float(capacity_per_minute)
+        self._refill_rate = self.capacity / 60.0
+        self._last_refill = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self._last_refill) * self._refill_rate)
+        self._last_refill = now
+
+    def seconds_until(self, amount):
+        amount = min(amount, self.capacity)
+        if self.available >= amount: return 0.0
+        return (amount - self.available) / self._refill_rate
+
+class GeminiScheduler:
+    """
+    تمام درخواست‌های Gemini پیش از ارسال از این زمان‌بند نوبت می‌گیرند. هر درخواست باید هم در سطل RPM و هم در سطل TPM
+    (بر اساس تخمین توکن) جا داشته باشد؛ فقط سر صف اولویت‌دار (محتوا، سپس عنوان، سپس کپشن) مجاز به برداشت است.
+    با دریافت 429 هر دو سطل خالی و صف تا پایان Retry-After متوقف می‌شود تا درخواست‌های هم‌زمان پشت سر هم 429 نگیرند.
+    """
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self._request_bucket = TokenBucket(requests_per_minute)
+        self._token_bucket = TokenBucket(tokens_per_minute)
+        self._condition = threading.Condition()
+        self._waiting_heap = []
+        self._sequence = 0
+        self._paused_until = 0.0
+        self.stats = {"requests": 0, "delayed_requests": 0, "total_wait": 0.0, "max_wait": 0.0, "max_queue_depth": 0, "rate_limited": 0}
+
+    @staticmethod
+    def estimate_tokens(payload):
+        # تخمین محافظه‌کارانه: حدود ۴ کاراکتر برای هر توکن ورودی و خروجی تقریباً هم‌اندازه ورودی (ترجمه)
+        prompt_characters = sum(len(part.get("text", "")) for content in payload.get("contents", []) for part in content.get("parts", []))
+        return max(1, prompt_characters // 4) * 2
+
+    def acquire(self, estimated_tokens, priority, label):
+        with self._condition:
+            self._sequence += 1
+            ticket = (priority, self._sequence)
+            heapq.heappush(self._waiting_heap, ticket)
+            queue_depth = len(self._waiting_heap)
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], queue_depth)
+            wait_started = time.monotonic()
+            while True:
+                now = time.monotonic()
+                self._request_bucket.refill(); self._token_bucket.refill()
+                if self._waiting_heap[0] == ticket:
+                    wait_seconds = max(self._paused_until - now, self._request_bucket.seconds_until(1), self._token_bucket.seconds_until(estimated_tokens))
+                    if wait_seconds <= 0: break
+                else:
+                    wait_seconds = None
+                self._condition.wait(timeout=wait_seconds)
+            heapq.heappop(self._waiting_heap)
+            self._request_bucket.available -= 1
+            self._token_bucket.available -= min(estimated_tokens, self._token_bucket.capacity)
+            waited_seconds = time.monotonic() - wait_started
+            self.stats["requests"] += 1
+            self.stats["total_wait"] += waited_seconds
+            self.stats["max_wait"] = max(self.stats["max_wait"], waited_seconds)
+            if waited_seconds >= 0.5: self.stats["delayed_requests"] += 1
+            self._condition.notify_all()
+        if waited_seconds >= 0.5 or queue_depth > 1:
+            print(f"--- [Gemini Scheduler] {label}: {waited_seconds:.1f} ثانیه انتظار در صف (عمق صف هنگام ورود: {queue_depth}، ~{estimated_tokens} توکن)")
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        # اختلاف تخمین با مصرف واقعی (usageMetadata) از سطل TPM کم یا به آن اضافه می‌شود
+        if not actual_tokens: return
+        with self._condition:
+            self._token_bucket.refill()
+            self._token_bucket.available -= actual_tokens - min(estimated_tokens, self._token_bucket.capacity)
+            self._condition.notify_all()
+
+    def on_rate_limited(self, retry_after_seconds):
+        pause_seconds = retry_after_seconds if retry_after_seconds is not None else GEMINI_RATE_LIMIT_PAUSE_SECONDS
+        with self._condition:
+            self.stats["rate_limited"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + pause_seconds)
+            self._request_bucket.available = min(self._request_bucket.available, 0.0)
+            self._token_bucket.available = min(self._token_bucket.available, 0.0)
+            self._condition.notify_all()
+        print(f"!!! [Gemini Scheduler] 429 دریافت شد؛ صف درخواست‌های Gemini به مدت {pause_seconds:.0f} ثانیه متوقف شد.")
+
+    def log_stats(self):
+        if not self.stats["requests"]: return
+        print(f"--- [Gemini Scheduler] {self.stats['requests']} درخواست، {self.stats['delayed_requests']} درخواست با تأخیر، "
+              f"مجموع انتظار {self.stats['total_wait']:.1f} ثانیه، بیشینه انتظار {self.stats['max_wait']:.1f} ثانیه، "
+              f"بیشینه عمق صف {self.stats['max_queue_depth']}، {self.stats['rate_limited']} پاسخ 429")
+
+gemini_scheduler = GeminiScheduler(GEMINI_RPM_LIMIT, GEMINI_TPM_LIMIT)
+
+def gemini_model_url(model_name, stream=False):
+    if stream: return f"{GEMINI_API_BASE_URL}/models/{model_name}:streamGenerateContent?alt=sse"
+    return f"{GEMINI_API_BASE_URL}/models/{model_name}:generateContent"
+
+def gemini_generate(payload, priority, label, timeout=REQUEST_TIMEOUT, model_name=GEMINI_MODEL_NAME):
+    """یک درخواست generateContent پس از گرفتن نوبت از gemini_scheduler؛ خروجی JSON پاسخ است."""
+    estimated_tokens = GeminiScheduler.estimate_tokens(payload)
+    gemini_scheduler.acquire(estimated_tokens, priority, label)
+    response = http_client.post("gemini", gemini_model_url(model_name), json=payload, timeout=timeout)
+    if response.status_code == 429: gemini_scheduler.on_rate_limited(parse_retry_after(response))
+    response.raise_for_status()
+    try:
+        result = response.json()
+    except ValueError as e_json:
+        raise RetryableError(f"پاسخ JSON نامعتبر از Gemini ({label}): {e_json}")
+    gemini_scheduler.record_usage(estimated_tokens, (result.get("usageMetadata") or {}).get("totalTokenCount"))
+    run_metrics.record_gemini_usage(label, result.get("usageMetadata"))
+    return result
+
+def gemini_generate_stream(payload, priority, label, total_timeout=GEMINI_TIMEOUT, idle_timeout=GEMINI_STREAM_IDLE_TIMEOUT, model_name=GEMINI_MODEL_NAME):
+    """
+    نسخه استریمی gemini_generate با streamGenerateContent (SSE). متن به تدریج سر هم می‌شود و خروجی همان ساختار پاسخ
+    generateContent را دارد. اگر بین دو بخش بیش از idle_timeout ثانیه داده‌ای نرسد یا کل پاسخ از total_timeout بیشتر شود،
+    درخواست زودتر قطع می‌شود تا call_with_retry دوباره تلاش کند.
+    """
+    estimated_tokens = GeminiScheduler.estimate_tokens(payload)
+    gemini_scheduler.acquire(estimated_tokens, priority, label)
+    request_started = time.monotonic()
+    # timeout خواندن requests برای هر بار خواندن از سوکت اعمال می‌شود و همان timeout بیکاری بین بخش‌هاست
+    stream_api_url = gemini_model_url(model_name, stream=True)
+    response = http_client.post("gemini", stream_api_url, json=payload, stream=True, timeout=(REQUEST_TIMEOUT, idle_timeout))
+    with response:
+        if response.status_code == 429: gemini_scheduler.on_rate_limited(parse_retry_after(response))
+        response.raise_for_status()
+        text_parts, last_candidate, usage_metadata, prompt_feedback = [], {}, {}, None
+        streamed_bytes = 0
+        first_token_at = None
+        try:
+            # chunk_size=None: هر بخش chunked همان لحظه که برسد پردازش می‌شود و منتظر پر شدن بافر نمی‌ماند
+            for raw_line in response.iter_lines(chunk_size=None):
+                if time.monotonic() - request_started > total_timeout:
+                    raise requests.exceptions.Timeout(f"استریم Gemini ({label}) از سقف کل {total_timeout} ثانیه طولانی‌تر شد.")
+                streamed_bytes += len(raw_line) + 1
+                if not raw_line.startswith(b"data:"): continue
+                try:
+                    stream_chunk = json.loads(raw_line[5:].decode("utf-8"))
+                except ValueError as e_json:
+                    raise RetryableError(f"بخش نامعتبر در استریم Gemini ({label}): {e_json}")
+                prompt_feedback = stream_chunk.get("promptFeedback") or prompt_feedback
+                usage_metadata = stream_chunk.get("usageMetadata") or usage_metadata
+                for candidate in stream_chunk.get("candidates", [])[:1]:
+                    last_candidate = candidate
+                    for part in candidate.get("content", {}).get("parts", []):
+                        if part.get("text"):
+                            if first_token_at is None: first_token_at = time.monotonic()
+                            text_parts.append(part["text"])
+        except requests.exceptions.ConnectionError as e_stream:
+            print(f"!!! استریم Gemini ({label}) پس از {time.monotonic() - request_started:.1f} ثانیه متوقف ماند یا قطع شد ({len(text_parts)} بخش دریافت شده بود).")
+            raise requests.exceptions.Timeout(f"توقف استریم Gemini ({label}): {e_stream}") from e_stream
+        finally:
+            run_metrics.add_http_bytes_received(urlparse(stream_api_url).hostname, streamed_bytes)
+    finished_at = time.monotonic()
+    output_tokens = usage_metadata.get("candidatesTokenCount") or len("".join(text_parts)) // 4
+    if first_token_at is not None:
+        generation_seconds = max(finished_at - first_token_at, 1e-6)
+        print(f"--- [Gemini Stream] {label}: اولین توکن پس از {first_token_at - request_started:.1f} ثانیه، "
+              f"{output_tokens} توکن در {finished_at - request_started:.1f} ثانیه ({output_tokens / generation_seconds:.1f} توکن بر ثانیه)")
+    gemini_scheduler.record_usage(estimated_tokens, usage_metadata.get("totalTokenCount"))
+    run_metrics.record_gemini_usage(label, usage_metadata)
+    result = {"usageMetadata": usage_metadata, "candidates": []}
+    if prompt_feedback: result["promptFeedback"] = prompt_feedback
+    if last_candidate:
+        assembled_candidate = {key: value for key, value in last_candidate.items() if key != "content"}
+        if text_parts: assembled_candidate["content"] = {"parts": [{"text": "".join(text_parts)}], "role": "model"}
+        result["candidates"].append(assembled_candidate)
+    return result
+
+# --- ذخیره‌سازهای پایدار SQLite (پوشه STATE_DIR بین اجراهای workflow بازیابی می‌شود) ---
+class SqliteStore:
+    """پایه ذخیره‌سازهای SQLite در STATE_DIR؛ یک اتصال مشترک که با قفل بین Threadها استفاده می‌شود."""
+    schema = ""
+
+    def __init__(self, file_name):
+        os.makedirs(STATE_DIR, exist_ok=True)
+        self.db_path = os.path.join(STATE_DIR, file_name)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.executescript(self.schema)
+
+    def _execute(self, sql, params=()):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).fetchall()
+
+class TranslationMemory(SqliteStore):
+    """
+    حافظه ترجمه: کلید = متن مبدأ نرمال‌شده + نسخه پرامپت + مدل.
+    با رسیدن به سقف TRANSLATION_MEMORY_MAX_ENTRIES قدیمی‌ترین آیتم‌ها (بر اساس آخرین استفاده) حذف می‌شوند.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS translation_memory (
+            key TEXT PRIMARY KEY,
+            prompt_version TEXT NOT NULL,
+            model TEXT NOT NULL,
+            translated_text TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_translation_memory_last_used ON translation_memory (last_used);
+    """
+
+    def __init__(self, file_name="translation_memory.sqlite3", max_entries=5000):
+        super().__init__(file_name)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(source_text):
+        return " ".join(source_text.split())
+
+    def _make_key(self, source_text, prompt_version, model):
+        key_material = f"{model}\n{prompt_version}\n{self.normalize(source_text)}"
+        return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+    def get(self, source_text, prompt_version, model=GEMINI_MODEL_NAME):
+        key = self._make_key(source_text, prompt_version, model)
+        rows = self._execute("SELECT translated_text FROM translation_memory WHERE key = ?", (key,))
+        if not rows:
+            self.misses += 1
+            print(f"--- [حافظه ترجمه] miss ({prompt_version}) - hit: {self.hits}، miss: {self.misses}")
+            return None
+        self._execute("UPDATE translation_memory SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        print(f"--- [حافظه ترجمه] hit ({prompt_version}) - hit: {self.hits}، miss: {self.misses}")
+        return rows[0][0]
+
+    def put(self, source_text, prompt_version, translated_text, model=GEMINI_MODEL_NAME):
+        if not translated_text or not translated_text.strip(): return
+        now = time.time()
+        self._execute(
+            "INSERT OR REPLACE INTO translation_memory (key, prompt_version, model, translated_text, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+            (self._make_key(source_text, prompt_version, model), prompt_version, model, translated_text, now, now),
+        )
+        self._execute(
+            "DELETE FROM translation_memory WHERE key IN (SELECT key FROM translation_memory ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def log_stats(self):
+        total_entries = self._execute("SELECT COUNT(*) FROM translation_memory")[0][0]
+        print(f"--- [حافظه ترجمه] آمار اجرا: hit: {self.hits}، miss: {self.misses}، تعداد آیتم‌های ذخیره شده: {total_entries}/{self.max_entries}")
+
+_translation_memory = None
+_translation_memory_lock = threading.Lock()
+
+def get_translation_memory():
+    """نمونه مشترک حافظه ترجمه؛ اگر غیرفعال باشد یا باز نشود None برمی‌گرداند تا ترجمه بدون آن ادامه یابد."""
+    global _translation_memory
+    if not TRANSLATION_MEMORY_ENABLED: return None
+    with _translation_memory_lock:
+        if _translation_memory is None:
+            try:
+                _translation_memory = TranslationMemory(max_entries=TRANSLATION_MEMORY_MAX_ENTRIES)
+            except sqlite3.Error as e_tm:
+                print(f"!!! هشدار: حافظه ترجمه باز نشد و غیرفعال شد: {e_tm}")
+                return None
+        return _translation_memory
+
+_PLACEHOLDER_UUID_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+def canonicalize_placeholder_ids(html_content, original_ids=None):
+    """
+    شناسه‌های تصادفی Placeholderها را به شناسه‌های ترتیبی ثابت تبدیل می‌کند تا متن یکسان کلید یکسانی در حافظه ترجمه داشته باشد.
+    اگر original_ids داده شود (مثلاً برای متن ترجمه شده) همان ترتیب متن مبدأ استفاده می‌شود.
+    خروجی: (متن کانونی، لیست شناسه‌های اصلی به ترتیب ظهور)
+    """
+    if original_ids is None:
+        original_ids = []
+        for placeholder_id in _PLACEHOLDER_UUID_PATTERN.findall(html_content):
+            if placeholder_id not in original_ids: original_ids.append(placeholder_id)
+    for placeholder_idx, placeholder_id in enumerate(original_ids):
+        html_content = html_content.replace(placeholder_id, f"00000000-0000-0000-0000-{placeholder_idx:012d}")
+    return html_content, original_ids
+
+def restore_placeholder_ids(html_content, original_ids):
+    for placeholder_idx, placeholder_id in enumerate(original_ids):
+        html_content = html_content.replace(f"00000000-0000-0000-0000-{placeholder_idx:012d}", placeholder_id)
+    return html_content
+
+def placeholder_image_keys(placeholder_ids, placeholder_map):
+    """آدرس اصلی (بدون پراکسی) عکس هر Placeholder به ترتیب placeholder_ids؛ برای تطبیق Placeholderها بین اجراها."""
+    return [unproxy_image_url(placeholder_map[placeholder_id].get("src", "")) if placeholder_id in placeholder_map else None for placeholder_id in placeholder_ids]
+
+def remap_checkpointed_placeholders(checkpointed_body, placeholder_map):
+    """
+    Placeholderهای متن ترجمه‌شده ذخیره‌شده در checkpoint را بر اساس آدرس عکس (نه ترتیب) به Placeholderهای اجرای جاری وصل می‌کند؛
+    اگر بررسی عکس در این اجرا عکس دیگری را حذف کرده باشد، کپشن‌ها و عکس‌ها جابه‌جا نمی‌شوند. Placeholder بدون عکس متناظر حذف می‌شود.
+    """
+    current_ids_by_image = {}
+    for placeholder_id, image_key in zip(placeholder_map, placeholder_image_keys(list(placeholder_map), placeholder_map)):
+        current_ids_by_image.setdefault(image_key, []).append(placeholder_id)
+    translated_html, unmatched_canonical_ids = checkpointed_body["html"], []
+    for placeholder_idx, image_key in enumerate(checkpointed_body["images"]):
+        canonical_id = f"00000000-0000-0000-0000-{placeholder_idx:012d}"
+        matching_ids = current_ids_by_image.get(image_key)
+        if matching_ids: translated_html = translated_html.replace(canonical_id, matching_ids.pop(0))
+        else: unmatched_canonical_ids.append(canonical_id)
+    if unmatched_canonical_ids:
+        print(f"--- هشدار (Checkpoint): {len(unmatched_canonical_ids)} عکس متن ذخیره‌شده در این اجرا وجود ندارد و Placeholder آن حذف شد.")
+        soup = make_soup(translated_html)
+        for canonical_id in unmatched_canonical_ids:
+            for stale_placeholder in soup.find_all("div", id=f"placeholder-{canonical_id}"): stale_placeholder.decompose()
+        translated_html = str(soup)
+    unused_ids_count = sum(len(placeholder_ids) for placeholder_ids in current_ids_by_image.values())
+    if unused_ids_count: print(f"--- هشدار (Checkpoint): {unused_ids_count} عکس این اجرا در متن ذخیره‌شده نبود و بازگردانده نمی‌شود.")
+    return translated_html
+
+# --- سرویس مشترک تبدیل لینک‌های TradingView به لینک مستقیم عکس (og:image) ---
+class TradingViewImageCache(SqliteStore):
+    """کش پایدار لینک صفحه snapshot ← لینک og:image؛ لینک‌های snapshot هرگز تغییر نمی‌کنند پس انقضا ندارند."""
+    schema = """
+        CREATE TABLE IF NOT EXISTS tradingview_images (
+            page_url TEXT PRIMARY KEY,
+            image_url TEXT NOT NULL,
+            resolved_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, file_name="tradingview_cache.sqlite3"):
+        super().__init__(file_name)
+
+    def get(self, page_url):
+        rows = self._execute("SELECT image_url FROM tradingview_images WHERE page_url = ?", (page_url,))
+        return rows[0][0] if rows else None
+
+    def put(self, page_url, image_url):
+        self._execute("INSERT OR REPLACE INTO tradingview_images (page_url, image_url, resolved_at) VALUES (?, ?, ?)", (page_url, image_url, time.time()))
+
+_META_TAG_PATTERN = re.compile(rb'<meta\b[^>]*>', re.IGNORECASE)
+_OG_IMAGE_PROPERTY_PATTERN = re.compile(rb'''(?:property|name)\s*=\s*["']og:image["']''', re.IGNORECASE)
+_META_CONTENT_PATTERN = re.compile(rb'''content\s*=\s*["']([^"']+)["']''', re.IGNORECASE)
+
+def find_og_image_in_head(head_bytes):
+    for meta_match in _META_TAG_PATTERN.finditer(head_bytes):
+        meta_tag_bytes = meta_match.group(0)
+        if _OG_IMAGE_PROPERTY_PATTERN.search(meta_tag_bytes):
+            content_match = _META_CONTENT_PATTERN.search(meta_tag_bytes)
+            if content_match: return html.unescape(content_match.group(1).decode("utf-8", errors="replace"))
+    return None
+
+class TradingViewResolver:
+    """
+    هر صفحه snapshot فقط یک‌بار دانلود می‌شود: درخواست‌های هم‌زمان برای یک URL یک Future مشترک می‌گیرند،
+    تعداد اتصال هم‌زمان به هر host محدود است و پاسخ به صورت stream خوانده می‌شود و با دیدن og:image یا </head> قطع می‌شود.
+    """
+    MAX_HEAD_BYTES = 512 * 1024
+
+    def __init__(self, cache=None, per_host_limit=4, max_workers=8):
+        self._cache = cache
+        self._per_host_limit = per_host_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tradingview")
+        self._inflight_lock = threading.Lock()
+        self._inflight = {}
+        self._host_semaphores = {}
+
+    def _host_semaphore(self, page_url):
+        host = urlparse(page_url).netloc
+        with self._inflight_lock:
+            if host not in self._host_semaphores: self._host_semaphores[host] = threading.Semaphore(self._per_host_limit)
+            return self._host_semaphores[host]
+
+    def _fetch_og_image(self, page_url):
+        with self._host_semaphore(page_url):
+            print(f"--- [TradingView] دریافت صفحه: {page_url[:70]}...")
+            with http_client.get("scraper", page_url, stream=True) as response:
+                response.raise_for_status()
+                head_buffer = b""
+                for chunk in response.iter_content(chunk_size=8192):
+                    head_buffer += chunk
+                    image_url = find_og_image_in_head(head_buffer)
+                    if image_url or b"</head>" in head_buffer.lower() or len(head_buffer) >= self.MAX_HEAD_BYTES:
+                        break
+                else:
+                    image_url = find_og_image_in_head(head_buffer)
+        print(f"--- [TradingView] {len(head_buffer)} بایت خوانده شد؛ {'لینک مستقیم یافت شد: ' + image_url if image_url else 'og:image یافت نشد.'}")
+        if image_url and self._cache:
+            try: self._cache.put(page_url, image_url)
+            except sqlite3.Error as e_cache: print(f"!!! هشدار: ذخیره در کش TradingView ناموفق بود: {e_cache}")
+        return image_url
+
+    def _submit(self, page_url):
+        with self._inflight_lock:
+            future = self._inflight.get(page_url)
+            if future is None:
+                future = self._executor.submit(self._fetch_og_image, page_url)
+                self._inflight[page_url] = future
+                future.add_done_callback(lambda _, url=page_url: self._forget_inflight(url))
+            return future
+
+    def _forget_inflight(self, page_url):
+        with self._inflight_lock:
+            self._inflight.pop(page_url, None)
+
+    def resolve_many(self, page_urls):
+        """دیکشنری URL صفحه ← لینک مستقیم عکس (یا None در صورت خطا) برمی‌گرداند؛ صفحات کش‌نشده هم‌زمان دریافت می‌شوند."""
+        resolved = {}
+        futures = {}
+        for page_url in dict.fromkeys(page_urls):
+            cached_image_url = self._cache.get(page_url) if self._cache else None
+            if cached_image_url:
+                print(f"--- [TradingView] از کش: {page_url[:70]}...")
+                resolved[page_url] = cached_image_url
+            else:
+                futures[page_url] = self._submit(page_url)
+        for page_url, future in futures.items():
+            try:
+                resolved[page_url] = future.result()
+            except requests.exceptions.RequestException as e:
+                print(f"!!! خطا در دسترسی به صفحه TradingView ({page_url}): {e}")
+                resolved[page_url] = None
+            except Exception as e:
+                print(f"!!! خطای پیش‌بینی نشده در پردازش لینک TradingView: {e}")
+                resolved[page_url] = None
+        return resolved
+
+    def resolve(self, page_url):
+        return self.resolve_many([page_url]).get(page_url)
+
+_tradingview_resolver = None
+_tradingview_resolver_lock = threading.Lock()
+
+def get_tradingview_resolver():
+    global _tradingview_resolver
+    with _tradingview_resolver_lock:
+        if _tradingview_resolver is None:
+            tradingview_cache = None
+            try:
+                tradingview_cache = TradingViewImageCache()
+            except sqlite3.Error as e_cache:
+                print(f"!!! هشدار: کش TradingView باز نشد؛ بدون کش پایدار ادامه می‌دهیم: {e_cache}")
+            _tradingview_resolver = TradingViewResolver(cache=tradingview_cache, per_host_limit=TRADINGVIEW_PER_HOST_LIMIT)
+        return _tradingview_resolver
+
+# --- بررسی هم‌زمان عکس‌ها: سالم بودن و ابعاد واقعی از روی هدر فایل ---
+def parse_image_dimensions(head_bytes):
+    """ابعاد عکس را از چند بایت اول فایل PNG/JPEG/WebP/GIF می‌خواند. خروجی: (فرمت، عرض، ارتفاع)؛ اگر فرمت شناخته نشود None."""
+    if head_bytes.startswith(b"\x89PNG\r\n\x1a\n") and len(head_bytes) >= 24 and head_bytes[12:16] == b"IHDR":
+        return "png", int.from_bytes(head_bytes[16:20], "big"), int.from_bytes(head_bytes[20:24], "big")
+    if head_bytes[:6] in (b"GIF87a", b"GIF89a") and len(head_bytes) >= 10:
+        return "gif", int.from_bytes(head_bytes[6:8], "little"), int.from_bytes(head_bytes[8:10], "little")
+    if head_bytes[:4] == b"RIFF" and head_bytes[8:12] == b"WEBP" and len(head_bytes) >= 30:
+        chunk_type = head_bytes[12:16]
+        if chunk_type == b"VP8 ":
+            return "webp", int.from_bytes(head_bytes[26:28], "little") & 0x3FFF, int.from_bytes(head_bytes[28:30], "little") & 0x3FFF
+        if chunk_type == b"VP8L":
+            packed_size = int.from_bytes(head_bytes[21:25], "little")
+            return "webp", (packed_size & 0x3FFF) + 1, ((packed_size >> 14) & 0x3FFF) + 1
+        if chunk_type == b"VP8X":
+            return "webp", int.from_bytes(head_bytes[24:27], "little") + 1, int.from_bytes(head_bytes[27:30], "little") + 1
+        return "webp", None, None
+    if head_bytes[:2] == b"\xff\xd8":
+        # مارکرهای JPEG تا رسیدن به SOF پیمایش می‌شوند؛ اگر EXIF بزرگ‌تر از بازه خوانده‌شده باشد ابعاد نامعلوم می‌ماند
+        offset = 2
+        while offset + 9 <= len(head_bytes):
+            if head_bytes[offset] != 0xFF:
+                offset += 1
+                continue
+            marker = head_bytes[offset + 1]
+            if marker in (0xFF, 0x01) or 0xD0 <= marker <= 0xD8:
+                offset += 1 if marker == 0xFF else 2
+                continue
+            if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+                return "jpeg", int.from_bytes(head_bytes[offset + 7:offset + 9], "big"), int.from_bytes(head_bytes[offset + 5:offset + 7], "big")
+            offset += 2 + int.from_bytes(head_bytes[offset + 2:offset + 4], "big")
+        return "jpeg", None, None
+    return None
+
+class ImageProbeCache(SqliteStore):
+    """کش پایدار نتیجه بررسی عکس‌ها بر اساس URL؛ نتیجه عکس خراب پس از dead_ttl منقضی می‌شود."""
+    schema = """
+        CREATE TABLE IF NOT EXISTS image_probes (
+            image_url TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            format TEXT,
+            width INTEGER,
+            height INTEGER,
+            probed_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, file_name="image_probe_cache.sqlite3", dead_ttl=21600):
+        super().__init__(file_name)
+        self.dead_ttl = dead_ttl
+
+    def get(self, image_url):
+        rows = self._execute("SELECT status, format, width, height, probed_at FROM image_probes WHERE image_url = ?", (image_url,))
+        if not rows: return None
+        status, image_format, width, height, probed_at = rows[0]
+        if status == "dead" and time.time() - probed_at > self.dead_ttl: return None
+        return {"status": status, "format": image_format, "width": width, "height": height}
+
+    def put(self, image_url, probe_result):
+        self._execute(
+            "INSERT OR REPLACE INTO image_probes (image_url, status, format, width, height, probed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (image_url, probe_result["status"], probe_result.get("format"), probe_result.get("width"), probe_result.get("height"), time.time()),
+        )
+
+class ImageProber:
+    """
+    سالم بودن و ابعاد عکس‌ها را هم‌زمان بررسی می‌کند. از هر عکس فقط range_bytes بایت اول (با هدر Range) خوانده می‌شود.
+    وضعیت‌ها: ok (ابعاد در صورت امکان)، dead (404/410 یا پاسخ غیر عکس) و unknown (خطای شبکه، 5xx یا 4xx دیگر مثل
+    401/403 ضد hotlink؛ عکس دست‌نخورده می‌ماند و کش نمی‌شود). اگر سرور Range را نپذیرد (405/416) یک‌بار بدون Range تلاش می‌شود.
+    """
+
+    def __init__(self, cache=None, range_bytes=16384, per_host_limit=4, max_workers=8):
+        self._cache = cache
+        self._range_bytes = range_bytes
+        self._per_host_limit = per_host_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-probe")
+        self._lock = threading.Lock()
+        self._host_semaphores = {}
+
+    def _host_semaphore(self, image_url):
+        host = urlparse(image_url).netloc
+        with self._lock:
+            if host not in self._host_semaphores: self._host_semaphores[host] = threading.Semaphore(self._per_host_limit)
+            return self._host_semaphores[host]
+
+    def _fetch_head(self, image_url, use_range):
+        """(کد وضعیت، چند KB اول بدنه، Content-Type). بدون Range هم فقط range_bytes اول بدنه خوانده می‌شود."""
+        request_headers = {"Range": f"bytes=0-{self._range_bytes - 1}"} if use_range else None
+        with http_client.get("scraper", image_url, stream=True, timeout=IMAGE_PROBE_TIMEOUT, headers=request_headers) as response:
+            head_bytes = b""
+            if response.status_code < 400:
+                for chunk in response.iter_content(chunk_size=4096):
+                    head_bytes += chunk
+                    if len(head_bytes) >= self._range_bytes: break
+            return response.status_code, head_bytes, response.headers.get("Content-Type", "").lower()
+
+    def _probe(self, image_url):
+        with self._host_semaphore(image_url):
+            status_code, head_bytes, content_type = self._fetch_head(image_url, use_range=True)
+            if status_code in (405, 416): status_code, head_bytes, content_type = self._fetch_head(image_url, use_range=False)
+        if status_code in (404, 410): return {"status": "dead", "reason": f"HTTP {status_code}"}
+        if status_code >= 400: return {"status": "unknown", "reason": f"HTTP {status_code}"}
+        parsed_header = parse_image_dimensions(head_bytes)
+        if parsed_header is None:
+            # SVG و فرمت‌های دیگر با Content-Type عکس سالم حساب می‌شوند؛ صفحه HTML خطا یا فایل خالی نه
+            if content_type.startswith("image/") and head_bytes: return {"status": "ok", "format": content_type[6:].split(";")[0], "width": None, "height": None}
+            return {"status": "dead", "reason": f"پاسخ عکس نیست ({content_type or 'بدون Content-Type'})"}
+        image_format, width, height = parsed_header
+        return {"status": "ok", "format": image_format, "width": width, "height": height}
+
+    def _probe_and_cache(self, image_url):
+        try:
+            probe_result = self._probe(image_url)
+        except requests.exceptions.RequestException as e_probe:
+            probe_result = {"status": "unknown", "reason": f"{type(e_probe).__name__}: {e_probe}"}
+        if probe_result["status"] != "unknown" and self._cache:
+            try: self._cache.put(image_url, probe_result)
+            except sqlite3.Error as e_cache: print(f"!!! هشدار: ذخیره در کش بررسی عکس ناموفق بود: {e_cache}")
+        return probe_result
+
+    def probe_many(self, image_urls):
+        """دیکشنری URL عکس ← نتیجه بررسی برمی‌گرداند؛ URLهای کش‌نشده هم‌زمان بررسی می‌شوند."""
+        probe_results = {}
+        futures = {}
+        for image_url in dict.fromkeys(image_urls):
+            cached_result = self._cache.get(image_url) if self._cache else None
+            if cached_result: probe_results[image_url] = cached_result
+            else: futures[image_url] = self._executor.submit(self._probe_and_cache, image_url)
+        cached_count = len(probe_results)
+        for image_url, future in futures.items():
+            try:
+                probe_results[image_url] = future.result()
+            except Exception as e_probe:
+                print(f"!!! خطای پیش‌بینی نشده در بررسی عکس ({image_url[:70]}): {e_probe}")
+                probe_results[image_url] = {"status": "unknown", "reason": str(e_probe)}
+        print(f"--- [بررسی عکس] {len(probe_results)} عکس: {cached_count} از کش، {len(futures)} با درخواست Range.")
+        return probe_results
+
+_image_prober = None
+_image_prober_lock = threading.Lock()
+
+def get_image_prober():
+    global _image_prober
+    with _image_prober_lock:
+        if _image_prober is None:
+            image_probe_cache = None
+            try:
+                image_probe_cache = ImageProbeCache(dead_ttl=IMAGE_PROBE_DEAD_TTL)
+            except sqlite3.Error as e_cache:
+                print(f"!!! هشدار: کش بررسی عکس باز نشد؛ بدون کش پایدار ادامه می‌دهیم: {e_cache}")
+            _image_prober = ImageProber(cache=image_probe_cache, range_bytes=IMAGE_PROBE_RANGE_BYTES,
+                                        per_host_limit=IMAGE_PROBE_PER_HOST_LIMIT, max_workers=IMAGE_PROBE_MAX_WORKERS)
+        return _image_prober
+
+# --- آپلود عکس‌ها در کتابخانه رسانه وردپرس با حذف تکراری‌ها بر اساس هش محتوا ---
+class MediaLibraryIndex(SqliteStore):
+    """ایندکس محلی SHA-256 محتوای عکس ← پیوست وردپرس، و URL منبع ← SHA-256 تا عکس‌های شناخته‌شده دوباره دانلود نشوند."""
+    schema = """
+        CREATE TABLE IF NOT EXISTS media_by_hash (
+            sha256 TEXT PRIMARY KEY,
+            attachment_id INTEGER NOT NULL,
+            media_url TEXT NOT NULL,
+            uploaded_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS media_sources (
+            image_url TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, file_name="media_index.sqlite3"):
+        super().__init__(file_name)
+
+    def get_by_source(self, image_url):
+        rows = self._execute(
+            "SELECT m.attachment_id, m.media_url FROM media_sources s JOIN media_by_hash m ON m.sha256 = s.sha256 WHERE s.image_url = ?", (image_url,))
+        return {"attachment_id": rows[0][0], "media_url": rows[0][1]} if rows else None
+
+    def get_by_hash(self, sha256):
+        rows = self._execute("SELECT attachment_id, media_url FROM media_by_hash WHERE sha256 = ?", (sha256,))
+        return {"attachment_id": rows[0][0], "media_url": rows[0][1]} if rows else None
+
+    def put(self, image_url, sha256, attachment_id, media_url):
+        self._execute("INSERT OR IGNORE INTO media_by_hash (sha256, attachment_id, media_url, uploaded_at) VALUES (?, ?, ?, ?)", (sha256, attachment_id, media_url, time.time()))
+        self._execute("INSERT OR REPLACE INTO media_sources (image_url, sha256) VALUES (?, ?)", (image_url, sha256))
+
+    def add_source(self, image_url, sha256):
+        self._execute("INSERT OR REPLACE INTO media_sources (image_url, sha256) VALUES (?, ?)", (image_url, sha256))
+
+class MediaSideloader:
+    """
+    هر عکس یک‌بار دانلود و در صورت نبودن هش آن در ایندکس، با Session مشترک وردپرس به /wp/v2/media آپلود می‌شود.
+    آپلودها هم‌زمان‌اند؛ دو عکس با محتوای یکسان در یک لحظه فقط یک پیوست می‌سازند. خطا فقط همان عکس را بی‌نصیب می‌گذارد.
+    قفل هر هش پس از پایان کار آخرین Thread منتظر آن حذف می‌شود تا در حالت daemon حافظه رشد نکند.
+    """
+
+    def __init__(self, index=None, max_workers=4, max_bytes=15 * 1024 * 1024, memory_max_entries=1000):
+        self._index = index
+        self._max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sideload")
+        self._lock = threading.Lock()
+        # SHA-256 ← [قفل، تعداد Threadهایی که آن را گرفته‌اند یا منتظرش هستند]
+        self._hash_locks = {}
+        # نتیجه آپلودهای همین Process وقتی ایندکس پایدار در دسترس نیست (حداکثر memory_max_entries مورد اخیر)
+        self._uploaded_by_hash = collections.OrderedDict()
+        self._memory_max_entries = memory_max_entries
+        self.uploaded_count = 0
+        self.reused_count = 0
+
+    @contextlib.contextmanager
+    def _hash_lock(self, sha256):
+        with self._lock:
+            hash_lock_entry = self._hash_locks.setdefault(sha256, [threading.Lock(), 0])
+            hash_lock_entry[1] += 1
+        try:
+            with hash_lock_entry[0]: yield
+        finally:
+            with self._lock:
+                hash_lock_entry[1] -= 1
+                if not hash_lock_entry[1]: del self._hash_locks[sha256]
+
+    def _remember_upload(self, image_url, sha256, media):
+        # زیر قفل هش صدا زده می‌شود تا Thread بعدی با همان محتوا نتیجه را در ایندکس یا حافظه پیدا کند
+        if self._index:
+            try:
+                self._index.put(image_url, sha256, media["attachment_id"], media["media_url"])
+                return
+            except sqlite3.Error as e_index: print(f"!!! هشدار: ذخیره در ایندکس رسانه ناموفق بود: {e_index}")
+        with self._lock:
+            self._uploaded_by_hash[sha256] = media
+            self._uploaded_by_hash.move_to_end(sha256)
+            while len(self._uploaded_by_hash) > self._memory_max_entries: self._uploaded_by_hash.popitem(last=False)
+
+    def _lookup_hash(self, sha256):
+        with self._lock:
+            if sha256 in self._uploaded_by_hash: return self._uploaded_by_hash[sha256]
+        return self._index.get_by_hash(sha256) if self._index else None
+
+    def _download(self, image_url):
+        with http_client.get("scraper", image_url, stream=True) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if not content_type.startswith("image/"): raise ValueError(f"پاسخ عکس نیست ({content_type or 'بدون Content-Type'})")
+            image_bytes = b""
+            for chunk in response.iter_content(chunk_size=65536):
+                image_bytes += chunk
+                if len(image_bytes) > self._max_bytes: raise ValueError(f"حجم عکس بیش از {self._max_bytes} بایت است")
+        return image_bytes, content_type
+
+    def _upload(self, image_url, image_bytes, content_type, sha256):
+        file_name = os.path.basename(urlparse(image_url).path) or ""
+        if "." not in file_name: file_name = f"{sha256[:16]}.{content_type.split('/')[-1].split('+')[0]}"
+
+        def send_media_request():
+            response = http_client.post("wordpress", WORDPRESS_MEDIA_API_ENDPOINT, data=image_bytes, headers={
+                "Content-Type": content_type, "Content-Disposition": f'attachment; filename="{file_name}"'})
+            response.raise_for_status()
+            response_data = response.json()
+            if not response_data.get("id") or not response_data.get("source_url"):
+                raise RetryableError(f"پاسخ نامعتبر از endpoint رسانه: {str(response_data)[:200]}")
+            return response_data
+
+        response_data = call_with_retry("wordpress_media", send_media_request, f"آپلود عکس {file_name[:50]}")
+        return {"attachment_id": response_data["id"], "media_url": response_data["source_url"]}
+
+    def _sideload(self, image_url):
+        known_media = self._index.get_by_source(image_url) if self._index else None
+        if known_media:
+            with self._lock: self.reused_count += 1
+            return known_media
+        image_bytes, content_type = self._download(image_url)
+        sha256 = hashlib.sha256(image_bytes).hexdigest()
+        with self._hash_lock(sha256):
+            media = self._lookup_hash(sha256)
+            if media:
+                with self._lock: self.reused_count += 1
+                if self._index: self._index.add_source(image_url, sha256)
+                print(f"--- [رسانه] محتوای تکراری، از پیوست {media['attachment_id']} استفاده شد: {image_url[:70]}")
+                return media
+            media = self._upload(image_url, image_bytes, content_type, sha256)
+            with self._lock: self.uploaded_count += 1
+            self._remember_upload(image_url, sha256, media)
+        print(f"--- [رسانه] آپلود شد (پیوست {media['attachment_id']}، {len(image_bytes)} بایت): {image_url[:70]}")
+        return media
+
+    def sideload_many(self, image_urls):
+        """دیکشنری URL عکس ← {"attachment_id"، "media_url"} پیوست وردپرس (یا None در صورت خطا) برمی‌گرداند."""
+        futures = {image_url: self._executor.submit(self._sideload, image_url) for image_url in dict.fromkeys(image_urls)}
+        sideloaded = {}
+        for image_url, future in futures.items():
+            try:
+                sideloaded[image_url] = future.result()
+            except Exception as e_sideload:
+                print(f"!!! [رسانه] انتقال عکس به وردپرس ناموفق بود؛ لینک قبلی حفظ می‌شود ({image_url[:70]}): {type(e_sideload).__name__}: {e_sideload}")
+                sideloaded[image_url] = None
+        return sideloaded
+
+    def log_stats(self):
+        print(f"--- [رسانه] آمار اجرا: {self.uploaded_count} آپلود جدید، {self.reused_count} استفاده مجدد از پیوست موجود.")
+
+_media_sideloader = None
+_media_sideloader_lock = threading.Lock()
+
+def get_media_sideloader():
+    global _media_sideloader
+    with _media_sideloader_lock:
+        if _media_sideloader is None:
+            media_index = None
+            try:
+                media_index = MediaLibraryIndex()
+            except sqlite3.Error as e_index:
+                print(f"!!! هشدار: ایندکس رسانه باز نشد؛ تکراری‌ها فقط در همین اجرا شناخته می‌شوند: {e_index}")
+            _media_sideloader = MediaSideloader(index=media_index, max_workers=SIDELOAD_MAX_WORKERS, max_bytes=SIDELOAD_MAX_BYTES)
+        return _media_sideloader
 
 # --- توابع کمکی ---
 def generate_english_slug(title_str):
@@ -71,55 +1466,83 @@ def generate_english_slug(title_str):
     slug = re.sub(r'-+', '-', slug); slug = slug.strip('-')
     return slug if len(slug) > 4 else f"article-{uuid.uuid4().hex[:8]}"
 
-def replace_images_with_placeholders(html_content):
-    print("--- شروع جایگزینی عکس‌ها با Placeholder...")
-    sys.stdout.flush()
-    if not html_content: return "", {}
+# --- backend پارسر HTML ---
+def resolve_html_document_parser(requested_backend):
+    """
+    پارسر صفحه‌های کامل را برمی‌گرداند. lxml ساختار نادرست را متفاوت از html.parser اصلاح می‌کند (پاراگراف را دور Placeholder تصویر
+    می‌شکند، فاصله‌های لبه قطعه را حذف می‌کند و <li> باز را جور دیگری می‌بندد)، پس برای قطعه‌هایی که منتشر می‌شوند پذیرفته نمی‌شود.
+    """
+    if requested_backend == "lxml":
+        print("--- هشدار: HTML_PARSER_BACKEND=lxml برای قطعه‌های منتشرشده پذیرفته نمی‌شود؛ مثل auto فقط صفحه‌های کامل با lxml parse می‌شوند.")
+        requested_backend = "auto"
+    if requested_backend not in ("auto", "html.parser"):
+        print(f"!!! هشدار: HTML_PARSER_BACKEND='{requested_backend}' ناشناخته است؛ از auto استفاده می‌شود.")
+        requested_backend = "auto"
+    if requested_backend == "html.parser": return "html.parser"
+    try:
+        import lxml.etree  # noqa: F401
+    except ImportError:
+        return "html.parser"
+    return "lxml"
 
-    soup = BeautifulSoup(html_content, "html.parser")
-    images = soup.find_all("img")
+HTML_DOCUMENT_PARSER = resolve_html_document_parser(HTML_PARSER_BACKEND)
+
+def make_soup(markup, document=False):
+    """
+    قطعه HTML را همیشه با html.parser و صفحه کامل یا متنی که فقط get_text می‌شود (document=True) را با HTML_DOCUMENT_PARSER parse می‌کند.
+    """
+    return BeautifulSoup(markup, HTML_DOCUMENT_PARSER if document else "html.parser")
+
+def replace_images_with_placeholders_in_soup(soup):
+    """
+    نسخه درون‌درختی: تگ‌های <img> را در همان soup با Placeholder جایگزین می‌کند.
+    خود تگ‌های img (نه رشته آن‌ها) در نقشه نگه داشته می‌شوند تا هنگام بازگردانی دوباره parse نشوند.
+    """
+    print("--- شروع جایگزینی عکس‌ها با Placeholder...")
     placeholder_map = {}
     count = 0
-    for i, img in enumerate(images):
-        img_src_for_log = img.get('src', 'NO_SRC')
-        
+    for img in soup.find_all("img"):
         placeholder_uuid = str(uuid.uuid4())
-        
-        placeholder_div_str = f'<div class="image-placeholder-container" id="placeholder-{placeholder_uuid}">Image-Placeholder-{placeholder_uuid}</div>'
-        
-        placeholder_map[placeholder_uuid] = str(img) 
-        
-        img.replace_with(BeautifulSoup(placeholder_div_str, 'html.parser'))
+        placeholder_div = soup.new_tag("div", attrs={"class": "image-placeholder-container", "id": f"placeholder-{placeholder_uuid}"})
+        placeholder_div.string = f"Image-Placeholder-{placeholder_uuid}"
+        placeholder_map[placeholder_uuid] = img.replace_with(placeholder_div)
         count += 1
-        
+
     print(f"--- {count} عکس با Placeholder جایگزین شد.")
-    sys.stdout.flush()
-    return str(soup), placeholder_map
+    return placeholder_map
+
+def replace_images_with_placeholders(html_content):
+    if not html_content:
+        print("--- شروع جایگزینی عکس‌ها با Placeholder...")
+        return "", {}
+    soup = make_soup(html_content)
+    placeholder_map = replace_images_with_placeholders_in_soup(soup)
+    return str(soup), {placeholder_uuid: str(img_tag) for placeholder_uuid, img_tag in placeholder_map.items()}
     
     
-def restore_images_from_placeholders(html_content, placeholder_map):
+def restore_images_from_placeholders_in_soup(soup, placeholder_map):
     print("--- شروع بازگرداندن عکس‌ها از Placeholder...")
-    sys.stdout.flush()
     if not placeholder_map:
-        return html_content
+        return soup
 
-    soup = BeautifulSoup(html_content, 'html.parser')
     count = 0
     not_found_count = 0
 
-    for placeholder_uuid, img_tag_str in placeholder_map.items():
+    for placeholder_uuid, img_tag in placeholder_map.items():
         target_div = soup.find('div', id=f"placeholder-{placeholder_uuid}")
+        # نقشه‌های قدیمی (رشته‌ای) هم پشتیبانی می‌شوند
+        if isinstance(img_tag, str):
+            img_fragment = make_soup(img_tag)
+            img_tag = img_fragment.find("img") or img_fragment
         
         if target_div:
-            target_div.replace_with(BeautifulSoup(img_tag_str, 'html.parser'))
+            target_div.replace_with(img_tag)
             count += 1
         else:
             not_found_count += 1
             original_img_src_for_log = "نامشخص"
             try:
-                temp_soup = BeautifulSoup(img_tag_str, "html.parser")
-                img_in_tag = temp_soup.find("img")
-                if img_in_tag: original_img_src_for_log = img_in_tag.get('src', 'NO_SRC')[:70]
+                if img_tag.name == "img": original_img_src_for_log = img_tag.get('src', 'NO_SRC')[:70]
             except: pass
             print(f"--- هشدار (Restore): Placeholder با شناسه 'placeholder-{placeholder_uuid}' یافت نشد! (تصویر اصلی src: '{original_img_src_for_log}...')")
 
@@ -127,15 +1550,24 @@ def restore_images_from_placeholders(html_content, placeholder_map):
     if not_found_count > 0:
         print(f"--- هشدار جدی: {not_found_count} Placeholder در متن ترجمه شده برای بازگردانی یافت نشدند!")
         
-    sys.stdout.flush()
+    return soup
+
+def restore_images_from_placeholders(html_content, placeholder_map):
+    if not placeholder_map:
+        print("--- شروع بازگرداندن عکس‌ها از Placeholder...")
+        return html_content
+    soup = make_soup(html_content)
+    restore_images_from_placeholders_in_soup(soup, placeholder_map)
     return str(soup)
     
     
 def translate_title_with_gemini(text_title):
     print(f">>> ترجمه عنوان با Gemini ({GEMINI_MODEL_NAME}): '{text_title[:50]}...'")
-    sys.stdout.flush()
     if not text_title or text_title.isspace(): raise ValueError("متن عنوان برای ترجمه خالی است.")
-    headers = {"Content-Type": "application/json"}
+    translation_memory = get_translation_memory()
+    if translation_memory:
+        cached_title = translation_memory.get(text_title, TITLE_PROMPT_VERSION)
+        if cached_title: return cached_title
     prompt = (
         f"عنوان خبری انگلیسی زیر را به یک تیتر فارسی **بسیار جذاب، خلاقانه و بهینه شده برای موتورهای جستجو (SEO-friendly)** تبدیل کن. تیتر نهایی باید عصاره اصلی خبر را منتقل کند، کنجکاوی مخاطب علاقه‌مند به حوزه ارز دیجیتال را برانگیزد و او را به خواندن ادامه مطلب ترغیب کند. از ترجمه تحت‌اللفظی پرهیز کن و به جای آن، تیتری خلق کن که دیدگاهی نو ارائه دهد یا اهمیت کلیدی موضوع را برجسته سازد و ترجیحا از قیمت ارز در ان استفاده شود. توضیحات بی مورد و توی پرانتز نده مثلا نگو (تحلیل قیمت جدید) یا نگو (قیمت لحظه ای) .\n"
         f"**فقط و فقط تیتر فارسی ساخته شده را به صورت یک خط، بدون هیچ‌گونه توضیح اضافی، علامت نقل قول یا پیشوند بازگردان.**\n"
@@ -144,144 +1576,519 @@ def translate_title_with_gemini(text_title):
         f"تیتر فارسی جذاب و خلاقانه:"
     )
     payload = {"contents": [{"parts": [{"text": prompt}]}],"generationConfig": {"temperature": 0.4, "topP": 0.9, "topK": 50}}
-    max_retries, retry_delay = 2, 10
-    for attempt in range(max_retries + 1):
-        print(f"--- تلاش {attempt + 1}/{max_retries + 1} برای ترجمه عنوان...")
-        sys.stdout.flush()
-        try:
-            response = requests.post(f"{GEMINI_API_URL}?key={GEMINI_API_KEY}", headers=headers, json=payload, timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
-            result = response.json()
-            if result and "candidates" in result and result["candidates"] and "text" in result["candidates"][0].get("content", {}).get("parts", [{}])[0]:
-                print("<<< ترجمه عنوان با Gemini موفق بود.")
-                sys.stdout.flush(); return result["candidates"][0]["content"]["parts"][0]["text"].strip()
-            print(f"!!! پاسخ نامعتبر از Gemini (عنوان): {str(result)[:500]}"); sys.stdout.flush()
-            if attempt < max_retries: time.sleep(retry_delay); retry_delay = int(retry_delay * 1.5); continue
-            raise ValueError("پاسخ نامعتبر از API Gemini برای ترجمه عنوان دریافت شد.")
-        except requests.exceptions.Timeout: print(f"!!! Timeout در ترجمه عنوان."); sys.stdout.flush()
-        except requests.exceptions.RequestException as e:
-            print(f"!!! خطا در درخواست ترجمه عنوان: {e}"); sys.stdout.flush()
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"--- جزئیات خطای درخواست (عنوان): {e.response.status_code} - {e.response.text[:300]}"); sys.stdout.flush()
-        except Exception as e: print(f"!!! خطای پیش‌بینی نشده در ترجمه عنوان: {e}"); sys.stdout.flush(); raise
-        if attempt < max_retries: time.sleep(retry_delay); retry_delay = int(retry_delay * 1.5); continue
-    raise ValueError("ترجمه عنوان پس از تمام تلاش‌ها ناموفق بود.")
-
-def translate_with_gemini(text_to_translate):
-    print(f">>> ترجمه محتوای اصلی با Gemini ({GEMINI_MODEL_NAME}) (طول: {len(text_to_translate)} کاراکتر)...")
-    sys.stdout.flush()
+
+    def request_title_translation():
+        result = gemini_generate(payload, GEMINI_PRIORITY_TITLE, "ترجمه عنوان")
+        if result and "candidates" in result and result["candidates"] and "text" in result["candidates"][0].get("content", {}).get("parts", [{}])[0]:
+            return result["candidates"][0]["content"]["parts"][0]["text"].strip()
+        print(f"!!! پاسخ نامعتبر از Gemini (عنوان): {str(result)[:500]}")
+        raise RetryableError("پاسخ نامعتبر از API Gemini برای ترجمه عنوان دریافت شد.")
+
+    translated_title = call_with_retry("gemini_title", request_title_translation, "ترجمه عنوان")
+    print("<<< ترجمه عنوان با Gemini موفق بود.")
+    if translation_memory: translation_memory.put(text_title, TITLE_PROMPT_VERSION, translated_title)
+    return translated_title
+
+def build_body_translation_prompt(text_to_translate, chunk_position=None):
+    """
+    پرامپت بازنویسی محتوا. chunk_position=(شماره بخش از صفر، تعداد کل بخش‌ها) برای حالت بخش‌بخش است:
+    دستور خلاصه فقط به بخش اول و دستورهای نتیجه‌گیری و نظرسنجی فقط به بخش آخر داده می‌شود.
+    """
+    chunk_index, chunk_count = chunk_position if chunk_position else (0, 1)
+    is_first_chunk, is_last_chunk = chunk_index == 0, chunk_index == chunk_count - 1
+    prompt_parts = [
+        f"متن زیر یک خبر یا تحلیل در حوزه ارز دیجیتال است. من می‌خوام این متن رو به فارسی روان بازنویسی کنی به طوری که ارزش افزوده پیدا کنه و مفهوم کلی را کاملا واضح بیان کنه و طبق قوانین زیرعمل کن:\n",
+        f"1. فقط متن بازنویسی شده را برگردان و هیچ توضیح اضافی (مثل 'متن بازنویسی شده' یا موارد مشابه) اضافه نکن.\n",
+    ]
+    if is_first_chunk:
+        prompt_parts.append(
+            f"2. **دستورالعمل بسیار مهم:** پاسخ شما باید با یک خلاصه دو خطی از کل محتوای ورودی شروع شود که حداکثر 230 کاراکتر باشد. این خلاصه را **باید** داخل یک تگ div با کلاس 'summary' قرار دهی. به این شکل: <div class=\"summary\" style=\"font-weight: bold;\">متن خلاصه اینجا قرار گیرد</div>. **این تگ div باید بلافاصله بسته شود و بقیه محتوا خارج از آن قرار گیرد.** قبل از این تگ هیچ عبارت یا کاراکتر اضافی مانند 'خلاصه:' یا بک‌تیک (`) قرار نده. بعد از این تگ div، بقیه متن را طبق قوانین زیر بازنویسی کن.\n"
+        )
+    else:
+        prompt_parts.append(f"2. این متن بخش {chunk_index + 1} از {chunk_count} یک مقاله طولانی است و ادامه بخش قبلی محسوب می‌شود. **هیچ خلاصه، مقدمه یا تگ div با کلاس 'summary' اضافه نکن.**\n")
+    prompt_parts += [
+        f"قوانین مهم:\n",
+        f"3. در همه جا اصول سئو کامل رعایت بشه.\n",
+    ]
+    if is_last_chunk:
+        prompt_parts.append(
+            f"4. در انتهای متن یک نتیجه‌گیری کامل و تحلیلی ارائه کن که **نباید بیشتر از 6 خط باشد**. این نتیجه‌گیری را داخل یک تگ div با کلاس 'conclusion' قرار بده. فقط عنوان 'جمع‌بندی:' باید بولد باشد و بقیه متن باید در خط جدید و بدون بولد شروع شود. به این شکل: <div class=\"conclusion\"><strong>جمع‌بندی:</strong><br>متن نتیجه‌گیری شما در اینجا...</div>\n"
+        )
+    else:
+        prompt_parts.append("4. این بخش آخر مقاله نیست؛ **هیچ نتیجه‌گیری، جمع‌بندی یا تگ div با کلاس 'conclusion' اضافه نکن.**\n")
+    prompt_parts += [
+        f"5. **اولویت بالا:** محتوای متنی داخل *تمام* تگ‌های HTML (مانند متن داخل تگ‌های <p>, <h1>, <h2>, <li>, <a>, <figcaption>) را به فارسی روان و دقیق بازنویسی کن. این شامل محتوای متنی داخل تگ‌های تو در تو نیز می‌شود.\n",
+        f"5.1. **جایگزینی محتوای توییت:** برای تگ‌های <blockquote> با کلاس 'twitter-tweet'، **متن انگلیسی داخل تگ <p> را با بازنویسی روان فارسی آن جایگزین کن.** ساختار کلی <blockquote>، لینک‌های داخل آن (تگ <a>) و نام‌های کاربری را دست‌نخورده باقی بگذار، اما متن اصلی انگلیسی را *کاملاً حذف* کن. هرگز این بلاک را تکرار نکن.\n",
+        f"6. اصطلاحات 'bear'، 'bearish' یا مشابه را به 'فروشندگان' یا 'نزولی' و 'bull'، 'bullish' یا مشابه را به 'خریداران' یا 'صعودی' ترجمه کن.\n",
+        f"7. تاریخ‌های میلادی را به فرمت شمسی تبدیل کن (مثال: May 1, 2025 به ۱۱ اردیبهشت ۱۴۰۴).\n",
+        f"8. ساختار HTML موجود (مثل تگ‌های <p>، <div>، <b>) رو دقیقاً حفظ کن و تغییر نده.\n",
+        f"8.1. **حفظ کامل کدهای TradingView:** هر تگ <figure> یا <blockquote> که حاوی لینکی به 'tradingview.com' است را به طور کامل و **بدون هیچ‌گونه تغییری** (نه در ساختار و نه در محتوا) در خروجی حفظ کن. این بلوک‌ها نباید ترجمه یا دستکاری شوند.\n",
+    ]
+    if is_last_chunk:
+        prompt_parts.append(
+            f"9. در انتهای متن یک پاراگراف برای تحریک کاربران به نظرسنجی اضافه کن که بیشتر از یک خط نباشد.\n"
+        )
+    else:
+        prompt_parts.append("9. پاراگراف نظرسنجی یا دعوت به مشارکت اضافه نکن.\n")
+    prompt_parts += [
+        f"10. هیچ تگ HTML جدیدی اضافه نکن، مگر اینکه در متن اصلی وجود داشته باشد.\n",
+        f"11. Placeholder های تصویر (مثل <div class=\"image-placeholder-container\"...>) و تگ‌های دارای ویژگی data-k (مثل <figure data-k=\"b1\"></figure> یا <a data-k=\"a3\">) را دقیقاً همان‌طور که هستند حفظ کن: ویژگی data-k هر تگ را تغییر نده یا حذف نکن، تگ‌های خالی data-k را خالی و سر جای خود نگه دار و هیچ‌کدام را تکرار نکن.\n",
+        f"12. لینک‌ها (مقدار href در تگ <a>) و نام‌های کاربری (مثل @Steph_iscrypto) را همان‌طور که هستند نگه دار.\n",
+        f"12.1. **قانون اکید:** تحت هیچ شرایطی متن اصلی انگلیسی در کنار ترجمه فارسی در خروجی نهایی وجود نداشته باشد.\n",
+        f"13. **قانون فرمت‌بندی:** برای بولد کردن متن، همیشه از تگ‌های <strong> یا <b> استفاده کن و هرگز از **...** استفاده نکن.\n",
+        f"--- متن انگلیسی برای بازنویسی: ---\n{text_to_translate}",
+    ]
+    return "".join(prompt_parts)
+
+def translate_body_fragment_with_gemini(text_to_translate, chunk_position=None, model_name=GEMINI_MODEL_NAME):
+    """کل محتوا (chunk_position=None) یا یک بخش از آن را ترجمه می‌کند؛ پاسخ ناقص (بدون finishReason=STOP) با تلاش مجدد همان درخواست جبران می‌شود."""
+    fragment_label = f"ترجمه محتوا (بخش {chunk_position[0] + 1}/{chunk_position[1]})" if chunk_position else "ترجمه محتوا"
+    # کلید حافظه ترجمه هر بخش به جایگاه آن (اول/میانی/آخر) وابسته است چون دستورهای پرامپت متفاوت‌اند
+    prompt_version = BODY_PROMPT_VERSION
+    if chunk_position:
+        prompt_version += ":" + ("single" if chunk_position[1] == 1 else "first" if chunk_position[0] == 0 else "last" if chunk_position[0] == chunk_position[1] - 1 else "middle")
+    print(f">>> {fragment_label} با Gemini ({model_name}) (طول: {len(text_to_translate)} کاراکتر)...")
     if not text_to_translate or text_to_translate.isspace(): raise ValueError("متن محتوا برای ترجمه خالی است.")
-    headers = {"Content-Type": "application/json"}
+    translation_memory = get_translation_memory()
+    canonical_source_text, placeholder_ids = canonicalize_placeholder_ids(text_to_translate)
+    if translation_memory:
+        cached_body = translation_memory.get(canonical_source_text, prompt_version, model_name)
+        if cached_body: return restore_placeholder_ids(cached_body, placeholder_ids)
+    prompt = build_body_translation_prompt(text_to_translate, chunk_position)
+    payload = {"contents": [{"parts": [{"text": prompt}]}],"generationConfig": {"temperature": 0.4, "topP": 0.9, "topK": 50}}
+
+    def request_body_translation():
+        if GEMINI_STREAMING: result = gemini_generate_stream(payload, GEMINI_PRIORITY_BODY, fragment_label, model_name=model_name)
+        else: result = gemini_generate(payload, GEMINI_PRIORITY_BODY, fragment_label, timeout=GEMINI_TIMEOUT, model_name=model_name)
+        print("--- پاسخ Gemini (محتوا) دریافت شد؛ در حال پردازش...")
+        if not result or "candidates" not in result or not result["candidates"]:
+            feedback = result.get("promptFeedback", {}); block_reason = feedback.get("blockReason")
+            if block_reason: print(f"!!! مسدود شد (محتوا): {block_reason}. Safety: {feedback.get('safetyRatings', [])}"); raise ValueError(f"ترجمه محتوا توسط Gemini مسدود شد: {block_reason}")
+            print(f"!!! پاسخ نامعتبر از Gemini (محتوا): {str(result)[:500]}"); raise ValueError("پاسخ نامعتبر از API Gemini برای محتوا دریافت شد.")
+        candidate = result["candidates"][0]
+        response_parts = candidate.get("content", {}).get("parts") or [{}]
+        response_text = response_parts[0].get("text")
+        # فقط پاسخ با finishReason=STOP کامل است؛ استریمی که بدون finishReason بسته شود یا پاسخ MAX_TOKENS/SAFETY
+        # پس از دریافت بخشی از متن، HTML بریده‌شده است و نباید در حافظه ترجمه یا checkpoint ذخیره شود
+        finish_reason = candidate.get("finishReason")
+        if finish_reason != "STOP":
+            print(f"!!! ترجمه محتوا کامل نشد: {finish_reason or 'بدون finishReason'}. Safety Ratings: {candidate.get('safetyRatings', [])}")
+            if response_text or finish_reason is None: raise RetryableError(f"پاسخ ناقص برای {fragment_label} (دلیل: {finish_reason or 'استریم بدون finishReason بسته شد'})")
+            raise ValueError(f"ترجمه محتوا ناقص از Gemini دریافت شد (دلیل: {finish_reason})")
+        if response_text is None: print(f"!!! بدون 'text' در پاسخ Gemini (محتوا): {str(candidate)[:500]}"); raise ValueError("بدون 'text' در پاسخ Gemini (محتوا)")
+        return response_text
+
+    translated_text = call_with_retry("gemini_body", request_body_translation, fragment_label)
+    print(f"<<< {fragment_label} با Gemini موفق بود.")
+    translated_text = re.sub(r'^```html\s*', '', translated_text, flags=re.IGNORECASE); translated_text = re.sub(r'\s*```$', '', translated_text)
+    translated_text = translated_text.strip()
+    if translation_memory: translation_memory.put(canonical_source_text, prompt_version, canonicalize_placeholder_ids(translated_text, placeholder_ids)[0], model_name)
+    return translated_text
+
+def split_html_into_chunks(html_content, max_tokens):
+    """
+    محتوا را در مرز عناصر سطح بالا (<p>، <h2>، <blockquote>، <figure>، Placeholder تصویر و ...) به بخش‌هایی تقسیم می‌کند
+    که تخمین توکن هرکدام از max_tokens بیشتر نباشد. عنصری که به تنهایی بزرگ‌تر باشد یک بخش مستقل می‌شود.
+    """
+    soup = make_soup(html_content)
+    chunks, current_parts, current_tokens = [], [], 0
+    for node in soup.contents:
+        node_html = str(node)
+        node_tokens = len(node_html) // 4
+        if current_parts and current_tokens + node_tokens > max_tokens and node_html.strip():
+            chunks.append("".join(current_parts))
+            current_parts, current_tokens = [], 0
+        current_parts.append(node_html)
+        current_tokens += node_tokens
+    if current_parts: chunks.append("".join(current_parts))
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+# --- کوچک‌سازی برگشت‌پذیر HTML برای پرامپت ---
+MINIMIZER_TOKEN_ATTRIBUTE = "data-k"
+# ویژگی‌هایی که برای فهم قواعد پرامپت لازم‌اند (مثل کلاس twitter-tweet در قانون 5.1) در متن می‌مانند
+_MINIMIZER_INLINE_ATTRIBUTES = {("blockquote", "class")}
+_MINIMIZER_OPAQUE_TAGS = ("script", "style", "iframe", "video", "audio", "embed", "object", "noscript")
+
+def _is_untouchable_block(tag):
+    if tag.name in _MINIMIZER_OPAQUE_TAGS: return True
+    if tag.name == "div" and "image-placeholder-container" in (tag.get("class") or []): return True
+    # قانون 8.1 پرامپت: بلوک‌های TradingView باید بدون تغییر برگردند
+    if tag.name in ("figure", "blockquote"):
+        return bool(tag.find("a", href=re.compile(r"tradingview\.com", re.IGNORECASE)) or tag.find("img", src=re.compile(r"tradingview\.com", re.IGNORECASE)))
+    return False
+
+def minimize_markup_for_prompt(html_content):
+    """
+    بلوک‌های دست‌نخوردنی (Placeholder تصویر، TradingView، اسکریپت و embed) با یک تگ خالی <tag data-k="bN">
+    و ویژگی‌های بقیه تگ‌ها (href، style، srcset و ...) با data-k="aN" جایگزین می‌شوند تا فقط اسکلت قابل ترجمه به Gemini برسد.
+    شماره توکن‌ها ترتیبی است تا متن یکسان کلید یکسانی در حافظه ترجمه داشته باشد. خروجی: (HTML کوچک‌شده، انبار توکن‌ها)
+    """
+    soup = make_soup(html_content)
+    markup_stash = {}
+    stashed_block_ids = set()
+    for block_tag in soup.find_all(_is_untouchable_block):
+        if any(id(parent_tag) in stashed_block_ids for parent_tag in block_tag.parents): continue
+        stashed_block_ids.add(id(block_tag))
+        token = f"b{len(markup_stash) + 1}"
+        markup_stash[token] = block_tag.replace_with(soup.new_tag(block_tag.name, attrs={MINIMIZER_TOKEN_ATTRIBUTE: token}))
+    for tag in soup.find_all(True):
+        if MINIMIZER_TOKEN_ATTRIBUTE in tag.attrs or not tag.attrs: continue
+        stashed_attributes = {name: value for name, value in tag.attrs.items() if (tag.name, name) not in _MINIMIZER_INLINE_ATTRIBUTES}
+        if not stashed_attributes: continue
+        token = f"a{len(markup_stash) + 1}"
+        markup_stash[token] = stashed_attributes
+        tag.attrs = {name: value for name, value in tag.attrs.items() if name not in stashed_attributes}
+        tag[MINIMIZER_TOKEN_ATTRIBUTE] = token
+    minimized_html = str(soup)
+    print(f"--- [کوچک‌سازی پرامپت] {len(html_content)} ← {len(minimized_html)} کاراکتر "
+          f"({sum(1 for token in markup_stash if token.startswith('b'))} بلوک و {sum(1 for token in markup_stash if token.startswith('a'))} مجموعه ویژگی کنار گذاشته شد).")
+    return minimized_html, markup_stash
+
+def restore_minimized_markup(translated_html, markup_stash):
+    """
+    توکن‌های data-k را به بلوک‌ها و ویژگی‌های اصلی برمی‌گرداند. تکرار یک توکن بلوک حذف می‌شود و توکن ناشناخته کنار گذاشته می‌شود.
+    خروجی: (HTML بازگردانده، گزارش {"restored"، "missing"، "unknown"}) که missing توکن‌های گم‌شده در پاسخ Gemini است.
+    """
+    soup = make_soup(translated_html)
+    restored_tokens, unknown_tokens = set(), []
+    for tag in soup.find_all(attrs={MINIMIZER_TOKEN_ATTRIBUTE: True}):
+        token = tag[MINIMIZER_TOKEN_ATTRIBUTE]
+        del tag[MINIMIZER_TOKEN_ATTRIBUTE]
+        if token not in markup_stash or token in restored_tokens:
+            unknown_tokens.append(token)
+            if token in markup_stash and token.startswith("b"): tag.decompose()
+            continue
+        restored_tokens.add(token)
+        if token.startswith("b"): tag.replace_with(markup_stash[token])
+        else: tag.attrs = {**tag.attrs, **markup_stash[token]}
+    restore_report = {
+        "restored": len(restored_tokens),
+        "missing": [token for token in markup_stash if token not in restored_tokens],
+        "unknown": unknown_tokens,
+    }
+    if restore_report["missing"] or restore_report["unknown"]:
+        print(f"--- هشدار (کوچک‌سازی پرامپت): {restore_report['restored']}/{len(markup_stash)} توکن بازگردانده شد؛ "
+              f"گم‌شده: {', '.join(restore_report['missing']) or '-'}؛ تکراری/ناشناخته: {', '.join(restore_report['unknown']) or '-'}")
+    else:
+        print(f"--- [کوچک‌سازی پرامپت] تمام {len(markup_stash)} توکن بازگردانده شد.")
+    return str(soup), restore_report
+
+def translate_with_gemini(text_to_translate, model_name=GEMINI_MODEL_NAME):
+    if not text_to_translate or text_to_translate.isspace(): raise ValueError("متن محتوا برای ترجمه خالی است.")
+    if not PROMPT_MINIMIZER_ENABLED:
+        return validate_and_repair_translation(text_to_translate, translate_markup_with_gemini(text_to_translate, model_name), model_name)
+    minimized_html, markup_stash = minimize_markup_for_prompt(text_to_translate)
+    translated_minimized_html = validate_and_repair_translation(minimized_html, translate_markup_with_gemini(minimized_html, model_name), model_name)
+    return restore_minimized_markup(translated_minimized_html, markup_stash)[0]
+
+def translate_markup_with_gemini(text_to_translate, model_name=GEMINI_MODEL_NAME):
+    """کل متن را در یک درخواست یا (در حالت GEMINI_CHUNKED_TRANSLATION) به صورت بخش‌بخش و موازی ترجمه می‌کند."""
+    if not GEMINI_CHUNKED_TRANSLATION: return translate_body_fragment_with_gemini(text_to_translate, model_name=model_name)
+    chunks = split_html_into_chunks(text_to_translate, GEMINI_CHUNK_MAX_TOKENS)
+    if len(chunks) < 2: return translate_body_fragment_with_gemini(text_to_translate, model_name=model_name)
+    print(f">>> ترجمه بخش‌بخش محتوا: {len(chunks)} بخش (بیشینه ~{GEMINI_CHUNK_MAX_TOKENS} توکن) به صورت موازی...")
+    # هر بخش تلاش‌های مجدد خودش را دارد؛ شکست نهایی هر بخش یعنی شکست ترجمه مقاله
+    parent_log_context = current_log_context()
+    def translate_chunk_in_context(chunk, chunk_position):
+        with log_context(**parent_log_context):
+            return translate_body_fragment_with_gemini(chunk, chunk_position, model_name)
+    with ThreadPoolExecutor(max_workers=max(1, min(GEMINI_CHUNK_MAX_WORKERS, len(chunks))), thread_name_prefix="body-chunk") as executor:
+        chunk_futures = [executor.submit(translate_chunk_in_context, chunk, (chunk_idx, len(chunks))) for chunk_idx, chunk in enumerate(chunks)]
+        translated_chunks = [chunk_future.result() for chunk_future in chunk_futures]
+    print(f"<<< ترجمه {len(chunks)} بخش محتوا کامل شد و به ترتیب اصلی کنار هم قرار گرفت.")
+    return "\n".join(translated_chunks)
+
+# --- اعتبارسنجی ساختار خروجی Gemini و ترمیم موضعی ---
+_VALIDATION_TEXT_TAGS = ("p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "figcaption")
+_VALIDATION_SKELETON_TAGS = ("h1", "h2", "h3", "h4", "h5", "h6", "ul", "ol", "table", "figure", "blockquote", "iframe")
+_LATIN_IGNORED_PATTERN = re.compile(r"https?://\S+|www\.\S+|@\w+")
+_LATIN_WORD_PATTERN = re.compile(r"[A-Za-z]{3,}")
+_PERSIAN_LETTER_PATTERN = re.compile(r"[\u0600-\u06FF]")
+
+def latin_script_ratio(text):
+    """(سهم حروف لاتین از کل حروف، تعداد حروف لاتین). لینک‌ها، نام‌های کاربری و اختصارهای تمام‌بزرگ (BTC، USD، RSI) شمرده نمی‌شوند."""
+    text = _LATIN_IGNORED_PATTERN.sub(" ", text)
+    latin_letters = sum(len(word) for word in _LATIN_WORD_PATTERN.findall(text) if not word.isupper())
+    total_letters = latin_letters + len(_PERSIAN_LETTER_PATTERN.findall(text))
+    return (latin_letters / total_letters if total_letters else 0.0), latin_letters
+
+def translatable_text(text_tag):
+    """
+    متنی از عنصر که باید فارسی شده باشد. متن لینک‌ها و بلوک‌های دست‌نخوردنی (TradingView، Placeholder تصویر، embed) کنار گذاشته می‌شود
+    تا نتیجه با روشن یا خاموش بودن کوچک‌سازی پرامپت یکسان باشد.
+    """
+    text_parts = []
+    for text_node in text_tag.find_all(string=True):
+        if isinstance(text_node, Comment): continue
+        for parent in text_node.parents:
+            if parent is text_tag:
+                text_parts.append(str(text_node))
+                break
+            if parent.name == "a" or _is_untouchable_block(parent): break
+    return " ".join(text_parts)
+
+def _anchor_key(tag):
+    """شناسه بلوک دست‌نخوردنی: توکن data-k بلوک (کوچک‌سازی پرامپت) یا id Placeholder تصویر."""
+    token = tag.get(MINIMIZER_TOKEN_ATTRIBUTE)
+    if token and token.startswith("b"): return token
+    if tag.name == "div" and str(tag.get("id", "")).startswith("placeholder-"): return tag["id"]
+    return None
+
+def _count_skeleton_tags(soup):
+    skeleton_counts = {}
+    for tag in soup.find_all(_VALIDATION_SKELETON_TAGS):
+        if _anchor_key(tag): continue
+        skeleton_counts[tag.name] = skeleton_counts.get(tag.name, 0) + 1
+    return skeleton_counts
+
+def validate_translated_soup(source_soup, translated_soup):
+    """
+    خروجی Gemini را با متن مبدأ مقایسه می‌کند و لیست مشکل‌ها را برمی‌گرداند؛ هر مشکل یک dict با کلید check است:
+    anchors (بلوک گم‌شده یا تکراری)، summary و conclusion (div الزامی غایب)، skeleton (تعداد تگ‌های ساختاری متفاوت)
+    و latin (عنصرهای ترجمه‌نشده). مشکل skeleton فقط گزارش می‌شود چون محل دقیق آن قابل تشخیص نیست.
+    """
+    issues = []
+    source_anchor_keys = [_anchor_key(tag) for tag in source_soup.find_all(_anchor_key)]
+    translated_anchor_keys = [_anchor_key(tag) for tag in translated_soup.find_all(_anchor_key)]
+    missing_keys = [key for key in source_anchor_keys if key not in translated_anchor_keys]
+    duplicated_keys = sorted({key for key in translated_anchor_keys if translated_anchor_keys.count(key) > 1})
+    if missing_keys or duplicated_keys: issues.append({"check": "anchors", "missing": missing_keys, "duplicated": duplicated_keys})
+    for required_class in ("summary", "conclusion"):
+        if not translated_soup.find("div", class_=required_class): issues.append({"check": required_class})
+    source_skeleton, translated_skeleton = _count_skeleton_tags(source_soup), _count_skeleton_tags(translated_soup)
+    if source_skeleton != translated_skeleton:
+        skeleton_diff = {tag_name: (source_skeleton.get(tag_name, 0), translated_skeleton.get(tag_name, 0)) for tag_name in set(source_skeleton) | set(translated_skeleton) if source_skeleton.get(tag_name, 0) != translated_skeleton.get(tag_name, 0)}
+        issues.append({"check": "skeleton", "diff": skeleton_diff})
+    untranslated_elements = []
+    for text_tag in translated_soup.find_all(_VALIDATION_TEXT_TAGS):
+        if text_tag.find_parent(_VALIDATION_TEXT_TAGS) or text_tag.find_parent(_is_untouchable_block): continue
+        latin_ratio, latin_letters = latin_script_ratio(translatable_text(text_tag))
+        if latin_letters >= 20 and latin_ratio > OUTPUT_MAX_LATIN_RATIO: untranslated_elements.append((latin_letters, text_tag))
+    if untranslated_elements:
+        issues.append({"check": "latin", "elements": [text_tag for _, text_tag in sorted(untranslated_elements, key=lambda item: -item[0])]})
+    return issues
+
+def request_repair_from_gemini(prompt, label, model_name):
+    """یک درخواست کوچک ترمیم؛ پاسخ با کلید همان پرامپت در حافظه ترجمه نگه داشته می‌شود."""
+    translation_memory = get_translation_memory()
+    if translation_memory:
+        cached_repair = translation_memory.get(prompt, REPAIR_PROMPT_VERSION, model_name)
+        if cached_repair: return cached_repair
+    payload = {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": {"temperature": 0.3}}
+
+    def request_repair():
+        result = gemini_generate(payload, GEMINI_PRIORITY_BODY, label, model_name=model_name)
+        if result and "candidates" in result and result["candidates"] and "text" in result["candidates"][0].get("content", {}).get("parts", [{}])[0]:
+            return re.sub(r'\s*```$', '', re.sub(r'^```html\s*', '', result["candidates"][0]["content"]["parts"][0]["text"], flags=re.IGNORECASE)).strip()
+        print(f"!!! پاسخ نامعتبر از Gemini ({label}): {str(result)[:200]}")
+        raise RetryableError(f"پاسخ نامعتبر از API Gemini برای {label} دریافت شد.")
+
+    repaired_html = call_with_retry("gemini_body", request_repair, label)
+    if translation_memory: translation_memory.put(prompt, REPAIR_PROMPT_VERSION, repaired_html, model_name)
+    return repaired_html
+
+def _repair_required_div(translated_soup, required_class, model_name):
+    article_text = translated_soup.get_text(" ", strip=True)[:6000]
+    if required_class == "summary":
+        instruction = "یک خلاصه دو خطی حداکثر 230 کاراکتری از متن زیر بنویس و فقط آن را به این شکل برگردان: <div class=\"summary\" style=\"font-weight: bold;\">متن خلاصه</div>"
+    else:
+        instruction = "یک نتیجه‌گیری کامل و تحلیلی حداکثر 6 خطی برای متن زیر بنویس و فقط آن را به این شکل برگردان: <div class=\"conclusion\"><strong>جمع‌بندی:</strong><br>متن نتیجه‌گیری</div>"
+    prompt = f"{instruction}\nهیچ توضیح اضافی یا بک‌تیک اضافه نکن.\n--- متن مقاله: ---\n{article_text}"
+    reply_soup = make_soup(request_repair_from_gemini(prompt, f"ترمیم {required_class}", model_name))
+    required_div = reply_soup.find("div", class_=required_class)
+    if not required_div:
+        required_div = translated_soup.new_tag("div", attrs={"class": required_class})
+        required_div.string = reply_soup.get_text(" ", strip=True)
+    if not required_div.get_text(strip=True): return False
+    if required_class == "summary": translated_soup.insert(0, required_div)
+    else: translated_soup.append(required_div)
+    return True
+
+def _repair_untranslated_element(text_tag, model_name):
     prompt = (
-        f"متن زیر یک خبر یا تحلیل در حوزه ارز دیجیتال است. من می‌خوام این متن رو به فارسی روان بازنویسی کنی به طوری که ارزش افزوده پیدا کنه و مفهوم کلی را کاملا واضح بیان کنه و طبق قوانین زیرعمل کن:\n"
-        f"1. فقط متن بازنویسی شده را برگردان و هیچ توضیح اضافی (مثل 'متن بازنویسی شده' یا موارد مشابه) اضافه نکن.\n"
-        f"2. **دستورالعمل بسیار مهم:** پاسخ شما باید با یک خلاصه دو خطی از کل محتوای ورودی شروع شود که حداکثر 230 کاراکتر باشد. این خلاصه را **باید** داخل یک تگ div با کلاس 'summary' قرار دهی. به این شکل: <div class=\"summary\" style=\"font-weight: bold;\">متن خلاصه اینجا قرار گیرد</div>. **این تگ div باید بلافاصله بسته شود و بقیه محتوا خارج از آن قرار گیرد.** قبل از این تگ هیچ عبارت یا کاراکتر اضافی مانند 'خلاصه:' یا بک‌تیک (`) قرار نده. بعد از این تگ div، بقیه متن را طبق قوانین زیر بازنویسی کن.\n"
-        f"قوانین مهم:\n"
-        f"3. در همه جا اصول سئو کامل رعایت بشه.\n"
-        f"4. در انتهای متن یک نتیجه‌گیری کامل و تحلیلی ارائه کن که **نباید بیشتر از 6 خط باشد**. این نتیجه‌گیری را داخل یک تگ div با کلاس 'conclusion' قرار بده. فقط عنوان 'جمع‌بندی:' باید بولد باشد و بقیه متن باید در خط جدید و بدون بولد شروع شود. به این شکل: <div class=\"conclusion\"><strong>جمع‌بندی:</strong><br>متن نتیجه‌گیری شما در اینجا...</div>\n"        
-        f"5. **اولویت بالا:** محتوای متنی داخل *تمام* تگ‌های HTML (مانند متن داخل تگ‌های <p>, <h1>, <h2>, <li>, <a>, <figcaption>) را به فارسی روان و دقیق بازنویسی کن. این شامل محتوای متنی داخل تگ‌های تو در تو نیز می‌شود.\n"
-        f"5.1. **جایگزینی محتوای توییت:** برای تگ‌های <blockquote> با کلاس 'twitter-tweet'، **متن انگلیسی داخل تگ <p> را با بازنویسی روان فارسی آن جایگزین کن.** ساختار کلی <blockquote>، لینک‌های داخل آن (تگ <a>) و نام‌های کاربری را دست‌نخورده باقی بگذار، اما متن اصلی انگلیسی را *کاملاً حذف* کن. هرگز این بلاک را تکرار نکن.\n"
-        f"6. اصطلاحات 'bear'، 'bearish' یا مشابه را به 'فروشندگان' یا 'نزولی' و 'bull'، 'bullish' یا مشابه را به 'خریداران' یا 'صعودی' ترجمه کن.\n"
-        f"7. تاریخ‌های میلادی را به فرمت شمسی تبدیل کن (مثال: May 1, 2025 به ۱۱ اردیبهشت ۱۴۰۴).\n"
-        f"8. ساختار HTML موجود (مثل تگ‌های <p>، <div>، <b>) رو دقیقاً حفظ کن و تغییر نده.\n"
-        f"8.1. **حفظ کامل کدهای TradingView:** هر تگ <figure> یا <blockquote> که حاوی لینکی به 'tradingview.com' است را به طور کامل و **بدون هیچ‌گونه تغییری** (نه در ساختار و نه در محتوا) در خروجی حفظ کن. این بلوک‌ها نباید ترجمه یا دستکاری شوند.\n"
-        f"9. در انتهای متن یک پاراگراف برای تحریک کاربران به نظرسنجی اضافه کن که بیشتر از یک خط نباشد.\n"
-        f"10. هیچ تگ HTML جدیدی اضافه نکن، مگر اینکه در متن اصلی وجود داشته باشد.\n"
-        f"11. Placeholder های تصویر (مثل <div class=\"image-placeholder-container\"...>) را دقیقاً همان‌طور که هستند، بدون هیچ تغییری حفظ کن.\n"
-        f"12. لینک‌ها (مقدار href در تگ <a>) و نام‌های کاربری (مثل @Steph_iscrypto) را همان‌طور که هستند نگه دار.\n"
-        f"12.1. **قانون اکید:** تحت هیچ شرایطی متن اصلی انگلیسی در کنار ترجمه فارسی در خروجی نهایی وجود نداشته باشد.\n"
-        f"13. **قانون فرمت‌بندی:** برای بولد کردن متن، همیشه از تگ‌های <strong> یا <b> استفاده کن و هرگز از **...** استفاده نکن.\n"
-        f"--- متن انگلیسی برای بازنویسی: ---\n{text_to_translate}"
+        "قطعه HTML زیر بخشی از یک مقاله ارز دیجیتال است که به فارسی بازنویسی نشده است. متن آن را به فارسی روان بازنویسی کن. "
+        "تگ‌ها، ویژگی‌ها (از جمله data-k)، لینک‌ها و نام‌های کاربری را دقیقاً حفظ کن. 'bearish' را 'نزولی' و 'bullish' را 'صعودی' ترجمه کن. "
+        "فقط همان قطعه HTML را بدون هیچ توضیح اضافی برگردان.\n--- قطعه HTML: ---\n" + str(text_tag)
     )
-    payload = {"contents": [{"parts": [{"text": prompt}]}],"generationConfig": {"temperature": 0.4, "topP": 0.9, "topK": 50}}
-    max_retries, retry_delay = 2, 20
-    for attempt in range(max_retries + 1):
-        print(f"--- تلاش {attempt + 1}/{max_retries + 1} برای ترجمه محتوا...")
-        sys.stdout.flush()
-        try:
-            response = requests.post(f"{GEMINI_API_URL}?key={GEMINI_API_KEY}", headers=headers, json=payload, timeout=GEMINI_TIMEOUT)
-            print(f"--- پاسخ اولیه از Gemini (محتوا) دریافت شد (کد: {response.status_code})"); sys.stdout.flush()
-            if response.status_code == 429 and attempt < max_retries: print(f"!!! Rate Limit (محتوا). منتظر {retry_delay} ثانیه..."); sys.stdout.flush(); time.sleep(retry_delay); retry_delay = int(retry_delay * 1.5); continue
-            response.raise_for_status()
-            print("--- در حال پردازش پاسخ JSON از Gemini (محتوا)..."); sys.stdout.flush()
-            result = response.json()
-            if not result or "candidates" not in result or not result["candidates"]:
-                feedback = result.get("promptFeedback", {}); block_reason = feedback.get("blockReason")
-                if block_reason: print(f"!!! مسدود شد (محتوا): {block_reason}. Safety: {feedback.get('safetyRatings', [])}"); sys.stdout.flush(); raise ValueError(f"ترجمه محتوا توسط Gemini مسدود شد: {block_reason}")
-                print(f"!!! پاسخ نامعتبر از Gemini (محتوا): {str(result)[:500]}"); sys.stdout.flush(); raise ValueError("پاسخ نامعتبر از API Gemini برای محتوا دریافت شد.")
-            candidate = result["candidates"][0]
-            if "content" not in candidate or "parts" not in candidate["content"] or not candidate["content"]["parts"]:
-                finish_reason = candidate.get("finishReason", "نامشخص")
-                safety_ratings_cand_str = str(candidate.get("safetyRatings", []))
-                if finish_reason != "STOP":
-                    print(f"!!! ترجمه محتوا کامل نشد: {finish_reason}. Safety Ratings: {safety_ratings_cand_str}"); sys.stdout.flush()
-                    partial_text_node = candidate.get("content",{}).get("parts",[{}])[0]
-                    if partial_text_node and "text" in partial_text_node:
-                        partial_text = partial_text_node.get("text")
-                        if partial_text: print(f"--- هشدار: ممکن است ترجمه محتوا ناقص باشد: {partial_text[:100]}..."); sys.stdout.flush(); return partial_text.strip()
-                    raise ValueError(f"ترجمه محتوا ناقص از Gemini دریافت شد (دلیل: {finish_reason})")
-                else: print(f"!!! ساختار نامعتبر در پاسخ Gemini (محتوا، STOP): {str(candidate)[:500]}"); sys.stdout.flush(); raise ValueError("ساختار نامعتبر در پاسخ Gemini (محتوا، STOP)")
-            if "text" not in candidate["content"]["parts"][0]: print(f"!!! بدون 'text' در پاسخ Gemini (محتوا): {str(candidate)[:500]}"); sys.stdout.flush(); raise ValueError("بدون 'text' در پاسخ Gemini (محتوا)")
-            translated_text = candidate["content"]["parts"][0]["text"]
-            print("<<< ترجمه محتوای اصلی با Gemini موفق بود."); sys.stdout.flush()
-            translated_text = re.sub(r'^```html\s*', '', translated_text, flags=re.IGNORECASE); translated_text = re.sub(r'\s*```$', '', translated_text)
-            return translated_text.strip()
-        except requests.exceptions.Timeout:
-            print(f"!!! خطا: Timeout در ترجمه محتوا (تلاش {attempt + 1})."); sys.stdout.flush()
-            if attempt >= max_retries: raise ValueError(f"Timeout در API Gemini برای محتوا پس از {max_retries + 1} تلاش.")
-        except requests.exceptions.RequestException as e:
-            print(f"!!! خطا در درخواست ترجمه محتوا به API Gemini (تلاش {attempt + 1}): {e}"); sys.stdout.flush()
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"--- جزئیات خطای درخواست (محتوا): {e.response.status_code} - {e.response.text[:300]}"); sys.stdout.flush()
-            if attempt >= max_retries: raise ValueError(f"خطا در درخواست API Gemini برای محتوا پس از {max_retries + 1} تلاش: {e}")
-        except (ValueError, KeyError, json.JSONDecodeError) as e:
-            print(f"!!! خطا در پردازش پاسخ Gemini (محتوا) یا خطای داده داخلی: {e}"); sys.stdout.flush(); raise
-        except Exception as e:
-            print(f"!!! خطای پیش‌بینی نشده در یک تلاش ترجمه محتوا (تلاش {attempt + 1}): {type(e).__name__} - {e}"); sys.stdout.flush()
-            if attempt >= max_retries: raise
-        if attempt < max_retries:
-            print(f"--- منتظر ماندن برای {retry_delay} ثانیه قبل از تلاش مجدد برای ترجمه محتوا..."); sys.stdout.flush()
-            time.sleep(retry_delay); retry_delay = int(retry_delay * 1.5)
-    raise ValueError("ترجمه محتوای اصلی با Gemini پس از تمام تلاش‌ها ناموفق بود.")
-
-def translate_caption_with_gemini(text_caption):
+    replacement_tag = make_soup(request_repair_from_gemini(prompt, "ترمیم بخش ترجمه‌نشده", model_name)).find(text_tag.name)
+    if not replacement_tag or latin_script_ratio(translatable_text(replacement_tag))[0] > OUTPUT_MAX_LATIN_RATIO: return None
+    return replacement_tag
+
+def repair_translated_soup(source_soup, translated_soup, issues, model_name):
+    """
+    فقط بخش‌های خراب را ترمیم می‌کند: بلوک گم‌شده پس از نزدیک‌ترین بلوک قبلی موجود برگردانده و بلوک تکراری حذف می‌شود (بدون درخواست)،
+    خلاصه یا نتیجه‌گیری غایب جداگانه درخواست می‌شود و هر عنصر ترجمه‌نشده به تنهایی دوباره ترجمه می‌شود. خروجی: تعداد ترمیم‌ها.
+    """
+    repaired_count = 0
+    for issue in issues:
+        if issue["check"] == "anchors":
+            for duplicated_key in issue["duplicated"]:
+                for extra_tag in [tag for tag in translated_soup.find_all(_anchor_key) if _anchor_key(tag) == duplicated_key][1:]:
+                    extra_tag.decompose(); repaired_count += 1
+            source_anchors = source_soup.find_all(_anchor_key)
+            for anchor_idx, source_anchor in enumerate(source_anchors):
+                if _anchor_key(source_anchor) not in issue["missing"]: continue
+                translated_anchors = {_anchor_key(tag): tag for tag in translated_soup.find_all(_anchor_key)}
+                previous_anchor = next((translated_anchors[_anchor_key(tag)] for tag in reversed(source_anchors[:anchor_idx]) if _anchor_key(tag) in translated_anchors), None)
+                restored_anchor = copy.copy(source_anchor)
+                if previous_anchor: previous_anchor.insert_after(restored_anchor)
+                else:
+                    summary_div = translated_soup.find("div", class_="summary")
+                    if summary_div: summary_div.insert_after(restored_anchor)
+                    else: translated_soup.insert(0, restored_anchor)
+                repaired_count += 1
+        elif issue["check"] in ("summary", "conclusion"):
+            try:
+                if _repair_required_div(translated_soup, issue["check"], model_name): repaired_count += 1
+            except ValueError as e_repair: print(f"--- هشدار: ترمیم div {issue['check']} ناموفق بود: {e_repair}")
+        elif issue["check"] == "latin":
+            elements_to_repair = issue["elements"][:OUTPUT_REPAIR_MAX_FRAGMENTS]
+            if len(issue["elements"]) > len(elements_to_repair):
+                print(f"--- هشدار (اعتبارسنجی): {len(issue['elements'])} بخش ترجمه‌نشده؛ فقط {len(elements_to_repair)} بخش بزرگ‌تر ترمیم می‌شود.")
+            parent_log_context = current_log_context()
+            def repair_element_in_context(text_tag):
+                with log_context(**parent_log_context):
+                    try: return _repair_untranslated_element(text_tag, model_name)
+                    except ValueError as e_repair:
+                        print(f"--- هشدار: ترمیم بخش ترجمه‌نشده ناموفق بود: {e_repair}")
+                        return None
+            with ThreadPoolExecutor(max_workers=max(1, min(GEMINI_CHUNK_MAX_WORKERS, len(elements_to_repair))), thread_name_prefix="body-repair") as executor:
+                replacement_tags = list(executor.map(repair_element_in_context, elements_to_repair))
+            for text_tag, replacement_tag in zip(elements_to_repair, replacement_tags):
+                if replacement_tag is None: continue
+                text_tag.replace_with(replacement_tag); repaired_count += 1
+    return repaired_count
+
+def describe_validation_issue(issue):
+    if issue["check"] == "anchors": return f"بلوک گم‌شده: {', '.join(issue['missing']) or '-'}؛ تکراری: {', '.join(issue['duplicated']) or '-'}"
+    if issue["check"] == "skeleton": return "اسکلت تگ‌ها (مبدأ→ترجمه): " + "، ".join(f"{tag_name} {counts[0]}→{counts[1]}" for tag_name, counts in sorted(issue["diff"].items()))
+    if issue["check"] == "latin": return f"{len(issue['elements'])} بخش ترجمه‌نشده"
+    return f"div {issue['check']} وجود ندارد"
+
+def validate_and_repair_translation(source_html, translated_html, model_name=GEMINI_MODEL_NAME):
+    """خروجی Gemini را اعتبارسنجی و در صورت نیاز فقط بخش‌های خراب را ترمیم می‌کند؛ HTML نهایی را برمی‌گرداند."""
+    if not OUTPUT_VALIDATION_ENABLED: return translated_html
+    with run_metrics.timed("validate_translation"):
+        source_soup, translated_soup = make_soup(source_html), make_soup(translated_html)
+        issues = validate_translated_soup(source_soup, translated_soup)
+        if not issues:
+            print("--- [اعتبارسنجی خروجی] ساختار ترجمه با متن مبدأ سازگار است.")
+            return translated_html
+        for issue in issues: print(f"--- هشدار (اعتبارسنجی خروجی): {describe_validation_issue(issue)}")
+        repaired_count = repair_translated_soup(source_soup, translated_soup, issues, model_name)
+        remaining_issues = validate_translated_soup(source_soup, translated_soup)
+        print(f"--- [اعتبارسنجی خروجی] {repaired_count} ترمیم موضعی انجام شد؛ مشکل باقی‌مانده: "
+              f"{'؛ '.join(describe_validation_issue(issue) for issue in remaining_issues) or 'ندارد'}")
+        return str(translated_soup)
+
+def translate_caption_with_gemini(text_caption, consult_memory=True):
     print(f">>> ترجمه کپشن با Gemini ({GEMINI_MODEL_NAME}): '{text_caption[:30]}...'")
-    sys.stdout.flush()
     if not text_caption or text_caption.isspace(): return ""
-    headers = {"Content-Type": "application/json"}
+    translation_memory = get_translation_memory()
+    if translation_memory and consult_memory:
+        cached_caption = translation_memory.get(text_caption, CAPTION_PROMPT_VERSION)
+        if cached_caption: return cached_caption
     prompt = (f"متن HTML زیر (یک کپشن تصویر) را به فارسی روان و دقیق ترجمه کن. ساختار HTML (مثل <a>, <b>) را حفظ کن. اصطلاحات 'bearish' به 'نزولی' و 'bullish' به 'صعودی' ترجمه شوند. از کلمات 'خرس' یا 'گاو' استفاده نکن. فقط و فقط متن ترجمه شده را بازگردان و هیچ توضیح اضافی مانند 'کپشن ترجمه شده:' اضافه نکن.\nکپشن اصلی: \"{text_caption}\"\nکپشن ترجمه شده به فارسی:")
     payload = {"contents": [{"parts": [{"text": prompt}]}],"generationConfig": {"temperature": 0.3}}
-    max_retries, retry_delay = 2, 10
-    for attempt in range(max_retries + 1):
+
+    def request_caption_translation():
+        result = gemini_generate(payload, GEMINI_PRIORITY_CAPTION, "ترجمه کپشن")
+        if result and "candidates" in result and result["candidates"] and "text" in result["candidates"][0].get("content", {}).get("parts", [{}])[0]:
+            return re.sub(r'\s*```$', '', re.sub(r'^```html\s*', '', result["candidates"][0]["content"]["parts"][0]["text"], flags=re.IGNORECASE)).strip()
+        print(f"!!! پاسخ نامعتبر از Gemini (کپشن): {str(result)[:200]}")
+        raise RetryableError("پاسخ نامعتبر از API Gemini برای کپشن دریافت شد.")
+
+    try:
+        translated_caption = call_with_retry("gemini_caption", request_caption_translation, "ترجمه کپشن")
+    except ValueError as e_caption:
+        print(f"--- هشدار: ترجمه کپشن '{text_caption[:30]}...' ناموفق بود ({e_caption}). خالی برگردانده شد.")
+        return ""
+    if translation_memory: translation_memory.put(text_caption, CAPTION_PROMPT_VERSION, translated_caption)
+    return translated_caption
+
+def translate_captions_batch_with_gemini(captions_html_list):
+    """
+    تمام کپشن‌ها را در قالب یک آرایه JSON از {"id"، "html"} در یک درخواست واحد به Gemini می‌فرستد و آرایه‌ای هم‌طول برمی‌گرداند.
+    پاسخ‌ها فقط بر اساس id به ورودی‌ها نسبت داده می‌شوند (نه ترتیب)؛ آیتمی که id معتبر و یکتا ندارد یا خالی است
+    کنار گذاشته و فقط همان کپشن با translate_caption_with_gemini جداگانه ترجمه می‌شود.
+    """
+    if not captions_html_list: return []
+    results = [""] * len(captions_html_list)
+    translation_memory = get_translation_memory()
+    if translation_memory:
+        for caption_idx, caption_html in enumerate(captions_html_list):
+            results[caption_idx] = translation_memory.get(caption_html, CAPTION_PROMPT_VERSION) or ""
+    batch_indices = [caption_idx for caption_idx, cached_caption in enumerate(results) if not cached_caption]
+    if len(batch_indices) < len(captions_html_list):
+        print(f"--- {len(captions_html_list) - len(batch_indices)} کپشن از حافظه ترجمه خوانده شد.")
+    if not batch_indices: return results
+    batch_captions_html = [captions_html_list[caption_idx] for caption_idx in batch_indices]
+
+    print(f">>> ترجمه دسته‌ای {len(batch_captions_html)} کپشن با Gemini ({GEMINI_MODEL_NAME}) در یک درخواست...")
+    prompt = (
+        f"ورودی زیر یک آرایه JSON از کپشن‌های تصویر است؛ هر آیتم یک شناسه id و متن HTML کپشن (html) دارد. متن html هر آیتم را جداگانه به فارسی روان و دقیق ترجمه کن. ساختار HTML (مثل <a>, <b>) را حفظ کن. اصطلاحات 'bearish' به 'نزولی' و 'bullish' به 'صعودی' ترجمه شوند. از کلمات 'خرس' یا 'گاو' استفاده نکن.\n"
+        f"**فقط و فقط یک آرایه JSON از اشیای {{\"id\": ..., \"html\": ...}} بازگردان که برای هر id ورودی دقیقاً یک آیتم با همان id و ترجمه آن داشته باشد.** id را تغییر نده و هیچ توضیح اضافی ننویس.\n"
+        f"کپشن‌های اصلی:\n{json.dumps([{'id': batch_idx, 'html': caption_html} for batch_idx, caption_html in enumerate(batch_captions_html)], ensure_ascii=False)}"
+    )
+    payload = {"contents": [{"parts": [{"text": prompt}]}],"generationConfig": {"temperature": 0.3, "responseMimeType": "application/json"}}
+
+    def request_batch_caption_translation():
+        result = gemini_generate(payload, GEMINI_PRIORITY_CAPTION, "ترجمه دسته‌ای کپشن‌ها")
+        if not (result and "candidates" in result and result["candidates"] and "text" in result["candidates"][0].get("content", {}).get("parts", [{}])[0]):
+            print(f"!!! پاسخ نامعتبر از Gemini (کپشن دسته‌ای): {str(result)[:200]}")
+            raise RetryableError("پاسخ نامعتبر از API Gemini برای کپشن‌های دسته‌ای دریافت شد.")
+        response_text = result["candidates"][0]["content"]["parts"][0]["text"]
+        response_text = re.sub(r'\s*```$', '', re.sub(r'^```(json)?\s*', '', response_text.strip(), flags=re.IGNORECASE))
         try:
-            response = requests.post(f"{GEMINI_API_URL}?key={GEMINI_API_KEY}", headers=headers, json=payload, timeout=REQUEST_TIMEOUT)
-            response.raise_for_status(); result = response.json()
-            if result and "candidates" in result and result["candidates"] and "text" in result["candidates"][0].get("content", {}).get("parts", [{}])[0]:
-                return re.sub(r'\s*```$', '', re.sub(r'^```html\s*', '', result["candidates"][0]["content"]["parts"][0]["text"], flags=re.IGNORECASE)).strip()
-            print(f"!!! پاسخ نامعتبر از Gemini (کپشن): {str(result)[:200]}"); sys.stdout.flush()
-            if attempt < max_retries: time.sleep(retry_delay); retry_delay = int(retry_delay * 1.5); continue
-            raise ValueError("پاسخ نامعتبر از API Gemini برای کپشن دریافت شد.")
-        except requests.exceptions.Timeout:
-            print(f"!!! Timeout در ترجمه کپشن (تلاش {attempt + 1})."); sys.stdout.flush()
-            if attempt >= max_retries: raise ValueError(f"Timeout در ترجمه کپشن پس از {max_retries + 1} تلاش.")
-        except requests.exceptions.RequestException as e:
-            print(f"!!! خطا در درخواست ترجمه کپشن (تلاش {attempt + 1}): {e}"); sys.stdout.flush()
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"--- جزئیات خطای درخواست (کپشن): {e.response.status_code} - {e.response.text[:300]}"); sys.stdout.flush()
-            if attempt >= max_retries: raise ValueError(f"خطا در درخواست API Gemini برای کپشن پس از {max_retries + 1} تلاش: {e}")
-        except Exception as e:
-            print(f"!!! خطای پیش‌بینی نشده در ترجمه کپشن ({type(e).__name__}, تلاش {attempt + 1}): {e}"); sys.stdout.flush()
-            if attempt >= max_retries: raise
-        if attempt < max_retries:
-            print(f"--- منتظر {retry_delay} ثانیه قبل از تلاش مجدد (کپشن)..."); sys.stdout.flush()
-            time.sleep(retry_delay); retry_delay = int(retry_delay * 1.5)
-    print(f"--- هشدار: ترجمه کپشن '{text_caption[:30]}...' ناموفق بود. خالی برگردانده شد."); sys.stdout.flush()
-    return ""
+            parsed_captions = json.loads(response_text)
+        except json.JSONDecodeError as e_json:
+            raise RetryableError(f"پاسخ دسته‌ای کپشن JSON معتبر نیست: {e_json}")
+        if not isinstance(parsed_captions, list): raise RetryableError(f"پاسخ دسته‌ای کپشن آرایه نیست (نوع: {type(parsed_captions).__name__}).")
+        # نگاشت id به ترجمه؛ idهای تکراری قابل اعتماد نیستند و هر دو آیتم کنار گذاشته می‌شوند
+        captions_by_id, duplicated_ids = {}, set()
+        for item in parsed_captions:
+            if not isinstance(item, dict) or not isinstance(item.get("id"), int) or isinstance(item.get("id"), bool): continue
+            if item["id"] in captions_by_id: duplicated_ids.add(item["id"])
+            captions_by_id[item["id"]] = item.get("html")
+        if duplicated_ids: print(f"--- هشدار: شناسه‌های تکراری در پاسخ دسته‌ای کپشن کنار گذاشته شد: {sorted(duplicated_ids)}")
+        return {item_id: caption for item_id, caption in captions_by_id.items() if item_id not in duplicated_ids}
+
+    try:
+        translated_captions = call_with_retry("gemini_caption", request_batch_caption_translation, "ترجمه دسته‌ای کپشن‌ها")
+    except ValueError as e_batch:
+        print(f"!!! ترجمه دسته‌ای کپشن‌ها ناموفق بود: {e_batch}")
+        translated_captions = {}
+
+    missing_indices = []
+    for batch_idx, caption_idx in enumerate(batch_indices):
+        item = translated_captions.get(batch_idx)
+        if isinstance(item, str) and item.strip():
+            results[caption_idx] = item.strip()
+            if translation_memory: translation_memory.put(captions_html_list[caption_idx], CAPTION_PROMPT_VERSION, item.strip())
+        else:
+            missing_indices.append(caption_idx)
+    print(f"<<< ترجمه دسته‌ای کپشن‌ها: {len(batch_indices) - len(missing_indices)}/{len(batch_indices)} کپشن دریافت شد.")
+    if missing_indices:
+        print(f"--- {len(missing_indices)} کپشن در پاسخ دسته‌ای نبود؛ فقط همین‌ها جداگانه ترجمه می‌شوند...")
+        for caption_idx in missing_indices:
+            try:
+                results[caption_idx] = translate_caption_with_gemini(captions_html_list[caption_idx], consult_memory=False)
+            except Exception as e_single:
+                print(f"!!! ترجمه جداگانه کپشن {caption_idx + 1} ناموفق بود: {e_single}")
+    return results
 
 def remove_newsbtc_links(text):
     if not text: return ""
     return re.sub(r'<a\s+[^>]*href=["\']https?://(www\.)?newsbtc\.com[^"\']*["\'][^>]*>(.*?)</a>', r'\2', text, flags=re.IGNORECASE)
 
+def remove_links_to_domains_in_soup(soup, link_domains):
+    # معادل درون‌درختی remove_newsbtc_links برای هر دامنه: تگ <a> حذف و متن داخل آن حفظ می‌شود
+    if not link_domains: return soup
+    domains_pattern = "|".join(re.escape(link_domain) for link_domain in link_domains)
+    for link_tag in soup.find_all("a", href=re.compile(rf'^https?://([a-z0-9-]+\.)*({domains_pattern})(?=[/:?#]|$)', re.IGNORECASE)):
+        link_tag.unwrap()
+    return soup
+
 # --- تابع جدید برای پراکسی کردن تمام عکس‌ها ---
 def proxy_all_images(content_html):
     """
@@ -290,10 +2097,12 @@ def proxy_all_images(content_html):
     """
     if not content_html:
         return ""
-        
+    soup = make_soup(content_html)
+    proxy_all_images_in_soup(soup)
+    return str(soup)
+
+def proxy_all_images_in_soup(soup):
     print(">>> شروع بازنویسی آدرس تمام عکس‌ها با پراکسی شخصی...")
-    sys.stdout.flush()
-    soup = BeautifulSoup(content_html, "html.parser")
     images = soup.find_all("img")
     processed_count = 0
     
@@ -305,7 +2114,6 @@ def proxy_all_images(content_html):
             continue
 
         print(f"--- عکس {i+1} ({img_src[:70]}...) در حال بازنویسی با پراکسی شخصی...")
-        sys.stdout.flush()
         
         # URL اصلی عکس را به base64 تبدیل می‌کنیم
         encoded_url = base64.b64encode(img_src.encode('utf-8')).decode('utf-8')
@@ -319,53 +2127,122 @@ def proxy_all_images(content_html):
         processed_count += 1
             
     print(f"<<< بازنویسی آدرس‌ها تمام شد. {processed_count} عکس با موفقیت پراکسی شد.")
-    sys.stdout.flush()
-    
-    return str(soup)
+    return soup
+
+def remove_dead_image_tag(img_tag):
+    """عکس خراب را حذف می‌کند؛ لینک دور عکس و figure که دیگر عکسی ندارد (همراه کپشنش) هم حذف می‌شوند."""
+    removable_tag = img_tag
+    if img_tag.parent is not None and img_tag.parent.name == "a" and not img_tag.parent.get_text(strip=True) and len(img_tag.parent.find_all("img")) == 1:
+        removable_tag = img_tag.parent
+    parent_figure = removable_tag.find_parent("figure")
+    removable_tag.decompose()
+    if parent_figure is not None and not parent_figure.find(["img", "iframe", "video"]):
+        parent_figure.decompose()
+
+def probe_images_in_soup(soup):
+    """
+    پیش از پراکسی، تمام عکس‌ها هم‌زمان بررسی می‌شوند: عکس‌های خراب حذف یا با IMAGE_PROBE_FALLBACK_URL جایگزین
+    و ابعاد واقعی به صورت width/height روی تگ ثبت می‌شود تا مرورگر پیش از دانلود جای عکس را رزرو کند.
+    """
+    if not IMAGE_PROBE_ENABLED: return soup
+    img_tags = [img_tag for img_tag in soup.find_all("img") if img_tag.get("src", "").startswith(('http://', 'https://')) and 'arzitals.ir' not in img_tag.get("src", "")]
+    if not img_tags:
+        return soup
+    print(f">>> شروع بررسی {len(img_tags)} عکس (سالم بودن و ابعاد)...")
+    probe_results = get_image_prober().probe_many([img_tag["src"] for img_tag in img_tags])
+    dimensions_count, dead_count = 0, 0
+    for img_tag in img_tags:
+        probe_result = probe_results.get(img_tag["src"]) or {"status": "unknown"}
+        if probe_result["status"] == "dead":
+            dead_count += 1
+            print(f"--- عکس خراب ({probe_result.get('reason', 'کش')}): {img_tag['src'][:70]}")
+            if IMAGE_PROBE_FALLBACK_URL:
+                img_tag["src"] = IMAGE_PROBE_FALLBACK_URL
+                for stale_attribute in ("srcset", "sizes", "width", "height"):
+                    if img_tag.has_attr(stale_attribute): del img_tag[stale_attribute]
+            else:
+                remove_dead_image_tag(img_tag)
+            continue
+        if probe_result.get("width") and probe_result.get("height"):
+            img_tag["width"], img_tag["height"] = str(probe_result["width"]), str(probe_result["height"])
+            dimensions_count += 1
+    print(f"<<< بررسی عکس‌ها تمام شد. {dimensions_count} عکس ابعاد گرفت، {dead_count} عکس خراب {'جایگزین' if IMAGE_PROBE_FALLBACK_URL else 'حذف'} شد.")
+    return soup
+
+def unproxy_image_url(image_src):
+    """اگر لینک پراکسی شخصی باشد لینک اصلی عکس را کدگشایی می‌کند؛ در غیر این صورت همان لینک برمی‌گردد."""
+    if 'img.arzitals.ir/index.php?data=' not in image_src:
+        return image_src
+    try:
+        # استخراج پارامتر data از کوئری
+        b64_data = parse_qs(urlparse(image_src).query).get('data', [None])[0]
+        if b64_data:
+            return base64.b64decode(b64_data).decode('utf-8')
+    except Exception as e:
+        print(f"--- هشدار: خطای کدگشایی URL پراکسی: {e}")
+    return ""
+
+def apply_sideloaded_images_in_soup(soup, sideloaded_media):
+    """src عکس‌هایی که در کتابخانه رسانه آپلود شده‌اند (و لینک دور آن‌ها به همان عکس) را به پیوست وردپرس تغییر می‌دهد."""
+    if not sideloaded_media: return soup
+    for img_tag in soup.find_all("img"):
+        original_image_url = unproxy_image_url(img_tag.get("src", ""))
+        if not sideloaded_media.get(original_image_url): continue
+        media_url = sideloaded_media[original_image_url]["media_url"]
+        img_tag["src"] = media_url
+        # srcset به نسخه‌های راه دور همان عکس اشاره می‌کند
+        for stale_attribute in ("srcset", "sizes"):
+            if img_tag.has_attr(stale_attribute): del img_tag[stale_attribute]
+        if img_tag.parent is not None and img_tag.parent.name == "a" and unproxy_image_url(img_tag.parent.get("href", "")) == original_image_url:
+            img_tag.parent["href"] = media_url
+    return soup
 
 def crawl_captions(post_url):
     print(f">>> شروع کرال و ترجمه کپشن‌ها از: {post_url}")
-    sys.stdout.flush(); captions_data_list = []
+    captions_data_list = []
     try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36'}
-        response = requests.get(post_url, timeout=REQUEST_TIMEOUT, headers=headers)
-        response.raise_for_status(); soup = BeautifulSoup(response.content, "html.parser")
-        figures = soup.find_all("figure"); print(f"--- تعداد <figure> یافت شده برای بررسی کپشن: {len(figures)}"); sys.stdout.flush()
+        response = http_client.get("scraper", post_url)
+        response.raise_for_status(); soup = make_soup(response.content, document=True)
+        figures = soup.find_all("figure"); print(f"--- تعداد <figure> یافت شده برای بررسی کپشن: {len(figures)}")
+        pending_captions = []; seen_source_texts = set()
+        # تمام لینک‌های TradingView کپشن‌دار یک‌جا و هم‌زمان تصحیح می‌شوند
+        tradingview_urls = []
+        for figure_element in figures:
+            img_element = figure_element.find("img")
+            tv_candidate_src = img_element and (img_element.get("src") or img_element.get("data-src"))
+            if tv_candidate_src and figure_element.find("figcaption") and 'tradingview.com/x/' in tv_candidate_src: tradingview_urls.append(tv_candidate_src)
+        resolved_tradingview_urls = get_tradingview_resolver().resolve_many(tradingview_urls) if tradingview_urls else {}
         
         for fig_idx, figure_element in enumerate(figures):
             img_element = figure_element.find("img"); caption_element = figure_element.find("figcaption")
             if img_element and caption_element:
                 img_original_src = img_element.get("src") or img_element.get("data-src")
                 
-                # --- منطق جدید برای تصحیح لینک TradingView در همان ابتدا ---
+                # --- لینک TradingView با سرویس مشترک (کش‌شده) به لینک مستقیم .png تبدیل می‌شود ---
                 if img_original_src and 'tradingview.com/x/' in img_original_src:
-                    print(f"--- [Crawl] در حال تصحیح لینک TradingView برای کپشن: {img_original_src[:70]}...")
-                    try:
-                        tv_response = requests.get(img_original_src, timeout=REQUEST_TIMEOUT, headers=headers)
-                        tv_response.raise_for_status()
-                        tv_soup = BeautifulSoup(tv_response.content, "html.parser")
-                        meta_tag = tv_soup.find("meta", property="og:image")
-                        if meta_tag and meta_tag.get("content"):
-                            img_original_src = meta_tag["content"] # جایگزینی با لینک مستقیم .png
-                            print(f"--- [Crawl] لینک مستقیم یافت شد: {img_original_src}")
-                    except Exception as e_tv_crawl:
-                        print(f"!!! [Crawl] خطا در تصحیح لینک TradingView کپشن: {e_tv_crawl}")
-                # --- پایان منطق جدید ---
+                    img_original_src = resolved_tradingview_urls.get(img_original_src) or img_original_src
 
                 if img_original_src:
                     parsed_img_url = urlparse(unquote(img_original_src)); normalized_img_src = parsed_img_url._replace(query='').geturl()
-                    original_caption_html = str(caption_element); translated_caption_html = translate_caption_with_gemini(original_caption_html)
-                    if translated_caption_html and translated_caption_html.strip():
-                        captions_data_list.append({"image_url": normalized_img_src, "caption": translated_caption_html, "original_alt": img_element.get("alt", "")})
+                    # کپشن‌های تکراری (بر اساس متن) پیش از ترجمه حذف می‌شوند تا هزینه درخواست نداشته باشند
+                    caption_source_text = " ".join(caption_element.get_text(" ", strip=True).split())
+                    if not caption_source_text or caption_source_text in seen_source_texts: continue
+                    seen_source_texts.add(caption_source_text)
+                    pending_captions.append({"image_url": normalized_img_src, "caption_html": str(caption_element), "original_alt": img_element.get("alt", "")})
+
+        translated_captions_html = translate_captions_batch_with_gemini([item["caption_html"] for item in pending_captions])
+        for item, translated_caption_html in zip(pending_captions, translated_captions_html):
+            if translated_caption_html and translated_caption_html.strip():
+                captions_data_list.append({"image_url": item["image_url"], "caption": translated_caption_html, "original_alt": item["original_alt"]})
                         
         unique_captions = []; seen_caption_texts = set()
         for item in captions_data_list:
-            caption_text_for_uniqueness = BeautifulSoup(item['caption'], 'html.parser').get_text(strip=True)
+            caption_text_for_uniqueness = make_soup(item['caption'], document=True).get_text(strip=True)
             if caption_text_for_uniqueness and caption_text_for_uniqueness not in seen_caption_texts:
                 unique_captions.append(item); seen_caption_texts.add(caption_text_for_uniqueness)
-        print(f"<<< کرال و ترجمه کپشن‌ها تمام شد. {len(unique_captions)} کپشن منحصر به فرد یافت شد."); sys.stdout.flush()
+        print(f"<<< کرال و ترجمه کپشن‌ها تمام شد. {len(unique_captions)} کپشن منحصر به فرد یافت شد.")
         return unique_captions
-    except Exception as e_crawl: print(f"!!! خطا در کرال یا ترجمه کپشن‌ها: {e_crawl}"); sys.stdout.flush(); return []
+    except Exception as e_crawl: print(f"!!! خطا در کرال یا ترجمه کپشن‌ها: {e_crawl}"); return []
 
 # --- تابع هوشمندتر شده برای افزودن کپشن‌ها ---
 
@@ -374,12 +2251,17 @@ def crawl_captions(post_url):
 def add_captions_to_images(content_html, crawled_captions_list):
     if not crawled_captions_list or not content_html:
         return content_html
+    soup = make_soup(content_html)
+    add_captions_to_images_in_soup(soup, crawled_captions_list)
+    return str(soup)
+
+def add_captions_to_images_in_soup(soup, crawled_captions_list):
+    if not crawled_captions_list:
+        return soup
 
     print(">>> شروع افزودن کپشن‌های ترجمه شده به تصاویر محتوا...")
-    sys.stdout.flush()
-    soup = BeautifulSoup(content_html, "html.parser")
     images_in_content = soup.find_all("img")
-    print(f"--- تعداد عکس در محتوا برای بررسی کپشن: {len(images_in_content)}"); sys.stdout.flush()
+    print(f"--- تعداد عکس در محتوا برای بررسی کپشن: {len(images_in_content)}")
 
     used_caption_indices = set()
     captions_directly_added_count = 0
@@ -394,21 +2276,7 @@ def add_captions_to_images(content_html, crawled_captions_list):
         if not current_img_src:
             continue
 
-        original_src_found = ""
-        # بررسی هوشمند: اگر لینک پراکسی بود، آن را کدگشایی کن
-        if 'img.arzitals.ir/index.php?data=' in current_img_src:
-            try:
-                parsed_proxy_url = urlparse(current_img_src)
-                # استخراج پارامتر data از کوئری
-                b64_data = parse_qs(parsed_proxy_url.query).get('data', [None])[0]
-                if b64_data:
-                    original_src_found = base64.b64decode(b64_data).decode('utf-8')
-            except Exception as e:
-                print(f"--- هشدار: خطای کدگشایی URL پراکسی: {e}")
-        else:
-            # اگر لینک پراکسی نبود، همان لینک اصلی است
-             original_src_found = current_img_src
-
+        original_src_found = unproxy_image_url(current_img_src)
         if not original_src_found:
             continue
 
@@ -429,7 +2297,6 @@ def add_captions_to_images(content_html, crawled_captions_list):
 
         if matched_caption_data:
             print(f"--- افزودن کپشن کرال شده {matched_caption_original_index + 1} به عکس {img_content_idx + 1}")
-            sys.stdout.flush()
             # ... (بقیه کد تابع برای ساخت تگ figure و figcaption بدون تغییر باقی می‌ماند)
             caption_html_to_insert = matched_caption_data["caption"]
             new_figure_tag = soup.new_tag("figure", style="margin:1em auto; text-align:center; max-width:100%;")
@@ -440,7 +2307,7 @@ def add_captions_to_images(content_html, crawled_captions_list):
                 img_tag_in_content.wrap(new_figure_tag)
             if img_tag_in_content.parent != new_figure_tag:
                 new_figure_tag.append(img_tag_in_content.extract())
-            parsed_caption_for_insertion = BeautifulSoup(caption_html_to_insert, "html.parser")
+            parsed_caption_for_insertion = make_soup(caption_html_to_insert)
             final_figcaption_element = parsed_caption_for_insertion.find('figcaption')
             if not final_figcaption_element:
                 final_figcaption_element = soup.new_tag('figcaption')
@@ -464,28 +2331,23 @@ def add_captions_to_images(content_html, crawled_captions_list):
             remaining_captions_added_count += 1
     if remaining_captions_html_output.strip():
         print(f"--- افزودن {remaining_captions_added_count} کپشن باقی‌مانده به انتهای محتوا...")
-        sys.stdout.flush()
         remaining_div = soup.new_tag('div', style="text-align: center; margin-top: 20px; padding-top: 15px; border-top: 1px solid #eee;")
-        remaining_div.append(BeautifulSoup(remaining_captions_html_output, "html.parser"))
+        remaining_div.append(make_soup(remaining_captions_html_output))
         body_tag_found = soup.find('body') or soup
         body_tag_found.append(remaining_div)
 
-    print(f"<<< افزودن کپشن‌ها تمام شد. {captions_directly_added_count} به عکس‌ها اضافه شد، {remaining_captions_added_count} به انتها."); sys.stdout.flush()
-    return str(soup)
+    print(f"<<< افزودن کپشن‌ها تمام شد. {captions_directly_added_count} به عکس‌ها اضافه شد، {remaining_captions_added_count} به انتها.")
+    return soup
 
 def remove_boilerplate_sections(html_content):
     if not html_content:
         return ""
-    
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    boilerplate_keywords = [
-        'related reading',
-        'read also',
-        'see also',
-        'featured image from',
-        'disclaimer:',
-    ]
+    soup = make_soup(html_content)
+    remove_boilerplate_sections_in_soup(soup)
+    return str(soup)
+
+def remove_boilerplate_sections_in_soup(soup, boilerplate_keywords=None):
+    if boilerplate_keywords is None: boilerplate_keywords = DEFAULT_FEED_SOURCE["boilerplate_keywords"]
     
     tags_to_check = soup.find_all(['p', 'div', 'h2', 'h3'])
     
@@ -496,73 +2358,57 @@ def remove_boilerplate_sections(html_content):
             print(f"--- حذف بخش اضافی: {tag.get_text(strip=True)[:70]}...")
             tag.decompose()
             
-    return str(soup)
+    return soup
     
-def post_to_wordpress(title_for_wp, content_for_wp, original_english_title, thumbnail_url_for_plugin, source_url_for_post, status="publish"):
+def post_to_wordpress(title_for_wp, content_for_wp, original_english_title, thumbnail_url_for_plugin, source_url_for_post, status="publish", category_id=None, featured_media_id=None):
     print(f">>> شروع ارسال پست '{title_for_wp[:50]}...' به endpoint سفارشی وردپرس...")
-    sys.stdout.flush()
 
     english_slug = generate_english_slug(original_english_title)
     print(f"--- اسلاگ انگلیسی تولید شده: {english_slug}")
 
-    credentials = f"{WORDPRESS_USER}:{WORDPRESS_PASS}"
-    token = base64.b64encode(credentials.encode())
-    headers = {
-        'Authorization': f'Basic {token.decode("utf-8")}',
-        'Content-Type': 'application/json',
-        'User-Agent': 'Python-Rss-To-WordPress-Script/3.4-Proxy'
-    }
-
     post_data = {
         "title": title_for_wp,
         "content": content_for_wp,
         "slug": english_slug,
-        "category_id": 69,
+        "category_id": category_id if category_id is not None else DEFAULT_FEED_SOURCE["category_id"],
         "thumbnail_url": thumbnail_url_for_plugin if thumbnail_url_for_plugin else "",
         "source_url": source_url_for_post
     }
+    # تصویر شاخصی که قبلاً در کتابخانه رسانه آپلود شده با شناسه پیوست تنظیم می‌شود و پلاگین آن را دانلود نمی‌کند
+    if featured_media_id: post_data["featured_media"] = featured_media_id
 
     print(f"--- در حال ارسال داده به endpoint سفارشی: {WORDPRESS_CUSTOM_POST_API_ENDPOINT}")
 
-    max_retries_wp, retry_delay_wp = 2, 25
-    for attempt in range(max_retries_wp + 1):
-        print(f"--- تلاش {attempt + 1}/{max_retries_wp + 1} برای ارسال...")
+    def send_post_request():
         try:
-            response = requests.post(WORDPRESS_CUSTOM_POST_API_ENDPOINT, headers=headers, json=post_data, timeout=REQUEST_TIMEOUT * 3)
+            response = http_client.post("wordpress", WORDPRESS_CUSTOM_POST_API_ENDPOINT, json=post_data, timeout=REQUEST_TIMEOUT * 3)
             response.raise_for_status()
-            response_data = response.json()
-
-            if response.status_code == 201 and response_data.get("post_id"):
-                post_url_wp = response_data.get("url", "نامشخص")
-                print(f"<<< پست با موفقیت از طریق endpoint سفارشی ارسال شد! URL: {post_url_wp}")
-                return response_data
-            else:
-                print(f"!!! پاسخ غیرمنتظره از endpoint سفارشی: {response_data}")
-                raise ValueError("پاسخ غیرمنتظره از endpoint سفارشی دریافت شد.")
-
         except requests.exceptions.HTTPError as e_http:
-            error_text_from_server = e_http.response.text
-            error_message_detail = f"خطای HTTP در ارسال به endpoint سفارشی (کد {e_http.response.status_code}): {error_text_from_server[:500]}"
-            print(f"!!! {error_message_detail}")
-            if e_http.response.status_code == 404:
+            if e_http.response is not None and e_http.response.status_code == 404:
                 print("!!! خطای 404: Endpoint سفارشی یافت نشد. آیا پلاگین 'My Custom Post Creator' در وردپرس نصب و فعال است؟")
-            if attempt < max_retries_wp: time.sleep(retry_delay_wp); retry_delay_wp = int(retry_delay_wp * 1.5); continue
-            raise ValueError(error_message_detail)
-        except Exception as e:
-            print(f"!!! خطای ناشناخته در ارسال به endpoint سفarشی: {e}")
-            if attempt < max_retries_wp: time.sleep(retry_delay_wp); retry_delay_wp = int(retry_delay_wp * 1.5); continue
-            raise ValueError(f"خطای ناشناخته پس از تلاش‌های مکرر: {e}")
+            raise
+        try:
+            response_data = response.json()
+        except ValueError:
+            raise RetryableError(f"پاسخ JSON نامعتبر از endpoint سفارشی: {response.text[:300]}")
+        if response.status_code == 201 and response_data.get("post_id"):
+            return response_data
+        print(f"!!! پاسخ غیرمنتظره از endpoint سفارشی: {response_data}")
+        raise RetryableError("پاسخ غیرمنتظره از endpoint سفارشی دریافت شد.")
 
-    raise ValueError(f"ارسال پست '{title_for_wp[:50]}...' پس از تمام تلاش‌ها ناموفق بود.")
+    response_data = call_with_retry("wordpress_post", send_post_request, f"ارسال پست '{title_for_wp[:50]}...'")
+    print(f"<<< پست با موفقیت از طریق endpoint سفارشی ارسال شد! URL: {response_data.get('url', 'نامشخص')}")
+    return response_data
 
 def resolve_tradingview_links(html_content):
     if not html_content:
         return ""
+    soup = make_soup(html_content)
+    resolve_tradingview_links_in_soup(soup)
+    return str(soup)
 
+def resolve_tradingview_links_in_soup(soup):
     print(">>> شروع پردازش و تصحیح لینک‌های تصاویر TradingView...")
-    sys.stdout.flush()
-
-    soup = BeautifulSoup(html_content, "html.parser")
 
     targets_to_process = []
     chart_links = soup.find_all("a", href=re.compile(r"https?://(www\.)?tradingview\.com/x/"))
@@ -582,56 +2428,113 @@ def resolve_tradingview_links(html_content):
 
     if not targets_to_process:
         print("--- هیچ لینک TradingView برای تصحیح یافت نشد.")
-        return str(soup)
+        return soup
 
+    resolved_image_urls = get_tradingview_resolver().resolve_many([target['page_url'] for target in targets_to_process])
     resolved_count = 0
     for target in targets_to_process:
-        img_tag_to_modify = target['img_tag']
-        page_url_to_scrape = target['page_url']
-        link_tag_to_modify = target.get('link_tag')
-
-        print(f"--- در حال بررسی لینک TradingView: {page_url_to_scrape[:70]}...")
-        try:
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36'}
-            response = requests.get(page_url_to_scrape, timeout=REQUEST_TIMEOUT, headers=headers)
-            response.raise_for_status()
-
-            page_soup = BeautifulSoup(response.content, "html.parser")
-            meta_tag = page_soup.find("meta", property="og:image")
-
-            if meta_tag and meta_tag.get("content"):
-                direct_image_url = meta_tag["content"]
-                print(f"--- لینک مستقیم یافت شد: {direct_image_url}")
-
-                img_tag_to_modify['src'] = direct_image_url
-                resolved_count += 1
-
-                if link_tag_to_modify:
-                    link_tag_to_modify['href'] = direct_image_url
-        except requests.exceptions.RequestException as e:
-            print(f"!!! خطا در دسترسی به صفحه TradingView ({page_url_to_scrape}): {e}")
-        except Exception as e:
-            print(f"!!! خطای پیش‌بینی نشده در پردازش لینک TradingView: {e}")
+        direct_image_url = resolved_image_urls.get(target['page_url'])
+        if not direct_image_url: continue
+        target['img_tag']['src'] = direct_image_url
+        if target.get('link_tag'):
+            target['link_tag']['href'] = direct_image_url
+        resolved_count += 1
 
     print(f"<<< پردازش لینک‌های TradingView تمام شد. {resolved_count}/{len(targets_to_process)} لینک با موفقیت تصحیح شد.")
-    sys.stdout.flush()
 
-    return str(soup)
+    return soup
+
+# --- دریافت شرطی فید RSS با ETag/Last-Modified ---
+def load_feed_state():
+    feed_state_path = os.path.join(STATE_DIR, FEED_STATE_FILE)
+    try:
+        with open(feed_state_path, "r", encoding="utf-8") as feed_state_file:
+            return json.load(feed_state_file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e_state:
+        print(f"!!! هشدار: فایل وضعیت فید ({feed_state_path}) خوانده نشد و نادیده گرفته شد: {e_state}")
+        return {}
+
+def save_feed_state(feed_state):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    feed_state_path = os.path.join(STATE_DIR, FEED_STATE_FILE)
+    temp_path = f"{feed_state_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as feed_state_file:
+        json.dump(feed_state, feed_state_file, ensure_ascii=False, indent=2)
+    os.replace(temp_path, feed_state_path)
+
+def fetch_feed_conditionally(feed_url, feed_validators):
+    """
+    فید را با If-None-Match/If-Modified-Since دریافت می‌کند. در صورت 304 مقدار (None, validators قبلی) و در غیر این صورت
+    (فید تجزیه شده، validators جدید) برمی‌گرداند. validators جدید فقط پس از یک اجرای موفق باید ذخیره شوند.
+    """
+    conditional_headers = {}
+    if feed_validators.get("etag"): conditional_headers["If-None-Match"] = feed_validators["etag"]
+    if feed_validators.get("modified"): conditional_headers["If-Modified-Since"] = feed_validators["modified"]
+    response = http_client.get("scraper", feed_url, headers=conditional_headers)
+    if response.status_code == 304:
+        return None, feed_validators
+    response.raise_for_status()
+    new_validators = {"etag": response.headers.get("ETag"), "modified": response.headers.get("Last-Modified")}
+    response_headers = dict(response.headers); response_headers.setdefault("content-location", feed_url)
+    print(f"--- فید دریافت شد ({len(response.content)} بایت، ETag: {new_validators['etag'] or 'ندارد'}، Last-Modified: {new_validators['modified'] or 'ندارد'}).")
+    return feedparser.parse(response.content, response_headers=response_headers), new_validators
+
+def fetch_feed_sources(feed_sources, feed_state):
+    """
+    فید تمام منابع را هم‌زمان و شرطی دریافت می‌کند. هر ورودی با نام منبعش (feed_source) علامت می‌خورد.
+    خطای یک منبع بقیه را متوقف نمی‌کند. خروجی: لیست {"source", "parsed", "validators", "error"} به ترتیب منابع
+    که در آن parsed برای 304 برابر None است.
+    """
+    def fetch_one_source(feed_source):
+        fetch_result = {"source": feed_source, "parsed": None, "validators": None, "error": None}
+        try:
+            print(f"--- دریافت فید منبع '{feed_source['name']}' ({feed_source['feed_url']})...")
+            fetch_result["parsed"], fetch_result["validators"] = fetch_feed_conditionally(feed_source["feed_url"], feed_state.get(feed_source["feed_url"], {}))
+            if fetch_result["parsed"] is None:
+                print(f"--- فید منبع '{feed_source['name']}' تغییری نکرده است (304 Not Modified).")
+                return fetch_result
+            if fetch_result["parsed"].bozo: print(f"--- هشدار در تجزیه فید منبع '{feed_source['name']}': {fetch_result['parsed'].bozo_exception}")
+            for feed_entry in fetch_result["parsed"].entries: feed_entry["feed_source"] = feed_source["name"]
+        except Exception as e_fetch:
+            fetch_result["error"] = f"{type(e_fetch).__name__}: {e_fetch}"
+            print(f"!!! دریافت فید منبع '{feed_source['name']}' ناموفق بود: {fetch_result['error']}")
+        return fetch_result
+
+    if len(feed_sources) == 1: return [fetch_one_source(feed_sources[0])]
+    with ThreadPoolExecutor(max_workers=max(1, min(FEED_FETCH_MAX_WORKERS, len(feed_sources))), thread_name_prefix="feed") as executor:
+        return list(executor.map(fetch_one_source, feed_sources))
+
+def merge_feed_entries(fetch_results):
+    """ورودی‌های تمام منابع را از جدید به قدیم (بر اساس تاریخ انتشار) مرتب و بر اساس لینک یکتا می‌کند."""
+    merged_entries, seen_links = [], set()
+    for fetch_result in fetch_results:
+        for feed_entry in (fetch_result["parsed"].entries if fetch_result["parsed"] else []):
+            entry_link = getattr(feed_entry, 'link', None)
+            if entry_link and entry_link in seen_links: continue
+            if entry_link: seen_links.add(entry_link)
+            merged_entries.append(feed_entry)
+    # sort پایدار است؛ ورودی‌های بدون تاریخ ترتیب فید خودشان را حفظ می‌کنند
+    merged_entries.sort(key=lambda feed_entry: tuple(feed_entry.get("published_parsed") or feed_entry.get("updated_parsed") or ()), reverse=True)
+    return merged_entries
+
+def save_feed_source_validators(feed_state, fetch_results, skipped_source_names=()):
+    """ETag/Last-Modified جدید منابع دریافت‌شده (به جز skipped_source_names) در feed_state ثبت و در صورت تغییر ذخیره می‌شود."""
+    state_changed = False
+    for fetch_result in fetch_results:
+        feed_url, new_validators = fetch_result["source"]["feed_url"], fetch_result["validators"]
+        if fetch_result["source"]["name"] in skipped_source_names or not new_validators or new_validators == feed_state.get(feed_url): continue
+        feed_state[feed_url] = new_validators
+        state_changed = True
+    if not state_changed: return
+    try: save_feed_state(feed_state)
+    except OSError as e_state: print(f"!!! هشدار: ذخیره وضعیت فید ناموفق بود: {e_state}")
 
 def load_processed_links_from_wordpress():
     print(f"--- در حال دریافت لیست لینک‌های پردازش شده از وردپرس ({WORDPRESS_PROCESSED_LINKS_GET_API_ENDPOINT})...")
-    credentials = f"{WORDPRESS_USER}:{WORDPRESS_PASS}"
-    token = base64.b64encode(credentials.encode())
-    headers = {
-        'Authorization': f'Basic {token.decode("utf-8")}',
-        'User-Agent': 'Python-Rss-To-WordPress-Script/3.4-Proxy'
-    }
     try:
-        response = requests.get(
-            WORDPRESS_PROCESSED_LINKS_GET_API_ENDPOINT,
-            headers=headers,
-            timeout=REQUEST_TIMEOUT
-        )
+        response = http_client.get("wordpress", WORDPRESS_PROCESSED_LINKS_GET_API_ENDPOINT)
         response.raise_for_status()
         processed_links = response.json()
         if not isinstance(processed_links, list):
@@ -645,137 +2548,568 @@ def load_processed_links_from_wordpress():
 
 def save_processed_link_to_wordpress(link_url):
     print(f"--- در حال افزودن لینک '{link_url}' به لیست پردازش شده در وردپرس...")
-    credentials = f"{WORDPRESS_USER}:{WORDPRESS_PASS}"
-    token = base64.b64encode(credentials.encode())
-    headers = {
-        'Authorization': f'Basic {token.decode("utf-8")}',
-        'Content-Type': 'application/json',
-        'User-Agent': 'Python-Rss-To-WordPress-Script/3.4-Proxy'
-    }
     payload = {"link": link_url}
     try:
-        response = requests.post(
-            WORDPRESS_PROCESSED_LINKS_ADD_API_ENDPOINT,
-            headers=headers,
-            json=payload,
-            timeout=REQUEST_TIMEOUT
-        )
+        response = http_client.post("wordpress", WORDPRESS_PROCESSED_LINKS_ADD_API_ENDPOINT, json=payload)
         response.raise_for_status()
         response_data = response.json()
         print(f"--- لینک با موفقیت در وردپرس اضافه شد: {response_data.get('message', 'بدون پیام')}")
+        processed_links_index = get_processed_links_index()
+        if processed_links_index: processed_links_index.add_links([link_url])
         return True
     except requests.exceptions.RequestException as e:
         print(f"!!! خطای شدید در افزودن لینک '{link_url}' به وردپرس: {e}")
         raise ValueError(f"امکان ذخیره لینک '{link_url}' در وردپرس وجود ندارد: {e}")
 
-# --- شروع اسکریپت اصلی ---
-if __name__ == "__main__":
-    logger = Logger(log_file=MASTER_LOG_FILE)
-    sys.stdout = logger
+# --- ایندکس محلی لینک‌های پردازش شده (به جای دانلود کامل لیست در هر اجرا) ---
+class ProcessedLinksIndex(SqliteStore):
+    """کپی محلی لینک‌های پردازش شده؛ فقط لینک‌هایی که در آن نیستند از وردپرس پرسیده می‌شوند."""
+    schema = """
+        CREATE TABLE IF NOT EXISTS processed_links (
+            link TEXT PRIMARY KEY,
+            added_at REAL NOT NULL
+        );
+    """
 
-    main_script_start_time = time.time()
-    print(f"شروع پردازش فید RSS و ارسال به وردپرس")
+    def __init__(self, file_name="processed_links.sqlite3"):
+        super().__init__(file_name)
+
+    def known_links(self, links):
+        known = set()
+        links = list(links)
+        # محدودیت تعداد پارامترهای SQLite؛ فید معمولاً کمتر از ۵۰ ورودی دارد
+        for batch_start in range(0, len(links), 500):
+            links_batch = links[batch_start:batch_start + 500]
+            placeholders_sql = ",".join("?" * len(links_batch))
+            known.update(row[0] for row in self._execute(f"SELECT link FROM processed_links WHERE link IN ({placeholders_sql})", links_batch))
+        return known
+
+    def add_links(self, links):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO processed_links (link, added_at) VALUES (?, ?)", [(link, now) for link in links])
+
+_processed_links_index = None
+_processed_links_index_lock = threading.Lock()
+
+def get_processed_links_index():
+    global _processed_links_index
+    with _processed_links_index_lock:
+        if _processed_links_index is None:
+            try:
+                _processed_links_index = ProcessedLinksIndex()
+            except sqlite3.Error as e_index:
+                print(f"!!! هشدار: ایندکس محلی لینک‌ها باز نشد؛ فقط از وردپرس استعلام می‌شود: {e_index}")
+                return None
+        return _processed_links_index
+
+# --- Checkpoint مراحل هر مقاله (کلید: لینک ورودی فید) ---
+class CheckpointStore(SqliteStore):
+    """
+    خروجی مراحل پرهزینه هر مقاله (کپشن‌ها، عنوان، متن ترجمه‌شده، payload نهایی و پاسخ ارسال پست) را نگه می‌دارد.
+    ورودی فید هم ذخیره می‌شود تا مقاله گیرکرده بدون فید قابل اجرای مجدد باشد. پس از ثبت لینک پردازش‌شده checkpoint حذف می‌شود.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS article_checkpoints (
+            link TEXT PRIMARY KEY,
+            title TEXT,
+            entry_json TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS article_checkpoint_stages (
+            link TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            value_json TEXT NOT NULL,
+            completed_at REAL NOT NULL,
+            PRIMARY KEY (link, stage)
+        );
+    """
 
-    original_post_title_english_for_error = "نامشخص"
-    final_translated_title_for_error = "نامشخص"
-    post_original_link_from_feed = None
+    def __init__(self, file_name="checkpoints.sqlite3"):
+        super().__init__(file_name)
 
+    def begin(self, feed_entry):
+        """شروع (یا ادامه) پردازش یک ورودی؛ مراحل کامل‌شده قبلی به صورت دیکشنری نام مرحله ← خروجی برمی‌گردند."""
+        link, now = feed_entry.get("link"), time.time()
+        self._execute(
+            "INSERT INTO article_checkpoints (link, title, entry_json, status, attempts, created_at, updated_at) VALUES (?, ?, ?, 'in_progress', 1, ?, ?) "
+            "ON CONFLICT(link) DO UPDATE SET entry_json = excluded.entry_json, status = 'in_progress', attempts = attempts + 1, updated_at = excluded.updated_at",
+            (link, feed_entry.get("title"), json.dumps(feed_entry, ensure_ascii=False, default=str), now, now),
+        )
+        return self.get_stages(link)
+
+    def get_stages(self, link):
+        rows = self._execute("SELECT stage, value_json FROM article_checkpoint_stages WHERE link = ? ORDER BY completed_at", (link,))
+        return {stage: json.loads(value_json) for stage, value_json in rows}
+
+    def save_stage(self, link, stage, value):
+        self._execute("INSERT OR REPLACE INTO article_checkpoint_stages (link, stage, value_json, completed_at) VALUES (?, ?, ?, ?)",
+                      (link, stage, json.dumps(value, ensure_ascii=False), time.time()))
+
+    def mark_failed(self, link, error_text):
+        self._execute("UPDATE article_checkpoints SET status = 'failed', last_error = ?, updated_at = ? WHERE link = ?", (error_text, time.time(), link))
+
+    def complete(self, link):
+        self.purge([link])
+
+    def list_articles(self):
+        rows = self._execute(
+            "SELECT c.link, c.title, c.status, c.attempts, c.last_error, c.updated_at, GROUP_CONCAT(s.stage) FROM article_checkpoints c "
+            "LEFT JOIN article_checkpoint_stages s ON s.link = c.link GROUP BY c.link ORDER BY c.updated_at")
+        return [{"link": link, "title": title, "status": status, "attempts": attempts, "last_error": last_error, "updated_at": updated_at,
+                 "stages": stages.split(",") if stages else []} for link, title, status, attempts, last_error, updated_at, stages in rows]
+
+    def get_article(self, link):
+        rows = self._execute("SELECT title, entry_json, status, attempts, last_error, created_at, updated_at FROM article_checkpoints WHERE link = ?", (link,))
+        if not rows: return None
+        title, entry_json, status, attempts, last_error, created_at, updated_at = rows[0]
+        return {"link": link, "title": title, "entry": json.loads(entry_json), "status": status, "attempts": attempts, "last_error": last_error,
+                "created_at": created_at, "updated_at": updated_at, "stages": self.get_stages(link)}
+
+    def purge(self, links=None, older_than=None):
+        """checkpoint لینک‌های داده‌شده، یا همه (links=None)، یا آن‌هایی که از older_than (timestamp) قدیمی‌ترند حذف می‌شوند."""
+        if links is not None: selected_links = list(links)
+        elif older_than is not None: selected_links = [row[0] for row in self._execute("SELECT link FROM article_checkpoints WHERE updated_at < ?", (older_than,))]
+        else: selected_links = [row[0] for row in self._execute("SELECT link FROM article_checkpoints")]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM article_checkpoint_stages WHERE link = ?", [(link,) for link in selected_links])
+            self._conn.executemany("DELETE FROM article_checkpoints WHERE link = ?", [(link,) for link in selected_links])
+        return len(selected_links)
+
+_checkpoint_store = None
+_checkpoint_store_lock = threading.Lock()
+
+def get_checkpoint_store():
+    global _checkpoint_store
+    if not CHECKPOINTS_ENABLED: return None
+    with _checkpoint_store_lock:
+        if _checkpoint_store is None:
+            try:
+                _checkpoint_store = CheckpointStore()
+            except sqlite3.Error as e_store:
+                print(f"!!! هشدار: ذخیره‌ساز checkpoint باز نشد؛ مقاله‌ها بدون امکان ادامه پردازش می‌شوند: {e_store}")
+                return None
+        return _checkpoint_store
+
+# --- تشخیص خبرهای تقریباً تکراری با SimHash ---
+SIMHASH_BITS = 64
+
+def compute_simhash(text, shingle_size=3):
+    """SimHash ۶۴ بیتی از shingleهای سه‌کلمه‌ای متن؛ متن‌های تقریباً یکسان فاصله همینگ کمی دارند. برای متن خالی None."""
+    words = re.findall(r"\w+", text.lower())
+    if not words: return None
+    shingles = [" ".join(words[word_idx:word_idx + shingle_size]) for word_idx in range(max(1, len(words) - shingle_size + 1))]
+    bit_weights = [0] * SIMHASH_BITS
+    for shingle in shingles:
+        shingle_hash = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=SIMHASH_BITS // 8).digest(), "big")
+        for bit_idx in range(SIMHASH_BITS):
+            bit_weights[bit_idx] += 1 if (shingle_hash >> bit_idx) & 1 else -1
+    return sum(1 << bit_idx for bit_idx, weight in enumerate(bit_weights) if weight > 0)
+
+def simhash_similarity(first_hash, second_hash):
+    return 1 - bin(first_hash ^ second_hash).count("1") / SIMHASH_BITS
+
+def extract_fingerprint_text(raw_content_html, feed_source):
+    """متن انگلیسی تمیز مقاله (پس از حذف بخش‌های اضافی منبع) برای اثر انگشت SimHash."""
+    soup = make_soup(raw_content_html, document=True)
+    remove_boilerplate_sections_in_soup(soup, feed_source["boilerplate_keywords"])
+    for non_text_tag in soup.find_all(["script", "style", "figure", "blockquote"]): non_text_tag.decompose()
+    return soup.get_text(" ", strip=True)
+
+class NearDuplicateIndex(SqliteStore):
+    """اثر انگشت SimHash مقاله‌های چند ساعت اخیر؛ ردیف‌های قدیمی‌تر از window_seconds در هر افزودن حذف می‌شوند."""
+    schema = """
+        CREATE TABLE IF NOT EXISTS article_fingerprints (
+            link TEXT PRIMARY KEY,
+            simhash TEXT NOT NULL,
+            title TEXT,
+            added_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_article_fingerprints_added_at ON article_fingerprints (added_at);
+    """
+
+    def __init__(self, file_name="near_duplicates.sqlite3", window_seconds=48 * 3600):
+        super().__init__(file_name)
+        self.window_seconds = window_seconds
+
+    def check_and_add(self, link, simhash, title, threshold):
+        """
+        شبیه‌ترین مقاله اخیر (به جز خود لینک) را پیدا می‌کند. اگر شباهت به threshold برسد همان برمی‌گردد و چیزی اضافه نمی‌شود؛
+        در غیر این صورت اثر انگشت مقاله ثبت و None برگردانده می‌شود. جست‌وجو و ثبت زیر یک قفل‌اند تا دو مقاله تقریباً یکسان
+        که هم‌زمان در Workerهای بک‌لاگ پردازش می‌شوند هر دو از بررسی عبور نکنند.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM article_fingerprints WHERE added_at < ?", (now - self.window_seconds,))
+            best_match = None
+            for other_link, other_simhash, other_title in self._conn.execute("SELECT link, simhash, title FROM article_fingerprints WHERE link != ?", (link,)):
+                similarity = simhash_similarity(simhash, int(other_simhash, 16))
+                if similarity >= threshold and (best_match is None or similarity > best_match["similarity"]):
+                    best_match = {"link": other_link, "title": other_title, "similarity": similarity}
+            if best_match is None:
+                self._conn.execute("INSERT OR REPLACE INTO article_fingerprints (link, simhash, title, added_at) VALUES (?, ?, ?, ?)", (link, f"{simhash:016x}", title, now))
+            return best_match
+
+    def add(self, link, simhash, title):
+        self._execute("INSERT OR REPLACE INTO article_fingerprints (link, simhash, title, added_at) VALUES (?, ?, ?, ?)", (link, f"{simhash:016x}", title, time.time()))
+
+    def remove(self, link):
+        self._execute("DELETE FROM article_fingerprints WHERE link = ?", (link,))
+
+_near_duplicate_index = None
+_near_duplicate_index_lock = threading.Lock()
+
+def get_near_duplicate_index():
+    global _near_duplicate_index
+    if not NEAR_DUPLICATE_ENABLED: return None
+    with _near_duplicate_index_lock:
+        if _near_duplicate_index is None:
+            try:
+                _near_duplicate_index = NearDuplicateIndex(window_seconds=NEAR_DUPLICATE_WINDOW_HOURS * 3600)
+            except sqlite3.Error as e_index:
+                print(f"!!! هشدار: ایندکس خبرهای تکراری باز نشد؛ بررسی شباهت انجام نمی‌شود: {e_index}")
+                return None
+        return _near_duplicate_index
+
+def check_links_on_wordpress(candidate_links):
+    """
+    از endpoint دسته‌ای پلاگین می‌پرسد کدام یک از این N لینک قبلاً پردازش شده‌اند.
+    قرارداد: POST processed-links/check با {"links": [...]} ← {"known": [...]}
+    اگر پلاگین این endpoint را نداشته باشد (404) None برمی‌گرداند.
+    """
+    print(f"--- استعلام {len(candidate_links)} لینک از وردپرس ({WORDPRESS_PROCESSED_LINKS_CHECK_API_ENDPOINT})...")
     try:
-        print("\n>>> مرحله ۰: بررسی پست‌های تکراری...");
-        processed_links = load_processed_links_from_wordpress() 
-        print(f"--- {len(processed_links)} لینک پردازش شده از قبل یافت شد.")
+        response = http_client.post("wordpress", WORDPRESS_PROCESSED_LINKS_CHECK_API_ENDPOINT, json={"links": list(candidate_links)})
+        if response.status_code == 404:
+            print("--- endpoint استعلام دسته‌ای در پلاگین وجود ندارد؛ از دانلود کامل لیست استفاده می‌شود.")
+            return None
+        response.raise_for_status()
+        known_links = response.json().get("known", [])
+        if not isinstance(known_links, list):
+            raise ValueError(f"فیلد known در پاسخ استعلام لیست نیست (نوع: {type(known_links).__name__}).")
+        return set(known_links) & set(candidate_links)
+    except (requests.exceptions.RequestException, ValueError, AttributeError) as e:
+        print(f"!!! خطای شدید در استعلام لینک‌های پردازش شده از وردپرس: {e}")
+        raise ValueError(f"امکان استعلام لینک‌های پردازش شده از وردپرس وجود ندارد: {e}")
+
+def find_processed_links(candidate_links):
+    """
+    از میان لینک‌های ورودی فید، آن‌هایی را که قبلاً پردازش شده‌اند برمی‌گرداند.
+    هزینه هر اجرا به تعداد لینک‌های جدید فید بستگی دارد، نه به تعداد کل مقالات منتشر شده.
+    """
+    candidate_links = [link for link in dict.fromkeys(candidate_links) if link]
+    processed_links_index = get_processed_links_index()
+    known_links = processed_links_index.known_links(candidate_links) if processed_links_index else set()
+    unknown_links = [link for link in candidate_links if link not in known_links]
+    print(f"--- {len(known_links)} لینک در ایندکس محلی یافت شد، {len(unknown_links)} لینک نیاز به استعلام دارد.")
+    if not unknown_links:
+        return known_links
+
+    remote_known_links = check_links_on_wordpress(unknown_links)
+    if remote_known_links is None:
+        all_processed_links = load_processed_links_from_wordpress()
+        remote_known_links = set(unknown_links) & all_processed_links
+        # دانلود کامل فرصتی برای پر کردن ایندکس محلی است تا اجراهای بعدی کمتر به آن نیاز داشته باشند
+        if processed_links_index: processed_links_index.add_links(all_processed_links)
+    elif processed_links_index and remote_known_links:
+        processed_links_index.add_links(remote_known_links)
+    return known_links | remote_known_links
+
+# --- پایپ‌لاین تبدیل DOM: محتوا یک‌بار parse می‌شود و تمام پاس‌ها روی همان درخت اجرا می‌شوند ---
+def finalize_content_in_soup(soup, fallback_alt):
+    for img_tag_in_final_soup in soup.find_all("img"):
+        img_tag_in_final_soup['style'] = "max-width:100%; height:auto; display:block; margin:10px auto; border-radius:4px;"
+        if not img_tag_in_final_soup.get('alt'): img_tag_in_final_soup['alt'] = fallback_alt
+    for p_tag_to_check in soup.find_all('p'):
+        if not p_tag_to_check.get_text(strip=True) and not p_tag_to_check.find(['img', 'br', 'hr', 'figure', 'iframe', 'script', 'blockquote']):
+            p_tag_to_check.decompose()
+    return soup
+
+# ترتیب پاس‌ها مهم است: TradingView باید قبل از بررسی عکس‌ها و پراکسی به لینک مستقیم تبدیل شود
+def build_pre_translation_dom_passes(feed_source):
+    """پاس‌های پیش از ترجمه برای یک منبع فید؛ دو پاس اول قواعد همان منبع را به کار می‌برند."""
+    def remove_boilerplate_sections_for_source(soup):
+        return remove_boilerplate_sections_in_soup(soup, feed_source["boilerplate_keywords"])
+    def remove_source_links_for_source(soup):
+        return remove_links_to_domains_in_soup(soup, feed_source["strip_link_domains"])
+    return [
+        remove_boilerplate_sections_for_source,
+        remove_source_links_for_source,
+        resolve_tradingview_links_in_soup,
+        probe_images_in_soup,
+        proxy_all_images_in_soup,
+    ]
 
-        print("\n>>> مرحله ۱: دریافت و تجزیه فید RSS...");
-        feed_data_parsed = feedparser.parse(RSS_FEED_URL)
-        if feed_data_parsed.bozo: print(f"--- هشدار در تجزیه فید: {feed_data_parsed.bozo_exception}")
-        if not feed_data_parsed.entries: raise ValueError("هیچ پستی در فید RSS یافت نشد.")
+def apply_dom_passes(soup, dom_passes):
+    for dom_pass in dom_passes:
+        with run_metrics.timed(f"dom:{dom_pass.__name__}"):
+            dom_pass(soup)
+    return soup
 
-        latest_post_from_feed = feed_data_parsed.entries[0]
-        original_post_title_english_for_error = latest_post_from_feed.title
-        post_original_link_from_feed = getattr(latest_post_from_feed, 'link', None)
+def prepare_content_for_translation(raw_content_html, feed_source=None):
+    """
+    محتوای خام فید را فقط یک‌بار parse می‌کند، پاس‌های پیش از ترجمه را روی همان درخت اجرا می‌کند
+    و تنها یک‌بار (برای درخواست Gemini) سریال‌سازی می‌کند. خروجی: (HTML با Placeholder، نقشه Placeholder)
+    """
+    with run_metrics.timed("dom:parse_source"):
+        soup = make_soup(raw_content_html)
+    apply_dom_passes(soup, build_pre_translation_dom_passes(feed_source or DEFAULT_FEED_SOURCE))
+    with run_metrics.timed("dom:replace_images_with_placeholders_in_soup"):
+        placeholder_map = replace_images_with_placeholders_in_soup(soup)
+    return str(soup), placeholder_map
 
-        if not post_original_link_from_feed:
-            raise ValueError("پست یافت شده فاقد لینک منبع (link) است. امکان بررسی تکراری بودن وجود ندارد.")
+def build_final_content(translated_html, placeholder_map, crawled_captions_list, fallback_alt, sideloaded_media=None):
+    """
+    خروجی Gemini را یک‌بار parse می‌کند، تصاویر و کپشن‌ها و استایل نهایی را روی همان درخت اعمال می‌کند
+    و فقط یک‌بار (برای payload وردپرس) سریال‌سازی می‌کند.
+    """
+    with run_metrics.timed("dom:parse_translated"):
+        soup = make_soup(translated_html)
+    with run_metrics.timed("dom:restore_images_from_placeholders_in_soup"):
+        restore_images_from_placeholders_in_soup(soup, placeholder_map)
+    with run_metrics.timed("dom:add_captions_to_images_in_soup"):
+        add_captions_to_images_in_soup(soup, crawled_captions_list)
+    # پس از کپشن‌ها، چون تطبیق کپشن با لینک اصلی عکس انجام می‌شود
+    if sideloaded_media:
+        with run_metrics.timed("dom:apply_sideloaded_images_in_soup"):
+            apply_sideloaded_images_in_soup(soup, sideloaded_media)
+    with run_metrics.timed("dom:finalize_content_in_soup"):
+        finalize_content_in_soup(soup, fallback_alt)
+    return str(soup)
 
-        if post_original_link_from_feed in processed_links:
-            print("\n" + "*"*60)
-            print(f"*** پست تکراری یافت شد. این پست قبلاً پردازش شده است. ***")
-            print(f"*** عنوان: {original_post_title_english_for_error}")
-            print(f"*** لینک: {post_original_link_from_feed}")
-            print("*"*60 + "\n")
-            sys.exit(0)
+# --- اجرای مراحل به صورت گراف وابستگی (مراحل مستقل هم‌زمان اجرا می‌شوند) ---
+def _run_timed_stage(stage, dependency_results, parent_log_context):
+    with log_context(**parent_log_context):
+        return _run_timed_stage_in_context(stage, dependency_results)
 
-        print(f"--- جدیدترین پست (غیر تکراری) انتخاب شد: '{original_post_title_english_for_error}' (لینک: {post_original_link_from_feed})")
-        print("<<< مرحله ۱ کامل شد.");
+def _run_timed_stage_in_context(stage, dependency_results):
+    stage_start_time = time.time()
+    print(f"--- [{stage['name']}] شروع در {datetime.now().strftime('%H:%M:%S')}")
+    try:
+        with run_metrics.timed(stage["name"]):
+            return stage["func"](dependency_results)
+    finally:
+        print(f"--- [{stage['name']}] پایان در {datetime.now().strftime('%H:%M:%S')} (مدت: {time.time() - stage_start_time:.2f} ثانیه)")
 
-        thumbnail_url_for_plugin_final = None
-        if hasattr(latest_post_from_feed, 'media_content') and latest_post_from_feed.media_content:
-            raw_thumbnail_url = latest_post_from_feed.media_content[0].get('url', '')
-            if raw_thumbnail_url and raw_thumbnail_url.startswith(('http://', 'https://')):
-                thumbnail_url_for_plugin_final = raw_thumbnail_url
-                print(f"--- URL تصویر بندانگشتی برای پلاگین استخراج شد: {thumbnail_url_for_plugin_final}")
-            else:
-                print(f"--- هشدار: URL تصویر بندانگشتی ('{raw_thumbnail_url}') از فید برای پلاگین معتبر نیست.")
-        else:
-            print("--- هیچ تصویر بندانگشتی (media_content) در فید برای پلاگین یافت نشد.")
+def run_stage_graph(stages):
+    """
+    stages لیستی از دیکشنری‌های {"name", "func", "deps"} است؛ func دیکشنری نتایج مراحل پیش‌نیاز را می‌گیرد.
+    هر مرحله به محض آماده شدن پیش‌نیازهایش روی Thread Pool اجرا می‌شود، پس زمان کل برابر طولانی‌ترین شاخه است.
+    با اولین خطا مرحله جدیدی شروع نمی‌شود و همان خطا دوباره raise می‌شود.
+    """
+    results = {}
+    # زمینه لاگ (مثل شناسه مقاله) به Threadهای مراحل منتقل می‌شود
+    parent_log_context = current_log_context()
+    pending_stages = {stage["name"]: stage for stage in stages}
+    running_futures = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(stages)), thread_name_prefix="stage") as executor:
+        while pending_stages or running_futures:
+            for stage_name, stage in list(pending_stages.items()):
+                if all(dep in results for dep in stage.get("deps", ())):
+                    dependency_results = {dep: results[dep] for dep in stage.get("deps", ())}
+                    running_futures[executor.submit(_run_timed_stage, stage, dependency_results, parent_log_context)] = stage_name
+                    del pending_stages[stage_name]
+            if not running_futures:
+                raise ValueError(f"وابستگی‌های مراحل قابل حل نیستند: {', '.join(pending_stages)}")
+            done_futures, _ = wait(running_futures, return_when=FIRST_COMPLETED)
+            for future in done_futures:
+                results[running_futures.pop(future)] = future.result()
+    return results
+
+def extract_thumbnail_url(feed_entry):
+    if hasattr(feed_entry, 'media_content') and feed_entry.media_content:
+        raw_thumbnail_url = feed_entry.media_content[0].get('url', '')
+        if raw_thumbnail_url and raw_thumbnail_url.startswith(('http://', 'https://')):
+            print(f"--- URL تصویر بندانگشتی برای پلاگین استخراج شد: {raw_thumbnail_url}")
+            return raw_thumbnail_url
+        print(f"--- هشدار: URL تصویر بندانگشتی ('{raw_thumbnail_url}') از فید برای پلاگین معتبر نیست.")
+        return None
+    print("--- هیچ تصویر بندانگشتی (media_content) در فید برای پلاگین یافت نشد.")
+    return None
+
+def extract_entry_content(feed_entry):
+    raw_content_html_from_feed = ""
+    if 'content' in feed_entry and feed_entry.content:
+        if isinstance(feed_entry.content, list) and len(feed_entry.content) > 0 and 'value' in feed_entry.content[0]: raw_content_html_from_feed = feed_entry.content[0]['value']
+        elif isinstance(feed_entry.content, dict) and 'value' in feed_entry.content: raw_content_html_from_feed = feed_entry.content['value']
+    elif 'summary' in feed_entry: raw_content_html_from_feed = feed_entry.summary
+    return raw_content_html_from_feed
+
+def process_feed_entry(feed_entry, progress):
+    """
+    پایپ‌لاین کامل (کرال ← ترجمه ← ارسال) را برای یک ورودی فید اجرا می‌کند.
+    عنوان و لینک و عنوان ترجمه‌شده در دیکشنری progress به‌روز می‌شوند تا در گزارش خطا در دسترس باشند.
+    خروجی هر مرحله در checkpoint ذخیره می‌شود؛ اگر ورودی قبلاً نیمه‌کاره مانده باشد از آخرین مرحله کامل‌شده ادامه می‌یابد.
+    """
+    progress["title"] = feed_entry.title
+    progress["link"] = getattr(feed_entry, 'link', None)
+    checkpoint_store = get_checkpoint_store() if progress["link"] else None
+    completed_stages = {}
+    if checkpoint_store:
+        try: completed_stages = checkpoint_store.begin(feed_entry)
+        except sqlite3.Error as e_checkpoint: print(f"!!! هشدار: خواندن checkpoint ناموفق بود: {e_checkpoint}")
+        if completed_stages: print(f"--- [Checkpoint] ادامه پردازش از مراحل ذخیره‌شده: {', '.join(completed_stages)}")
+
+    def save_checkpoint(stage_name, stage_value):
+        if checkpoint_store:
+            try: checkpoint_store.save_stage(progress["link"], stage_name, stage_value)
+            except sqlite3.Error as e_checkpoint: print(f"!!! هشدار: ذخیره checkpoint مرحله {stage_name} ناموفق بود: {e_checkpoint}")
+        return stage_value
 
+    try:
+        post_response = run_feed_entry_stages(feed_entry, progress, completed_stages, save_checkpoint)
+    except Exception as entry_exception:
+        # مقاله ناموفق نباید نسخه‌های مشابه بعدی را به عنوان تکراری کنار بگذارد؛ با ادامه از checkpoint دوباره ثبت می‌شود
+        near_duplicate_index = get_near_duplicate_index() if progress["link"] else None
+        if near_duplicate_index:
+            try: near_duplicate_index.remove(progress["link"])
+            except sqlite3.Error as e_index: print(f"!!! هشدار: حذف اثر انگشت مقاله ناموفق بود: {e_index}")
+        if checkpoint_store:
+            try: checkpoint_store.mark_failed(progress["link"], f"{type(entry_exception).__name__}: {entry_exception}")
+            except sqlite3.Error as e_checkpoint: print(f"!!! هشدار: ثبت خطا در checkpoint ناموفق بود: {e_checkpoint}")
+        raise
+    if checkpoint_store:
+        try:
+            if post_response and (post_response.get("post_id") or post_response.get("duplicate_of")): checkpoint_store.complete(progress["link"])
+            else: checkpoint_store.mark_failed(progress["link"], "پاسخ وردپرس فاقد post_id بود.")
+        except sqlite3.Error as e_checkpoint: print(f"!!! هشدار: به‌روزرسانی checkpoint ناموفق بود: {e_checkpoint}")
+    return post_response
+
+def run_feed_entry_stages(feed_entry, progress, completed_stages, save_checkpoint):
+    """مراحل یک ورودی؛ مرحله‌ای که در completed_stages هست دوباره اجرا نمی‌شود و خروجی هر مرحله با save_checkpoint ذخیره می‌شود."""
+    original_post_title_english = feed_entry.title
+    post_original_link_from_feed = getattr(feed_entry, 'link', None)
+    progress["title"] = original_post_title_english
+    progress["link"] = post_original_link_from_feed
+
+    thumbnail_url_for_plugin_final = extract_thumbnail_url(feed_entry)
+    feed_source = get_feed_source(feed_entry.get("feed_source"))
+
+    def captions_stage(_):
+        if "captions" in completed_stages:
+            print(f"--- [Checkpoint] مرحله ۲: {len(completed_stages['captions'])} کپشن از checkpoint خوانده شد.")
+            return completed_stages["captions"]
         print("\n>>> مرحله ۲: کرال کردن و ترجمه کپشن‌ها...");
         crawled_and_translated_captions = crawl_captions(post_original_link_from_feed)
         print(f"<<< مرحله ۲ کامل شد (تعداد کپشن نهایی: {len(crawled_and_translated_captions)}).");
+        return save_checkpoint("captions", crawled_and_translated_captions)
 
+    def title_stage(_):
+        if "title" in completed_stages:
+            progress["translated_title"] = completed_stages["title"]
+            print(f"--- [Checkpoint] مرحله ۳: عنوان ترجمه‌شده از checkpoint: {completed_stages['title']}")
+            return completed_stages["title"]
         print("\n>>> مرحله ۳: ترجمه عنوان پست...");
-        final_translated_title_for_error = translate_title_with_gemini(original_post_title_english_for_error)
-        if not final_translated_title_for_error: raise ValueError("ترجمه عنوان پست ناموفق بود یا خالی بازگشت.")
-        final_translated_title_for_error = final_translated_title_for_error.replace("**", "").replace("`", "")
-        print(f"--- عنوان ترجمه‌شده نهایی: {final_translated_title_for_error}"); print("<<< مرحله ۳ کامل شد.");
-
+        final_translated_title = translate_title_with_gemini(original_post_title_english)
+        if not final_translated_title: raise ValueError("ترجمه عنوان پست ناموفق بود یا خالی بازگشت.")
+        final_translated_title = final_translated_title.replace("**", "").replace("`", "")
+        progress["translated_title"] = final_translated_title
+        print(f"--- عنوان ترجمه‌شده نهایی: {final_translated_title}"); print("<<< مرحله ۳ کامل شد.");
+        return save_checkpoint("title", final_translated_title)
+
+    def prepare_body_stage(_):
         print("\n>>> مرحله ۴: پردازش کامل محتوای اصلی...");
-        raw_content_html_from_feed = ""
-        if 'content' in latest_post_from_feed and latest_post_from_feed.content:
-            if isinstance(latest_post_from_feed.content, list) and len(latest_post_from_feed.content) > 0 and 'value' in latest_post_from_feed.content[0]: raw_content_html_from_feed = latest_post_from_feed.content[0]['value']
-            elif isinstance(latest_post_from_feed.content, dict) and 'value' in latest_post_from_feed.content: raw_content_html_from_feed = latest_post_from_feed.content['value']
-        elif 'summary' in latest_post_from_feed: raw_content_html_from_feed = latest_post_from_feed.summary
+        raw_content_html_from_feed = extract_entry_content(feed_entry)
         if not raw_content_html_from_feed: raise ValueError("محتوای اصلی (content یا summary) از فید یافت نشد.")
         print(f"--- محتوای خام از فید دریافت شد (طول: {len(raw_content_html_from_feed)} کاراکتر).");
-
-        # --- ترتیب نهایی و صحیح عملیات ---
-
-        # 1. پاکسازی اولیه
-        content_without_boilerplate = remove_boilerplate_sections(raw_content_html_from_feed)
-        cleaned_content_after_regex = remove_newsbtc_links(content_without_boilerplate)
-
-        # 2. تبدیل لینک TradingView به لینک عکس مستقیم
-        content_with_resolved_tv_links = resolve_tradingview_links(cleaned_content_after_regex)
-        
-        # 3. پراکسی کردن تمام عکس‌ها (که حالا همگی لینک مستقیم هستند)
-        content_with_all_images_proxied = proxy_all_images(content_with_resolved_tv_links)
-
-        # 4. آماده‌سازی برای ترجمه
-        content_with_placeholders, placeholder_map_generated = replace_images_with_placeholders(content_with_all_images_proxied)
-        translated_content_main_with_placeholders = translate_with_gemini(content_with_placeholders)
+        # پاکسازی، تصحیح لینک‌های TradingView، پراکسی عکس‌ها و Placeholder روی یک درخت واحد
+        return prepare_content_for_translation(raw_content_html_from_feed, feed_source)
+
+    def translate_body_stage(dependency_results):
+        content_with_placeholders, placeholder_map_generated = dependency_results["prepare_body"]
+        # شناسه Placeholderها در هر اجرا تصادفی است؛ متن با شناسه‌های ترتیبی و آدرس عکس هر شناسه ذخیره
+        # و هنگام ادامه بر اساس همان آدرس‌ها به شناسه‌های اجرای جاری وصل می‌شود
+        placeholder_ids = canonicalize_placeholder_ids(content_with_placeholders)[1]
+        if "translate_body" in completed_stages:
+            print("--- [Checkpoint] ترجمه محتوا از checkpoint خوانده شد.")
+            return remap_checkpointed_placeholders(completed_stages["translate_body"], placeholder_map_generated)
+        translated_content_main_with_placeholders = translate_with_gemini(content_with_placeholders, body_model_name)
         if not translated_content_main_with_placeholders: raise ValueError("ترجمه محتوای اصلی ناموفق بود یا خالی بازگشت.")
-
-        # 5. بازگرداندن تصاویر به متن ترجمه شده
-        translated_content_with_images_restored = restore_images_from_placeholders(translated_content_main_with_placeholders, placeholder_map_generated)
-        
-        # 6. افزودن کپشن‌ها با استفاده از تابع هوشمند
-        final_processed_content_html = add_captions_to_images(translated_content_with_images_restored, crawled_and_translated_captions)
-
-        # پردازش نهایی و اضافه کردن استایل
-        final_processed_soup = BeautifulSoup(final_processed_content_html, "html.parser")
-        for img_tag_in_final_soup in final_processed_soup.find_all("img"):
-            img_tag_in_final_soup['style'] = "max-width:100%; height:auto; display:block; margin:10px auto; border-radius:4px;"
-            if not img_tag_in_final_soup.get('alt'): img_tag_in_final_soup['alt'] = final_translated_title_for_error
-        for p_tag_to_check in final_processed_soup.find_all('p'):
-            if not p_tag_to_check.get_text(strip=True) and not p_tag_to_check.find(['img', 'br', 'hr', 'figure', 'iframe', 'script', 'blockquote']):
-                p_tag_to_check.decompose()
-        final_processed_content_html = str(final_processed_soup)
+        save_checkpoint("translate_body", {
+            "html": canonicalize_placeholder_ids(translated_content_main_with_placeholders, placeholder_ids)[0],
+            "images": placeholder_image_keys(placeholder_ids, placeholder_map_generated),
+        })
+        return translated_content_main_with_placeholders
+
+    def sideload_images_stage(dependency_results):
+        # هم‌زمان با ترجمه متن: عکس‌های مقاله و تصویر شاخص به کتابخانه رسانه وردپرس منتقل می‌شوند
+        _, placeholder_map_generated = dependency_results["prepare_body"]
+        image_urls = [unproxy_image_url(img_tag.get("src", "")) for img_tag in placeholder_map_generated.values()]
+        if thumbnail_url_for_plugin_final: image_urls.append(thumbnail_url_for_plugin_final)
+        image_urls = [image_url for image_url in image_urls if image_url.startswith(('http://', 'https://'))]
+        if not image_urls: return {}
+        print(f"\n>>> انتقال {len(set(image_urls))} عکس به کتابخانه رسانه وردپرس...")
+        sideloaded_media = get_media_sideloader().sideload_many(image_urls)
+        print(f"<<< انتقال عکس‌ها تمام شد ({sum(1 for media in sideloaded_media.values() if media)}/{len(sideloaded_media)} موفق).")
+        return sideloaded_media
+
+    def assemble_body_stage(dependency_results):
+        # بازگرداندن تصاویر، افزودن کپشن‌ها و استایل نهایی روی درخت متن ترجمه شده
+        _, placeholder_map_generated = dependency_results["prepare_body"]
+        final_processed_content_html = build_final_content(dependency_results["translate_body"], placeholder_map_generated, dependency_results["captions"],
+                                                           dependency_results["title"], dependency_results.get("sideload_images"))
         print("<<< مرحله ۴ (پردازش محتوا) کامل شد.");
-
+        return final_processed_content_html
+
+    body_model_name = GEMINI_MODEL_NAME
+    near_duplicate_index = get_near_duplicate_index() if post_original_link_from_feed else None
+    if near_duplicate_index:
+        with run_metrics.timed("near_duplicate_check"):
+            raw_content_html_from_feed = extract_entry_content(feed_entry)
+            article_simhash = compute_simhash(extract_fingerprint_text(raw_content_html_from_feed, feed_source)) if raw_content_html_from_feed else None
+            duplicate_match = None
+            if article_simhash is None: pass
+            elif "translate_body" in completed_stages or "payload" in completed_stages:
+                # هزینه ترجمه قبلاً پرداخت شده است؛ فقط اثر انگشت دوباره ثبت می‌شود
+                near_duplicate_index.add(post_original_link_from_feed, article_simhash, original_post_title_english)
+            else:
+                duplicate_match = near_duplicate_index.check_and_add(post_original_link_from_feed, article_simhash, original_post_title_english, NEAR_DUPLICATE_THRESHOLD)
+        if duplicate_match:
+            print(f"--- [خبر تکراری] شباهت {duplicate_match['similarity']:.0%} با '{duplicate_match['title']}' ({duplicate_match['link']}).")
+            if NEAR_DUPLICATE_ACTION == "update":
+                body_model_name = GEMINI_UPDATE_MODEL_NAME
+                print(f"--- [خبر تکراری] مسیر update: متن با مدل ارزان‌تر {body_model_name} ترجمه می‌شود.")
+            else:
+                print("--- [خبر تکراری] مقاله ارسال نمی‌شود و فقط لینک آن به عنوان پردازش‌شده ثبت می‌شود.")
+                with run_metrics.timed("save_processed_link"):
+                    save_processed_link_to_wordpress(post_original_link_from_feed)
+                return {"duplicate_of": duplicate_match["link"], "similarity": duplicate_match["similarity"]}
+
+    if "payload" in completed_stages:
+        post_payload = completed_stages["payload"]
+        progress["translated_title"] = post_payload["title"]
+        print("--- [Checkpoint] مراحل ۲ تا ۵: payload نهایی پست از checkpoint خوانده شد.")
+    else:
+        # کپشن‌ها، عنوان و متن به هم وابسته نیستند و فقط در مرحله ترکیب نهایی به هم می‌رسند
+        stages = [
+            {"name": "captions", "func": captions_stage},
+            {"name": "title", "func": title_stage},
+            {"name": "prepare_body", "func": prepare_body_stage},
+            {"name": "translate_body", "func": translate_body_stage, "deps": ["prepare_body"]},
+            {"name": "assemble_body", "func": assemble_body_stage, "deps": ["prepare_body", "translate_body", "captions", "title"]},
+        ]
+        if SIDELOAD_IMAGES:
+            stages.insert(4, {"name": "sideload_images", "func": sideload_images_stage, "deps": ["prepare_body"]})
+            stages[-1]["deps"].append("sideload_images")
+        stage_results = run_stage_graph(stages)
+        final_translated_title = stage_results["title"]
+        final_processed_content_html = stage_results["assemble_body"]
+        featured_media_id = None
+        sideloaded_thumbnail = stage_results.get("sideload_images", {}).get(thumbnail_url_for_plugin_final)
+        if sideloaded_thumbnail:
+            # شناسه پیوست به جای URL ارسال می‌شود؛ با URL پلاگین عکس را دوباره دانلود می‌کرد و پیوست دومی می‌ساخت
+            featured_media_id, thumbnail_url_for_plugin_final = sideloaded_thumbnail["attachment_id"], ""
+            print(f"--- تصویر شاخص از کتابخانه رسانه: پیوست {featured_media_id} ({sideloaded_thumbnail['media_url']})")
+
+        stage5_start_time = time.perf_counter()
         print("\n>>> مرحله ۵: آماده‌سازی ساختار نهایی HTML پست...");
         list_of_html_components = []
         if final_processed_content_html: list_of_html_components.append(f'<div style="line-height: 1.75; font-size: 17px; text-align: justify;">{final_processed_content_html}</div>')
-        
+    
         disclaimer_text = '<strong>سلب مسئولیت:</strong> احتمال اشتباه در تحلیل ها وجود دارد و هیچ تحلیلی قطعی نیست و همه بر پایه احتمالات میباشند. لطفا در خرید و فروش خود دقت کنید.'
         disclaimer_html_code = (
             f'<div style="color: #c00; '
@@ -788,35 +3122,448 @@ if __name__ == "__main__":
             f'border-radius: 5px;">{disclaimer_text}</div>'
         )
         list_of_html_components.append(disclaimer_html_code)
-        
+    
         if post_original_link_from_feed:
-            source_attribution_text = "منبع: NewsBTC"
+            source_attribution_text = feed_source["attribution"]
             source_link_html_code = (f'<hr style="margin-top: 25px; margin-bottom: 15px; border: 0; border-top: 1px solid #eee;"><p style="text-align:right; margin-top:15px; font-size: 0.85em; color: #555;"><em><a href="{post_original_link_from_feed}" target="_blank" rel="noopener noreferrer nofollow" style="color: #1a0dab; text-decoration: none;">{source_attribution_text}</a></em></p>')
             list_of_html_components.append(source_link_html_code)
         final_html_payload_for_wordpress = "".join(list_of_html_components)
+        run_metrics.record_stage("build_html", time.perf_counter() - stage5_start_time)
         print("<<< مرحله ۵ (ساختار نهایی) کامل شد.");
-
+        post_payload = save_checkpoint("payload", {"title": final_translated_title, "content": final_html_payload_for_wordpress,
+                                                   "thumbnail_url": thumbnail_url_for_plugin_final, "featured_media": featured_media_id})
+
+    if "post" in completed_stages:
+        # پست قبلاً ساخته شده است؛ ارسال دوباره پست تکراری می‌سازد
+        post_response = completed_stages["post"]
+        print(f"--- [Checkpoint] مرحله ۶: پست قبلاً ارسال شده است (post_id: {post_response.get('post_id')}).")
+    else:
         print("\n>>> مرحله ۶: ارسال پست به وردپرس...");
-        post_response = post_to_wordpress(
-            title_for_wp=final_translated_title_for_error,
-            content_for_wp=final_html_payload_for_wordpress,
-            original_english_title=original_post_title_english_for_error,
-            thumbnail_url_for_plugin=thumbnail_url_for_plugin_final,
-            source_url_for_post=post_original_link_from_feed
-        )
+        with run_metrics.timed("post_wordpress"):
+            post_response = post_to_wordpress(
+                title_for_wp=post_payload["title"],
+                content_for_wp=post_payload["content"],
+                original_english_title=original_post_title_english,
+                thumbnail_url_for_plugin=post_payload["thumbnail_url"],
+                featured_media_id=post_payload.get("featured_media"),
+                source_url_for_post=post_original_link_from_feed,
+                category_id=feed_source["category_id"]
+            )
+        if post_response and post_response.get("post_id"): save_checkpoint("post", post_response)
         print("<<< مرحله ۶ (ارسال به وردپرس) کامل شد.");
 
-        if post_response and post_response.get("post_id"):
-            print("\n>>> مرحله ۷: ذخیره کردن لینک منبع برای جلوگیری از تکرار...");
+    if post_response and post_response.get("post_id"):
+        print("\n>>> مرحله ۷: ذخیره کردن لینک منبع برای جلوگیری از تکرار...");
+        with run_metrics.timed("save_processed_link"):
             save_processed_link_to_wordpress(post_original_link_from_feed)
-            print(f"--- لینک '{post_original_link_from_feed[:70]}...' با موفقیت در وردپرس ثبت شد.")
-            print("<<< مرحله ۷ کامل شد.")
+        print(f"--- لینک '{post_original_link_from_feed[:70]}...' با موفقیت در وردپرس ثبت شد.")
+        print("<<< مرحله ۷ کامل شد.")
+    return post_response
+
+def select_new_feed_entries(feed_entries, processed_links):
+    """ورودی‌های فید را با لیست لینک‌های پردازش‌شده مقایسه و فقط ورودی‌های جدید (بدون تکرار) را برمی‌گرداند."""
+    new_entries = []
+    seen_links = set()
+    for feed_entry in feed_entries:
+        entry_link = getattr(feed_entry, 'link', None)
+        if not entry_link:
+            print(f"--- هشدار: ورودی '{getattr(feed_entry, 'title', 'بدون عنوان')}' فاقد لینک است و نادیده گرفته شد.")
+            continue
+        if entry_link in processed_links or entry_link in seen_links:
+            continue
+        seen_links.add(entry_link)
+        new_entries.append(feed_entry)
+    return new_entries
+
+def _process_entry_isolated(feed_entry):
+    """اجرای ایزوله یک ورودی در Worker؛ هر خطایی گرفته می‌شود تا بقیه ورودی‌ها ادامه پیدا کنند."""
+    progress = {"title": getattr(feed_entry, 'title', 'نامشخص'), "link": getattr(feed_entry, 'link', None), "translated_title": "نامشخص"}
+    entry_start_time = time.time()
+    try:
+        with log_context(article=progress["link"]):
+            post_response = process_feed_entry(feed_entry, progress)
+        if post_response and post_response.get("duplicate_of"):
+            progress["status"], progress["duplicate_of"] = "skipped_duplicate", post_response["duplicate_of"]
+        else:
+            progress["status"] = "ok" if post_response and post_response.get("post_id") else "failed"
+            progress["post_url"] = (post_response or {}).get("url")
+            if progress["status"] != "ok": progress["error"] = "پاسخ وردپرس فاقد post_id بود."
+    except Exception as entry_exception:
+        progress["status"] = "failed"
+        progress["error"] = f"{type(entry_exception).__name__}: {entry_exception}"
+        print(f"!!! خطا در پردازش '{progress['title']}' ({progress['link']}): {progress['error']}")
+        tb_lines = traceback.format_exception(type(entry_exception), entry_exception, entry_exception.__traceback__)
+        for line in tb_lines[-8:]: print(line.strip())
+    progress["duration"] = time.time() - entry_start_time
+    run_metrics.record_article(progress)
+    return progress
+
+def run_backlog(new_entries):
+    """
+    تمام ورودی‌های جدید فید را روی یک Pool محدود از Workerها پردازش می‌کند
+    و در انتها خلاصه‌ای از نتیجه هر ورودی چاپ می‌کند. خروجی: (تعداد ورودی‌های ناموفق، تعداد ورودی‌های تکراری کنارگذاشته‌شده)
+    """
+    if BACKLOG_MAX_ENTRIES > 0 and len(new_entries) > BACKLOG_MAX_ENTRIES:
+        print(f"--- محدودیت بک‌لاگ: فقط {BACKLOG_MAX_ENTRIES} ورودی جدیدتر از {len(new_entries)} ورودی پردازش می‌شوند.")
+        new_entries = new_entries[:BACKLOG_MAX_ENTRIES]
+    # فید از جدید به قدیم مرتب است؛ قدیمی‌ترها زودتر ارسال شوند تا ترتیب انتشار حفظ شود
+    ordered_entries = list(reversed(new_entries))
+    workers_count = max(1, min(BACKLOG_MAX_WORKERS, len(ordered_entries)))
+    print(f"--- حالت بک‌لاگ: {len(ordered_entries)} ورودی جدید با {workers_count} Worker پردازش می‌شوند.")
+
+    with ThreadPoolExecutor(max_workers=workers_count, thread_name_prefix="entry") as executor:
+        results = list(executor.map(_process_entry_isolated, ordered_entries))
+
+    print("\n" + "="*70 + "\nخلاصه پردازش ورودی‌های فید:")
+    for result_idx, result in enumerate(results):
+        status_mark = {"ok": "✅", "skipped_duplicate": "⏭️"}.get(result["status"], "❌")
+        print(f"{status_mark} [{result_idx + 1}] ({result['duration']:.1f} ثانیه) {result['title'][:60]}")
+        print(f"      لینک منبع: {result['link']}")
+        if result["status"] == "ok": print(f"      پست وردپرس: {result.get('post_url') or 'نامشخص'}")
+        elif result["status"] == "skipped_duplicate": print(f"      تکراری با: {result.get('duplicate_of')}")
+        else: print(f"      خطا: {result.get('error')}")
+    failed_count = sum(1 for result in results if result["status"] == "failed")
+    skipped_count = sum(1 for result in results if result["status"] == "skipped_duplicate")
+    print(f"--- موفق: {len(results) - failed_count - skipped_count}، تکراری: {skipped_count}، ناموفق: {failed_count}")
+    print("="*70)
+    return failed_count, skipped_count
+
+# --- حالت daemon: اجرای دائمی با Session و کش‌های گرم و فاصله نظرسنجی تطبیقی فید ---
+def poll_feed_once(feed_state, feed_sources=None):
+    """
+    یک چرخه daemon: دریافت شرطی و هم‌زمان فید منابع، ادغام ورودی‌ها، یافتن ورودی‌های جدید و پردازش آن‌ها مثل حالت بک‌لاگ.
+    ETag/Last-Modified منبعی که ورودی جدید داشته فقط وقتی ذخیره می‌شود که تمام ورودی‌های جدید موفق بوده باشند.
+    خروجی: (تعداد ورودی جدید هر منبع، تعداد ناموفق، تعداد تکراری کنارگذاشته‌شده، خطای دریافت هر منبع)
+    """
+    feed_sources = feed_sources or FEED_SOURCES
+    with run_metrics.timed("feed_fetch"):
+        fetch_results = fetch_feed_sources(feed_sources, feed_state)
+    source_errors = {fetch_result["source"]["name"]: fetch_result["error"] for fetch_result in fetch_results if fetch_result["error"]}
+    new_entries_by_source = {feed_source["name"]: 0 for feed_source in feed_sources}
+    merged_feed_entries = merge_feed_entries(fetch_results)
+    if not merged_feed_entries:
+        save_feed_source_validators(feed_state, fetch_results)
+        return new_entries_by_source, 0, 0, source_errors
+    with run_metrics.timed("find_processed_links"):
+        processed_links = find_processed_links([getattr(feed_entry, 'link', None) for feed_entry in merged_feed_entries])
+    new_feed_entries = select_new_feed_entries(merged_feed_entries, processed_links)
+    for feed_entry in new_feed_entries: new_entries_by_source[feed_entry["feed_source"]] += 1
+    print(f"--- {len(new_feed_entries)} ورودی جدید از {len(merged_feed_entries)} ورودی فید یافت شد.")
+    failed_entries_count, skipped_entries_count = run_backlog(new_feed_entries) if new_feed_entries else (0, 0)
+    entries_left_for_next_poll = BACKLOG_MAX_ENTRIES > 0 and len(new_feed_entries) > BACKLOG_MAX_ENTRIES
+    # run_backlog نتیجه را به تفکیک منبع برنمی‌گرداند؛ در صورت خطا وضعیت هیچ منبعِ دارای ورودی جدید ذخیره نمی‌شود
+    skipped_source_names = {name for name, count in new_entries_by_source.items() if count} if failed_entries_count or entries_left_for_next_poll else ()
+    save_feed_source_validators(feed_state, fetch_results, skipped_source_names)
+    return new_entries_by_source, failed_entries_count, skipped_entries_count, source_errors
+
+def write_daemon_health(health):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    health_path = os.path.join(STATE_DIR, DAEMON_HEALTH_FILE)
+    with open(health_path + ".tmp", "w", encoding="utf-8") as health_file:
+        json.dump(health, health_file, ensure_ascii=False, indent=2)
+    os.replace(health_path + ".tmp", health_path)
+
+def run_daemon(min_poll_interval, max_poll_interval):
+    """
+    فید منابع را در یک Process دائمی نظرسنجی می‌کند. هر منبع زمان‌بندی جداگانه دارد: پس از یافتن خبر جدید فاصله آن
+    به کمینه خودش (poll_interval پروفایل یا min_poll_interval) برمی‌گردد و در زمان آرامی فید (یا خطا) هر بار
+    DAEMON_BACKOFF_FACTOR برابر تا سقف max_poll_interval بیشتر می‌شود. منابعی که هم‌زمان سررسید شوند با هم دریافت می‌شوند.
+    SIGTERM/SIGINT چرخه جاری را قطع نمی‌کند؛ daemon پس از پایان آن خارج می‌شود. وضعیت در STATE_DIR/DAEMON_HEALTH_FILE ثبت می‌شود.
+    """
+    logger = Logger(log_file=MASTER_LOG_FILE, jsonl_file=MASTER_LOG_JSONL_FILE)
+    sys.stdout = logger
+    stop_event = threading.Event()
+
+    def request_shutdown(signal_number, _frame):
+        print(f"--- [Daemon] سیگنال {signal.Signals(signal_number).name} دریافت شد؛ پس از پایان چرخه جاری خارج می‌شود.")
+        stop_event.set()
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    def source_min_interval(feed_source):
+        return float(feed_source.get("poll_interval") or min_poll_interval)
+
+    source_schedules = {
+        feed_source["name"]: {"poll_interval_seconds": source_min_interval(feed_source), "next_poll_at": 0.0, "last_error": None}
+        for feed_source in FEED_SOURCES
+    }
+    health = {
+        "pid": os.getpid(), "status": "starting", "started_at": datetime.now().isoformat(timespec="seconds"),
+        "polls": 0, "entries_published": 0, "entries_skipped": 0, "entries_failed": 0, "consecutive_failures": 0,
+        "last_poll_at": None, "last_success_at": None, "last_new_entries_at": None, "last_error": None,
+        "poll_interval_seconds": min_poll_interval, "next_poll_at": None, "sources": {},
+    }
+    print(f"شروع daemon فید RSS ({len(FEED_SOURCES)} منبع، فاصله نظرسنجی {min_poll_interval} تا {max_poll_interval} ثانیه، PID {os.getpid()})")
+    try:
+        feed_state = load_feed_state()
+        while not stop_event.is_set():
+            due_sources = [feed_source for feed_source in FEED_SOURCES if source_schedules[feed_source["name"]]["next_poll_at"] <= time.time()]
+            health["polls"] += 1
+            # بودجه تلاش مجدد برای هر چرخه daemon است؛ در غیر این صورت پس از چند چرخه پرخطا برای همیشه تمام می‌شود
+            retry_budget.reset()
+            health["status"] = "polling"
+            health["last_poll_at"] = datetime.now().isoformat(timespec="seconds")
+            write_daemon_health(health)
+            new_entries_by_source, failed_entries_count, skipped_entries_count, source_errors, cycle_failed = {}, 0, 0, {}, False
+            try:
+                new_entries_by_source, failed_entries_count, skipped_entries_count, source_errors = poll_feed_once(feed_state, due_sources)
+                cycle_failed = failed_entries_count > 0 or bool(source_errors)
+                if failed_entries_count: health["last_error"] = f"{failed_entries_count} ورودی ناموفق بود."
+                elif source_errors: health["last_error"] = "; ".join(f"{name}: {error}" for name, error in source_errors.items())
+            except Exception as poll_exception:
+                cycle_failed = True
+                health["last_error"] = f"{type(poll_exception).__name__}: {poll_exception}"
+                source_errors = {feed_source["name"]: health["last_error"] for feed_source in due_sources}
+                print(f"!!! [Daemon] خطا در چرخه {health['polls']}: {health['last_error']}")
+                tb_lines = traceback.format_exception(type(poll_exception), poll_exception, poll_exception.__traceback__)
+                for line in tb_lines[-8:]: print(line.strip())
+            new_entries_count = sum(new_entries_by_source.values())
+            health["entries_published"] += new_entries_count - failed_entries_count - skipped_entries_count
+            health["entries_skipped"] += skipped_entries_count
+            health["entries_failed"] += failed_entries_count
+            if cycle_failed: health["consecutive_failures"] += 1
+            else:
+                health["consecutive_failures"] = 0
+                health["last_success_at"] = health["last_poll_at"]
+            if new_entries_count: health["last_new_entries_at"] = health["last_poll_at"]
+            for feed_source in due_sources:
+                schedule = source_schedules[feed_source["name"]]
+                source_new_entries = new_entries_by_source.get(feed_source["name"], 0)
+                schedule["last_error"] = source_errors.get(feed_source["name"])
+                # خبر جدید بدون خطا فاصله را به کمینه برمی‌گرداند؛ آرامی فید یا خطا (دریافت یا پردازش ورودی‌های همین منبع) backoff می‌شود
+                if source_new_entries and not schedule["last_error"] and not failed_entries_count:
+                    schedule["poll_interval_seconds"] = source_min_interval(feed_source)
+                else:
+                    schedule["poll_interval_seconds"] = min(max(max_poll_interval, source_min_interval(feed_source)), schedule["poll_interval_seconds"] * DAEMON_BACKOFF_FACTOR)
+                schedule["next_poll_at"] = time.time() + schedule["poll_interval_seconds"]
+            # متریک‌ها فقط برای چرخه‌هایی که کاری انجام داده‌اند ثبت می‌شوند و سپس از صفر شروع می‌شوند
+            if new_entries_count or cycle_failed:
+                try: run_metrics.write(1 if cycle_failed else 0)
+                except OSError as e_metrics: print(f"!!! هشدار: ذخیره متریک‌های چرخه ناموفق بود: {e_metrics}")
+                run_metrics.reset()
+            next_poll_at = min(schedule["next_poll_at"] for schedule in source_schedules.values())
+            poll_interval = max(0.0, next_poll_at - time.time())
+            health["status"] = "sleeping"
+            health["poll_interval_seconds"] = poll_interval
+            health["next_poll_at"] = datetime.fromtimestamp(next_poll_at).isoformat(timespec="seconds")
+            health["sources"] = {
+                name: {"poll_interval_seconds": schedule["poll_interval_seconds"], "last_error": schedule["last_error"],
+                       "next_poll_at": datetime.fromtimestamp(schedule["next_poll_at"]).isoformat(timespec="seconds")}
+                for name, schedule in source_schedules.items()
+            }
+            write_daemon_health(health)
+            print(f"--- [Daemon] heartbeat: چرخه {health['polls']} ({len(due_sources)} منبع)، {new_entries_count} ورودی جدید، {failed_entries_count} ناموفق، "
+                  f"{health['consecutive_failures']} خطای پیاپی؛ نظرسنجی بعدی {poll_interval:.0f} ثانیه دیگر.")
+            stop_event.wait(poll_interval)
+    finally:
+        health["status"] = "stopped"
+        health["next_poll_at"] = None
+        try: write_daemon_health(health)
+        except OSError as e_health: print(f"!!! هشدار: ذخیره وضعیت daemon ناموفق بود: {e_health}")
+        if _translation_memory: _translation_memory.log_stats()
+        if _media_sideloader: _media_sideloader.log_stats()
+        http_client.log_stats()
+        gemini_scheduler.log_stats()
+        print(f"daemon متوقف شد ({health['polls']} چرخه، {health['entries_published']} پست منتشر شد).")
+        logger.close()
+        sys.stdout = logger.terminal
+    return 0
+
+def retry_checkpointed_articles(checkpoint_store, links):
+    """مقاله‌های گیرکرده را از آخرین مرحله کامل‌شده دوباره اجرا می‌کند؛ مقاله‌ای که در این فاصله ثبت شده فقط از checkpoint حذف می‌شود."""
+    logger = Logger(log_file=MASTER_LOG_FILE, jsonl_file=MASTER_LOG_JSONL_FILE)
+    sys.stdout = logger
+    failed_entries_count = 0
+    try:
+        articles = [checkpoint_store.get_article(link) for link in links]
+        for link, article in zip(links, articles):
+            if article is None: print(f"!!! checkpoint برای لینک '{link}' یافت نشد.")
+        articles = [article for article in articles if article]
+        processed_links = find_processed_links([article["link"] for article in articles]) if articles else set()
+        retry_entries = []
+        for article in articles:
+            if article["link"] in processed_links and "post" not in article["stages"]:
+                print(f"--- '{article['link']}' قبلاً در وردپرس ثبت شده است؛ checkpoint آن حذف می‌شود.")
+                checkpoint_store.complete(article["link"])
+                continue
+            retry_entries.append(feedparser.FeedParserDict(article["entry"]))
+        if retry_entries: failed_entries_count = run_backlog(retry_entries)[0]
+        else: print("*** مقاله‌ای برای اجرای مجدد وجود ندارد. ***")
+    finally:
+        if _translation_memory: _translation_memory.log_stats()
+        http_client.log_stats()
+        gemini_scheduler.log_stats()
+        try: run_metrics.write(1 if failed_entries_count else 0)
+        except OSError as e_metrics: print(f"!!! هشدار: ذخیره متریک‌های اجرا ناموفق بود: {e_metrics}")
+        logger.close()
+        sys.stdout = logger.terminal
+    return 1 if failed_entries_count else 0
+
+def run_checkpoints_command(cli_args):
+    checkpoint_store = get_checkpoint_store()
+    if checkpoint_store is None:
+        print("!!! ذخیره‌ساز checkpoint در دسترس نیست (CHECKPOINTS_ENABLED=0 یا خطای SQLite).")
+        return 1
+    if cli_args.checkpoints_command == "list":
+        articles = checkpoint_store.list_articles()
+        if not articles: print("هیچ مقاله نیمه‌کاره‌ای وجود ندارد.")
+        for article in articles:
+            print(f"[{article['status']}] تلاش {article['attempts']}، به‌روزرسانی {datetime.fromtimestamp(article['updated_at']).isoformat(timespec='seconds')}، "
+                  f"مراحل: {', '.join(article['stages']) or '-'}")
+            print(f"      {article['title']}\n      {article['link']}")
+            if article["last_error"]: print(f"      خطا: {article['last_error']}")
+        return 0
+    if cli_args.checkpoints_command == "show":
+        article = checkpoint_store.get_article(cli_args.link)
+        if article is None:
+            print(f"!!! checkpoint برای لینک '{cli_args.link}' یافت نشد.")
+            return 1
+        if cli_args.stage:
+            if cli_args.stage not in article["stages"]:
+                print(f"!!! مرحله '{cli_args.stage}' در checkpoint نیست (مراحل موجود: {', '.join(article['stages']) or '-'}).")
+                return 1
+            stage_value = article["stages"][cli_args.stage]
+            print(stage_value if isinstance(stage_value, str) else json.dumps(stage_value, ensure_ascii=False, indent=2))
+            return 0
+        print(json.dumps({key: value for key, value in article.items() if key not in ("entry", "stages")}, ensure_ascii=False, indent=2))
+        for stage_name, stage_value in article["stages"].items():
+            print(f"--- {stage_name}: {len(json.dumps(stage_value, ensure_ascii=False))} کاراکتر")
+        return 0
+    if cli_args.checkpoints_command == "retry":
+        links = cli_args.links or ([article["link"] for article in checkpoint_store.list_articles()] if cli_args.all else [])
+        if not links:
+            print("!!! لینک مقاله یا --all را مشخص کنید.")
+            return 1
+        return retry_checkpointed_articles(checkpoint_store, links)
+    if cli_args.checkpoints_command == "purge":
+        if cli_args.links: purged_count = checkpoint_store.purge(cli_args.links)
+        elif cli_args.older_than is not None: purged_count = checkpoint_store.purge(older_than=time.time() - cli_args.older_than * 86400)
+        elif cli_args.all: purged_count = checkpoint_store.purge()
+        else:
+            print("!!! لینک مقاله، --older-than یا --all را مشخص کنید.")
+            return 1
+        print(f"{purged_count} checkpoint حذف شد.")
+        return 0
+    return 1
+
+def build_cli_parser():
+    cli_parser = argparse.ArgumentParser(description="انتقال خبرهای فید RSS به وردپرس با ترجمه Gemini")
+    subcommands = cli_parser.add_subparsers(dest="command")
+    subcommands.add_parser("run", help="یک اجرای کامل و خروج (پیش‌فرض، برای cron)")
+    daemon_parser = subcommands.add_parser("daemon", help="اجرای دائمی با نظرسنجی تطبیقی فید")
+    daemon_parser.add_argument("--min-interval", type=float, default=DAEMON_MIN_POLL_INTERVAL, help="کمترین فاصله نظرسنجی فید (ثانیه)")
+    daemon_parser.add_argument("--max-interval", type=float, default=DAEMON_MAX_POLL_INTERVAL, help="بیشترین فاصله نظرسنجی فید (ثانیه)")
+    checkpoints_parser = subcommands.add_parser("checkpoints", help="مدیریت مقاله‌های نیمه‌کاره (checkpoint)")
+    checkpoint_commands = checkpoints_parser.add_subparsers(dest="checkpoints_command", required=True)
+    checkpoint_commands.add_parser("list", help="لیست مقاله‌های نیمه‌کاره")
+    show_parser = checkpoint_commands.add_parser("show", help="نمایش checkpoint یک مقاله")
+    show_parser.add_argument("link", help="لینک ورودی فید")
+    show_parser.add_argument("--stage", help="نمایش کامل خروجی یک مرحله (captions، title، translate_body، payload، post)")
+    retry_parser = checkpoint_commands.add_parser("retry", help="اجرای مجدد مقاله‌ها از آخرین مرحله کامل‌شده")
+    retry_parser.add_argument("links", nargs="*", help="لینک ورودی‌های فید")
+    retry_parser.add_argument("--all", action="store_true", help="تمام مقاله‌های نیمه‌کاره")
+    purge_parser = checkpoint_commands.add_parser("purge", help="حذف checkpoint مقاله‌ها")
+    purge_parser.add_argument("links", nargs="*", help="لینک ورودی‌های فید")
+    purge_parser.add_argument("--older-than", type=float, help="حذف checkpointهای قدیمی‌تر از این تعداد روز")
+    purge_parser.add_argument("--all", action="store_true", help="حذف تمام checkpointها")
+    return cli_parser
+
+# --- شروع اسکریپت اصلی ---
+if __name__ == "__main__":
+    cli_args = build_cli_parser().parse_args()
+    if cli_args.command == "daemon":
+        sys.exit(run_daemon(cli_args.min_interval, cli_args.max_interval))
+    if cli_args.command == "checkpoints":
+        sys.exit(run_checkpoints_command(cli_args))
+
+    logger = Logger(log_file=MASTER_LOG_FILE, jsonl_file=MASTER_LOG_JSONL_FILE)
+    sys.stdout = logger
+
+    main_script_start_time = time.time()
+    print(f"شروع پردازش فید RSS و ارسال به وردپرس")
+
+    entry_progress = {"title": "نامشخص", "link": None, "translated_title": "نامشخص"}
+    # ETag/Last-Modified جدید فقط وقتی ذخیره می‌شود که تمام ورودی‌های این نسخه فید با موفقیت پردازش شده باشند
+    run_completed_successfully = False
+    feed_state = {}
+    feed_fetch_results = []
+
+    try:
+        # فید پیش از لیست لینک‌های پردازش شده دریافت می‌شود تا در ساعت‌های بدون خبر هیچ درخواستی به وردپرس نرود
+        print(f"\n>>> مرحله ۰: دریافت شرطی و تجزیه فید {len(FEED_SOURCES)} منبع...");
+        feed_state = load_feed_state()
+        with run_metrics.timed("feed_fetch"):
+            feed_fetch_results = fetch_feed_sources(FEED_SOURCES, feed_state)
+        if all(fetch_result["error"] for fetch_result in feed_fetch_results):
+            raise ValueError("دریافت فید تمام منابع ناموفق بود.")
+        if all(fetch_result["parsed"] is None for fetch_result in feed_fetch_results):
+            print("*** فید منابع از اجرای قبلی تغییری نکرده است (304 Not Modified). کاری برای انجام نیست. ***")
+            sys.exit(0)
+        merged_feed_entries = merge_feed_entries(feed_fetch_results)
+        if not merged_feed_entries: raise ValueError("هیچ پستی در فید RSS یافت نشد.")
+        print(f"--- {len(merged_feed_entries)} ورودی یکتا از فید منابع ادغام شد.")
+        print("<<< مرحله ۰ کامل شد.");
+
+        print("\n>>> مرحله ۱: بررسی پست‌های تکراری...");
+        candidate_feed_entries = merged_feed_entries if BACKLOG_MODE else merged_feed_entries[:1]
+        with run_metrics.timed("find_processed_links"):
+            processed_links = find_processed_links([getattr(feed_entry, 'link', None) for feed_entry in candidate_feed_entries])
+        print(f"--- {len(processed_links)} لینک از ورودی‌های فید قبلاً پردازش شده است.")
+
+        if BACKLOG_MODE:
+            new_feed_entries = select_new_feed_entries(merged_feed_entries, processed_links)
+            print(f"--- {len(new_feed_entries)} ورودی جدید از {len(merged_feed_entries)} ورودی فید یافت شد.")
+            print("<<< مرحله ۱ کامل شد.");
+            if not new_feed_entries:
+                print("*** هیچ ورودی جدیدی برای پردازش وجود ندارد. ***")
+                run_completed_successfully = True
+                sys.exit(0)
+            failed_entries_count = run_backlog(new_feed_entries)[0]
+            if failed_entries_count: sys.exit(1)
+            # اگر سقف بک‌لاگ بخشی از ورودی‌ها را کنار گذاشت، اجرای بعد نباید 304 بگیرد
+            run_completed_successfully = not (BACKLOG_MAX_ENTRIES > 0 and len(new_feed_entries) > BACKLOG_MAX_ENTRIES)
+            sys.exit(0)
+
+        latest_post_from_feed = merged_feed_entries[0]
+        entry_progress["title"] = latest_post_from_feed.title
+        entry_progress["link"] = getattr(latest_post_from_feed, 'link', None)
+
+        if not entry_progress["link"]:
+            raise ValueError("پست یافت شده فاقد لینک منبع (link) است. امکان بررسی تکراری بودن وجود ندارد.")
+
+        if entry_progress["link"] in processed_links:
+            print("\n" + "*"*60)
+            print(f"*** پست تکراری یافت شد. این پست قبلاً پردازش شده است. ***")
+            print(f"*** عنوان: {entry_progress['title']}")
+            print(f"*** لینک: {entry_progress['link']}")
+            print("*"*60 + "\n")
+            run_completed_successfully = True
+            sys.exit(0)
+
+        print(f"--- جدیدترین پست (غیر تکراری) انتخاب شد: '{entry_progress['title']}' (لینک: {entry_progress['link']})")
+        print("<<< مرحله ۱ کامل شد.");
+
+        entry_start_time = time.time()
+        try:
+            with log_context(article=entry_progress["link"]):
+                post_response = process_feed_entry(latest_post_from_feed, entry_progress)
+            # همان وضعیت‌های run_backlog: خبر تکراری کنارگذاشته‌شده در متریک‌ها پست منتشرشده حساب نمی‌شود
+            if post_response and post_response.get("duplicate_of"):
+                entry_progress["status"], entry_progress["duplicate_of"] = "skipped_duplicate", post_response["duplicate_of"]
+            else: entry_progress["status"] = "ok"
+        except Exception as entry_exception:
+            entry_progress["status"], entry_progress["error"] = "failed", f"{type(entry_exception).__name__}: {entry_exception}"
+            raise
+        finally:
+            entry_progress["duration"] = time.time() - entry_start_time
+            run_metrics.record_article(entry_progress)
+        run_completed_successfully = True
 
     except Exception as global_exception:
         print("\n" + "!"*70 + "\n!!! خطای کلی و بحرانی در اجرای اسکریپت رخ داد. هیچ پستی ایجاد نشد. !!!")
-        print(f"!!! عنوان پست اصلی (انگلیسی): {original_post_title_english_for_error}")
-        print(f"!!! لینک منبع (در صورت وجود): {post_original_link_from_feed}")
-        print(f"!!! عنوان ترجمه شده (در صورت وجود): {final_translated_title_for_error}")
+        print(f"!!! عنوان پست اصلی (انگلیسی): {entry_progress['title']}")
+        print(f"!!! لینک منبع (در صورت وجود): {entry_progress['link']}")
+        print(f"!!! عنوان ترجمه شده (در صورت وجود): {entry_progress['translated_title']}")
         print(f"!!! نوع خطا: {type(global_exception).__name__}"); print(f"!!! پیام خطا: {global_exception}")
         print("--- جزئیات Traceback (آخرین بخش‌ها) ---")
         tb_lines = traceback.format_exception(type(global_exception), global_exception, global_exception.__traceback__)
@@ -825,7 +3572,17 @@ if __name__ == "__main__":
         sys.exit(1)
 
     finally:
+        if run_completed_successfully: save_feed_source_validators(feed_state, feed_fetch_results)
         total_script_execution_time = time.time() - main_script_start_time
+        if _translation_memory: _translation_memory.log_stats()
+        if _media_sideloader: _media_sideloader.log_stats()
+        http_client.log_stats()
+        gemini_scheduler.log_stats()
+        propagating_exception = sys.exc_info()[1]
+        if isinstance(propagating_exception, SystemExit): run_exit_code = propagating_exception.code if isinstance(propagating_exception.code, int) else int(propagating_exception.code is not None)
+        else: run_exit_code = 1 if propagating_exception else 0
+        try: run_metrics.write(run_exit_code)
+        except OSError as e_metrics: print(f"!!! هشدار: ذخیره متریک‌های اجرا ناموفق بود: {e_metrics}")
         print(f"\nاسکریپت به پایان رسید (زمان کل: {total_script_execution_time:.2f} ثانیه).")
         if 'logger' in locals() and isinstance(logger, Logger):
             logger.close()
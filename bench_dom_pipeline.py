@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# بنچمارک پایپ‌لاین تبدیل DOM:
+# زنجیره قدیمی (هر تابع یک‌بار parse و یک‌بار str(soup)) در برابر پایپ‌لاین تک‌parse
+# اجرا: python bench_dom_pipeline.py [--paragraphs 400] [--figures 40] [--repeat 5]
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import re
+import statistics
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+
+def load_aup_module():
+    # au-p.py در زمان import متغیرهای محیطی ضروری را بررسی می‌کند؛ برای بنچمارک مقادیر ساختگی کافی است
+    for env_name, env_value in (("GEMAPI", "bench"), ("WORDPRESS_URL", "http://wordpress.invalid"), ("WORDPRESS_USER", "bench"), ("WORDPRESS_PASS", "bench")):
+        os.environ.setdefault(env_name, env_value)
+    # بررسی عکس‌ها درخواست شبکه می‌فرستد و ربطی به هزینه DOM ندارد
+    os.environ.setdefault("IMAGE_PROBE_ENABLED", "0")
+    module_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "au-p.py")
+    spec = importlib.util.spec_from_file_location("au_p", module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_long_article(paragraphs_count, figures_count):
+    """یک مقاله تحلیلی طولانی و ساختگی با عکس، کپشن، لینک NewsBTC و بخش‌های اضافی می‌سازد."""
+    parts = []
+    captions = []
+    figure_every = max(1, paragraphs_count // max(1, figures_count))
+    figure_idx = 0
+    for p_idx in range(paragraphs_count):
+        parts.append(
+            f'<p>Bitcoin price started a fresh increase above the <strong>$6{p_idx % 10},500</strong> zone. '
+            f'BTC is now trading above <a href="https://www.newsbtc.com/analysis/btc/item-{p_idx}/">the 100 hourly SMA</a> '
+            f'and there was a break above a key bearish trend line with resistance at $6{p_idx % 10},800 on the hourly chart.</p>'
+        )
+        if p_idx % 7 == 3:
+            parts.append(f'<h2>Key level {p_idx}</h2>')
+        if p_idx % 11 == 5:
+            parts.append('<p></p>')
+        if p_idx % figure_every == 0 and figure_idx < figures_count:
+            img_src = f"https://www.newsbtc.com/wp-content/uploads/2025/05/chart-{figure_idx}.png?resize=800%2C450"
+            parts.append(f'<figure class="wp-block-image"><img src="{img_src}" alt="" srcset="{img_src} 800w, {img_src} 1600w" /></figure>')
+            captions.append({
+                "image_url": f"https://www.newsbtc.com/wp-content/uploads/2025/05/chart-{figure_idx}.png",
+                "caption": f"<figcaption>نمودار قیمت بیت‌کوین شماره {figure_idx}</figcaption>",
+                "original_alt": "",
+            })
+            figure_idx += 1
+    parts.append('<p>Related Reading: Bitcoin Price Could Surge</p>')
+    parts.append('<p>Featured image from Unsplash, chart from TradingView.com</p>')
+    parts.append('<p>Disclaimer: The article is provided for educational purposes only.</p>')
+    return "\n".join(parts), captions
+
+
+def run_legacy_chain(aup, raw_html, captions):
+    # زنجیره قبلی __main__: هر مرحله رشته می‌گیرد، parse می‌کند و دوباره str(soup) برمی‌گرداند
+    html = aup.remove_boilerplate_sections(raw_html)
+    html = aup.remove_newsbtc_links(html)
+    html = aup.resolve_tradingview_links(html)
+    html = aup.proxy_all_images(html)
+    html, placeholder_map = aup.replace_images_with_placeholders(html)
+    translated = html  # ترجمه ساختگی: متن بدون تغییر برمی‌گردد
+    html = aup.restore_images_from_placeholders(translated, placeholder_map)
+    html = aup.add_captions_to_images(html, captions)
+    soup = BeautifulSoup(html, "html.parser")
+    aup.finalize_content_in_soup(soup, "عنوان")
+    return str(soup)
+
+
+def run_single_parse_pipeline(aup, raw_html, captions):
+    content_with_placeholders, placeholder_map = aup.prepare_content_for_translation(raw_html)
+    translated = content_with_placeholders
+    return aup.build_final_content(translated, placeholder_map, captions, "عنوان")
+
+
+def measure(label, func, repeat):
+    cpu_times, wall_times, peaks = [], [], []
+    output = ""
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            tracemalloc.start()
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            output = func()
+            cpu_times.append(time.process_time() - cpu_start)
+            wall_times.append(time.perf_counter() - wall_start)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    return {
+        "label": label,
+        "cpu": statistics.median(cpu_times),
+        "wall": statistics.median(wall_times),
+        "peak": statistics.median(peaks),
+        "output": output,
+    }
+
+
+def normalize_output(html):
+    # شناسه‌های Placeholder تصادفی‌اند و در خروجی نهایی اهمیتی ندارند
+    return re.sub(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", "UUID", html)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="بنچمارک پایپ‌لاین DOM تک‌parse در برابر زنجیره str(soup)")
+    parser.add_argument("--paragraphs", type=int, default=400)
+    parser.add_argument("--figures", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    aup = load_aup_module()
+    raw_html, captions = build_long_article(args.paragraphs, args.figures)
+    print(f"مقاله ساختگی: {len(raw_html)} کاراکتر، {args.paragraphs} پاراگراف، {args.figures} عکس")
+
+    legacy = measure("زنجیره قدیمی str(soup)", lambda: run_legacy_chain(aup, raw_html, captions), args.repeat)
+    single = measure("پایپ‌لاین تک‌parse", lambda: run_single_parse_pipeline(aup, raw_html, captions), args.repeat)
+
+    print("=" * 70)
+    for result in (legacy, single):
+        print(f"{result['label']:<28} CPU: {result['cpu'] * 1000:8.1f} ms   Wall: {result['wall'] * 1000:8.1f} ms   اوج حافظه: {result['peak'] / 1024 / 1024:6.2f} MB")
+    print("=" * 70)
+    print(f"صرفه‌جویی CPU: {(1 - single['cpu'] / legacy['cpu']) * 100:.1f}%   صرفه‌جویی اوج حافظه: {(1 - single['peak'] / legacy['peak']) * 100:.1f}%")
+    outputs_match = normalize_output(legacy["output"]) == normalize_output(single["output"])
+    print(f"خروجی دو مسیر یکسان است: {'بله' if outputs_match else 'خیر'}")
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# بنچمارک backendهای پارسر HTML: سرعت parse و سریال‌سازی (str(soup)) هر backend روی یک مقاله طولانی و یک صفحه کامل.
+# هم‌ارزی خروجی با html.parser در tests/test_html_parser_equivalence.py بررسی می‌شود
+# اجرا: python bench_html_parsers.py [--paragraphs 400] [--figures 40] [--repeat 5]
+import argparse
+import statistics
+import time
+
+from bs4 import BeautifulSoup
+
+from bench_dom_pipeline import build_long_article
+
+
+def available_soup_backends():
+    backends = ["html.parser"]
+    for backend, module_name in (("lxml", "lxml.etree"), ("html5lib", "html5lib")):
+        try:
+            __import__(module_name)
+            backends.append(backend)
+        except ImportError:
+            print(f"--- {backend} نصب نیست و بررسی نمی‌شود.")
+    return backends
+
+
+def build_full_page(article_html):
+    # صفحه کامل شبیه صفحه‌ای که crawl_captions دریافت می‌کند: head حجیم، منو، مقاله و فوتر
+    head = "".join(f'<link rel="stylesheet" href="https://www.newsbtc.com/css/{idx}.css"><script src="https://www.newsbtc.com/js/{idx}.js"></script>' for idx in range(40))
+    nav = "<nav><ul>" + "".join(f'<li><a href="https://www.newsbtc.com/category/{idx}/">Category {idx}</a></li>' for idx in range(120)) + "</ul></nav>"
+    footer = "<footer>" + "".join(f"<div class=\"widget\"><h3>Widget {idx}</h3><p>Footer text {idx}</p></div>" for idx in range(60)) + "</footer>"
+    return f"<!DOCTYPE html><html><head><title>Bench</title>{head}</head><body>{nav}<article>{article_html}</article>{footer}</body></html>"
+
+
+def measure_throughput(label, parse_func, serialize_func, markup, repeat):
+    parse_times, serialize_times = [], []
+    for _ in range(repeat):
+        parse_start = time.perf_counter()
+        parsed = parse_func(markup)
+        parse_times.append(time.perf_counter() - parse_start)
+        serialize_start = time.perf_counter()
+        serialize_func(parsed)
+        serialize_times.append(time.perf_counter() - serialize_start)
+    size_mb = len(markup.encode("utf-8")) / 1024 / 1024
+    parse_seconds, serialize_seconds = statistics.median(parse_times), statistics.median(serialize_times)
+    print(f"{label:<34} parse: {parse_seconds * 1000:8.1f} ms ({size_mb / parse_seconds:5.2f} MB/s)   "
+          f"serialize: {serialize_seconds * 1000:8.1f} ms ({size_mb / serialize_seconds:5.2f} MB/s)")
+
+
+def run_throughput(backends, inputs, repeat):
+    print("=" * 70)
+    for input_label, markup in inputs:
+        print(f"--- {input_label}: {len(markup)} کاراکتر")
+        for backend in backends:
+            measure_throughput(f"BeautifulSoup + {backend}", lambda text, backend=backend: BeautifulSoup(text, backend), str, markup, repeat)
+        try:
+            from selectolax.parser import HTMLParser
+        except ImportError:
+            continue
+        # فقط برای مقایسه: درخت selectolax جایگزین API درخت BeautifulSoup در تبدیل‌های au-p.py نمی‌شود
+        measure_throughput("selectolax (مرجع)", HTMLParser, lambda tree: tree.html, markup, repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="سرعت parse و سریال‌سازی backendهای پارسر HTML")
+    parser.add_argument("--paragraphs", type=int, default=400)
+    parser.add_argument("--figures", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    backends = available_soup_backends()
+    article_html = build_long_article(args.paragraphs, args.figures)[0]
+    run_throughput(backends, [("مقاله طولانی", article_html), ("صفحه کامل", build_full_page(article_html))], args.repeat)
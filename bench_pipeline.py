@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+# بنچمارک آفلاین کل پایپ‌لاین au-p.py:
+# یک سرور HTTP محلی (به عنوان HTTP_PROXY) نقش NewsBTC (فید و صفحه مقاله)، TradingView، Gemini و وردپرس را بازی می‌کند.
+# au-p.py بدون تغییر و در یک Process جداگانه اجرا می‌شود و زمان هر مرحله از metrics.jsonl همان اجرا خوانده می‌شود.
+# اجرا: python bench_pipeline.py [--feed-size 5] [--paragraphs 120] [--figures 8] [--repeat 3]
+#        [--gemini-latency-ms 800] [--gemini-error-rate 0.1] [--streaming 0] [--env GEMINI_CHUNKED_TRANSLATION=1]
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from xml.sax.saxutils import escape
+
+NEWSBTC_HOST = "www.newsbtc.com"
+TRADINGVIEW_HOST = "www.tradingview.com"
+TRADINGVIEW_SNAPSHOT_HOST = "s3.tradingview.com"
+GEMINI_HOST = "generativelanguage.googleapis.com"
+WORDPRESS_HOST = "wordpress.bench"
+
+# کوچک‌ترین PNG معتبر (۱×۱) برای پاسخ درخواست‌های عکس
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000100ffff03000006000557bfabd40000000049454e44ae426082"
+)
+
+
+# واژه‌های متن مقاله‌های ساختگی؛ هر مقاله زیرمجموعه تصادفی (با seed ثابت) خودش را دارد تا مثل خبرهای واقعی واژگان متفاوتی داشته باشند
+# و بررسی خبر تکراری (SimHash) آن‌ها را تکراری تشخیص ندهد
+ARTICLE_VOCABULARY = (
+    "bitcoin ethereum solana cardano ripple dogecoin litecoin polkadot chainlink avalanche price rally dip breakout breakdown "
+    "support resistance zone level trend line channel wedge triangle flag candle wick close volume liquidity whales miners "
+    "exchange inflows outflows funding rate open interest futures options spot etf approval regulators lawsuit treasury yields "
+    "inflation dollar index equities sentiment fear greed halving hashrate difficulty staking validators upgrade fork mainnet "
+    "testnet layer bridge stablecoin reserves custody institutional retail traders analysts momentum oversold overbought divergence"
+).split()
+
+
+def build_article_content(article_idx, paragraphs_count, figures_count):
+    """محتوای content:encoded یک مقاله ساختگی: پاراگراف، تیتر، عکس با لینک TradingView، لینک NewsBTC و بخش‌های اضافی."""
+    article_random = random.Random(f"article-{article_idx}")
+    article_words = article_random.sample(ARTICLE_VOCABULARY, 16)
+    parts = []
+    figure_every = max(1, paragraphs_count // max(1, figures_count))
+    figure_idx = 0
+    for p_idx in range(paragraphs_count):
+        sentence_words = [article_random.choice(article_words) for _ in range(24)]
+        parts.append(
+            f'<p>{" ".join(sentence_words[:8]).capitalize()} <strong>${article_random.randrange(1000, 99000, 50):,}</strong> '
+            f'{" ".join(sentence_words[8:14])} <a href="http://{NEWSBTC_HOST}/analysis/btc/item-{article_idx}-{p_idx}/">{" ".join(sentence_words[14:17])}</a> '
+            f'{" ".join(sentence_words[17:])} ${article_random.randrange(1000, 99000, 50):,}.</p>'
+        )
+        if p_idx % 7 == 3: parts.append(f'<h2>{" ".join(article_random.sample(article_words, 3)).title()} {p_idx}</h2>')
+        if p_idx % figure_every == 0 and figure_idx < figures_count:
+            if figure_idx % 2 == 0:
+                chart_id = f"bench{article_idx}x{figure_idx}"
+                parts.append(f'<figure class="wp-block-image"><a href="http://{TRADINGVIEW_HOST}/x/{chart_id}/"><img src="http://{TRADINGVIEW_HOST}/x/{chart_id}/" alt="" /></a></figure>')
+            else:
+                img_src = f"http://{NEWSBTC_HOST}/wp-content/uploads/bench/{article_idx}-{figure_idx}.png"
+                parts.append(f'<figure class="wp-block-image"><img src="{img_src}?resize=800%2C450" alt="" /></figure>')
+            figure_idx += 1
+    parts.append('<p>Related Reading: Bitcoin Price Could Surge</p>')
+    parts.append('<p>Featured image from Unsplash, chart from TradingView.com</p>')
+    return "\n".join(parts)
+
+
+def build_article_page(article_idx, figures_count):
+    """صفحه HTML مقاله برای crawl_captions: همان عکس‌ها با figcaption."""
+    figures = []
+    for figure_idx in range(figures_count):
+        if figure_idx % 2 == 0:
+            img_src = f"http://{TRADINGVIEW_HOST}/x/bench{article_idx}x{figure_idx}/"
+        else:
+            img_src = f"http://{NEWSBTC_HOST}/wp-content/uploads/bench/{article_idx}-{figure_idx}.png"
+        figures.append(f'<figure><img src="{img_src}" alt="chart {figure_idx}" /><figcaption>BTC price chart {figure_idx} for article {article_idx}. Source: <a href="https://www.tradingview.com">TradingView.com</a></figcaption></figure>')
+    return f"<html><head><title>Article {article_idx}</title></head><body><article>{''.join(figures)}</article></body></html>"
+
+
+def build_feed_xml(scenario):
+    items = []
+    for article_idx in range(scenario["feed_size"]):
+        content_html = build_article_content(article_idx, scenario["paragraphs"], scenario["figures"])
+        items.append(
+            "<item>"
+            f"<title>Bitcoin Price Analysis {article_idx}: BTC Eyes Fresh Rally</title>"
+            f"<link>http://{NEWSBTC_HOST}/analysis/btc/bench-article-{article_idx}/</link>"
+            f"<pubDate>{formatdate(time.time() - article_idx * 3600, usegmt=True)}</pubDate>"
+            f'<media:content url="http://{NEWSBTC_HOST}/wp-content/uploads/bench/thumb-{article_idx}.png" medium="image" />'
+            f"<content:encoded>{escape(content_html)}</content:encoded>"
+            "</item>"
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<rss version="2.0" xmlns:content="http://purl.org/rss/1.0/modules/content/" xmlns:media="http://search.yahoo.com/mrss/">'
+        f"<channel><title>NewsBTC (bench)</title><link>http://{NEWSBTC_HOST}/</link>{''.join(items)}</channel></rss>"
+    ).encode("utf-8")
+
+
+def persianize_html(html_text):
+    """ترجمه ساختگی: هر واژه لاتین متن (نه تگ‌ها، ویژگی‌ها و entityها) با یک واژه فارسی جایگزین می‌شود."""
+    def persianize_text(text_match):
+        return ">" + re.sub(r"&\w+;|[A-Za-z]+", lambda word: word.group(0) if word.group(0).startswith("&") else "واژه", text_match.group(1)) + "<"
+    return re.sub(r">([^<]*)<", persianize_text, f">{html_text}<")[1:-1]
+
+
+def fake_body_translation(body_html, untranslated_rate):
+    # بخشی از پاراگراف‌ها (بر اساس هش متن و در نتیجه ثابت بین تکرارها) عمداً انگلیسی برمی‌گردند تا اعتبارسنجی خروجی و ترمیم موضعی هم اندازه‌گیری شوند
+    body_parts = re.split(r"(<p>.*?</p>)", body_html, flags=re.DOTALL)
+    for part_idx, body_part in enumerate(body_parts):
+        keep_untranslated = part_idx % 2 == 1 and int(hashlib.md5(body_part.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF < untranslated_rate
+        if not keep_untranslated: body_parts[part_idx] = persianize_html(body_part)
+    return "".join(body_parts)
+
+
+def fake_gemini_reply(prompt_text, untranslated_rate=0.0):
+    """پاسخ ساختگی Gemini بر اساس نوع پرامپت (عنوان، کپشن تکی، کپشن دسته‌ای، محتوا یا ترمیم)."""
+    if "--- متن انگلیسی برای بازنویسی: ---\n" in prompt_text:
+        body_html = prompt_text.split("--- متن انگلیسی برای بازنویسی: ---\n", 1)[1]
+        reply_parts = []
+        if 'class="summary"' in prompt_text: reply_parts.append('<div class="summary" style="font-weight: bold;">خلاصه ساختگی بنچمارک</div>')
+        reply_parts.append(fake_body_translation(body_html, untranslated_rate))
+        if 'class="conclusion"' in prompt_text: reply_parts.append('<div class="conclusion"><strong>جمع‌بندی:</strong><br>نتیجه‌گیری ساختگی.</div>')
+        return "\n".join(reply_parts)
+    if "--- قطعه HTML: ---\n" in prompt_text:
+        return persianize_html(prompt_text.split("--- قطعه HTML: ---\n", 1)[1])
+    if "کپشن‌های اصلی:\n" in prompt_text:
+        captions = json.loads(prompt_text.split("کپشن‌های اصلی:\n", 1)[1])
+        return json.dumps([{"id": caption["id"], "html": f"<figcaption>کپشن ساختگی {caption['id']}</figcaption>"} for caption in captions], ensure_ascii=False)
+    if "کپشن اصلی:" in prompt_text:
+        return "<figcaption>کپشن ساختگی</figcaption>"
+    title_match = re.search(r'عنوان اصلی انگلیسی: "(.*?)"', prompt_text)
+    return f"تحلیل قیمت بیت‌کوین {hashlib.md5((title_match.group(1) if title_match else prompt_text).encode()).hexdigest()[:6]}"
+
+
+class BenchState:
+    """وضعیت مشترک سرور: سناریو، شمارنده درخواست‌ها و لینک‌های ثبت‌شده در وردپرس ساختگی."""
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.feed_xml = build_feed_xml(scenario)
+        self.feed_etag = '"' + hashlib.sha1(self.feed_xml).hexdigest()[:16] + '"'
+        self.lock = threading.Lock()
+        self.processed_links = set()
+        self.request_counts = {}
+        self.injected_errors = {}
+        self.next_post_id = 1000
+        self.random = random.Random(scenario["seed"])
+
+    def reset_run(self):
+        with self.lock:
+            self.processed_links = set()
+            self.request_counts = {}
+            self.injected_errors = {}
+
+    def count(self, service):
+        with self.lock:
+            self.request_counts[service] = self.request_counts.get(service, 0) + 1
+
+    def should_fail(self, service):
+        with self.lock:
+            failed = self.random.random() < self.scenario["error_rates"].get(service, 0.0)
+            if failed: self.injected_errors[service] = self.injected_errors.get(service, 0) + 1
+            return failed
+
+    def sleep_latency(self, service):
+        latency_ms = self.scenario["latencies_ms"].get(service, 0)
+        if latency_ms: time.sleep(latency_ms / 1000.0 * (0.5 + self.random.random()))
+
+
+class BenchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def _target(self):
+        # درخواست از طریق HTTP_PROXY می‌رسد: path یک URL کامل است
+        parsed_url = urlparse(self.path)
+        host = parsed_url.hostname or (self.headers.get("Host") or "").split(":")[0]
+        return host, parsed_url.path or "/", parsed_url.query
+
+    def _send(self, status_code, body=b"", content_type="application/json", extra_headers=None):
+        if isinstance(body, str): body = body.encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for header_name, header_value in (extra_headers or {}).items(): self.send_header(header_name, header_value)
+        self.end_headers()
+        if self.command != "HEAD": self.wfile.write(body)
+
+    def _send_json(self, status_code, payload):
+        self._send(status_code, json.dumps(payload, ensure_ascii=False))
+
+    def _read_json(self):
+        content_length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(content_length) if content_length else b""
+        # بدنه آپلود رسانه فایل باینری عکس است
+        if "json" not in (self.headers.get("Content-Type") or ""): return {}
+        return json.loads(raw_body.decode("utf-8")) if raw_body else {}
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        host, path, _ = self._target()
+        if host == NEWSBTC_HOST and path == "/feed/":
+            self.state.count("feed"); self.state.sleep_latency("scraper")
+            if self.headers.get("If-None-Match") == self.state.feed_etag: return self._send(304, b"", "application/rss+xml", {"ETag": self.state.feed_etag})
+            return self._send(200, self.state.feed_xml, "application/rss+xml; charset=UTF-8", {"ETag": self.state.feed_etag})
+        if host == NEWSBTC_HOST and path.startswith("/analysis/"):
+            self.state.count("article_page"); self.state.sleep_latency("scraper")
+            if self.state.should_fail("scraper"): return self._send(503, "unavailable", "text/plain")
+            article_match = re.search(r"bench-article-(\d+)", path)
+            article_idx = int(article_match.group(1)) if article_match else 0
+            return self._send(200, build_article_page(article_idx, self.state.scenario["figures"]), "text/html; charset=UTF-8")
+        if host == TRADINGVIEW_HOST and path.startswith("/x/"):
+            self.state.count("tradingview"); self.state.sleep_latency("tradingview")
+            chart_id = path.strip("/").split("/")[-1]
+            page_head = f'<html><head><meta property="og:image" content="http://{TRADINGVIEW_SNAPSHOT_HOST}/snapshots/x/{chart_id}.png" /></head>'
+            return self._send(200, page_head + "<body>" + "<div>chart</div>" * 2000 + "</body></html>", "text/html; charset=UTF-8")
+        if path.endswith(".png"):
+            self.state.count("image")
+            return self._send(200, TINY_PNG, "image/png")
+        if host == WORDPRESS_HOST and path == "/wp-json/my-poster/v1/processed-links":
+            self.state.count("wordpress"); self.state.sleep_latency("wordpress")
+            with self.state.lock: processed_links = sorted(self.state.processed_links)
+            return self._send_json(200, processed_links)
+        self._send(404, "not found", "text/plain")
+
+    def do_POST(self):
+        host, path, query = self._target()
+        request_payload = self._read_json()
+        if host == GEMINI_HOST:
+            return self._handle_gemini(path, query, request_payload)
+        if host == WORDPRESS_HOST:
+            self.state.count("wordpress"); self.state.sleep_latency("wordpress")
+            if path == "/wp-json/my-poster/v1/processed-links/check":
+                with self.state.lock: known_links = [link for link in request_payload.get("links", []) if link in self.state.processed_links]
+                return self._send_json(200, {"known": known_links})
+            if path == "/wp-json/my-poster/v1/processed-links":
+                with self.state.lock: self.state.processed_links.add(request_payload.get("link"))
+                return self._send_json(200, {"message": "ok"})
+            if path == "/wp-json/my-poster/v1/create":
+                if self.state.should_fail("wordpress"): return self._send(503, "unavailable", "text/plain")
+                with self.state.lock:
+                    self.state.next_post_id += 1
+                    post_id = self.state.next_post_id
+                return self._send_json(201, {"post_id": post_id, "url": f"http://{WORDPRESS_HOST}/?p={post_id}"})
+            if path == "/wp-json/wp/v2/media":
+                self.state.count("media")
+                with self.state.lock:
+                    self.state.next_post_id += 1
+                    media_id = self.state.next_post_id
+                return self._send_json(201, {"id": media_id, "source_url": f"http://{WORDPRESS_HOST}/wp-content/uploads/bench/media-{media_id}.png"})
+        self._send(404, "not found", "text/plain")
+
+    def _handle_gemini(self, path, query, request_payload):
+        self.state.count("gemini"); self.state.sleep_latency("gemini")
+        if self.state.should_fail("gemini"):
+            return self._send(429, json.dumps({"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}), extra_headers={"Retry-After": "1"})
+        prompt_text = "".join(part.get("text", "") for content in request_payload.get("contents", []) for part in content.get("parts", []))
+        reply_text = fake_gemini_reply(prompt_text, self.state.scenario["gemini_untranslated_rate"])
+        usage_metadata = {"promptTokenCount": len(prompt_text) // 4, "candidatesTokenCount": len(reply_text) // 4}
+        usage_metadata["totalTokenCount"] = usage_metadata["promptTokenCount"] + usage_metadata["candidatesTokenCount"]
+        # زمان تولید پاسخ متناسب با طول خروجی است
+        generation_seconds = usage_metadata["candidatesTokenCount"] / max(1.0, self.state.scenario["gemini_tokens_per_second"])
+        if ":streamGenerateContent" in path:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            stream_pieces = [reply_text[piece_start:piece_start + 400] for piece_start in range(0, len(reply_text), 400)] or [""]
+            for piece_idx, stream_piece in enumerate(stream_pieces):
+                time.sleep(generation_seconds / len(stream_pieces))
+                stream_chunk = {"candidates": [{"content": {"parts": [{"text": stream_piece}], "role": "model"}}]}
+                if piece_idx == len(stream_pieces) - 1:
+                    stream_chunk["candidates"][0]["finishReason"] = "STOP"
+                    stream_chunk["usageMetadata"] = usage_metadata
+                event_bytes = b"data: " + json.dumps(stream_chunk, ensure_ascii=False).encode("utf-8") + b"\r\n\r\n"
+                self.wfile.write(b"%x\r\n" % len(event_bytes) + event_bytes + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        time.sleep(generation_seconds)
+        self._send_json(200, {"candidates": [{"content": {"parts": [{"text": reply_text}], "role": "model"}, "finishReason": "STOP"}], "usageMetadata": usage_metadata})
+
+
+class BenchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # resolver TradingView پس از یافتن og:image اتصال را می‌بندد؛ قطع اتصال از سمت کلاینت خطا نیست
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)): return
+        super().handle_error(request, client_address)
+
+
+def start_bench_server(state):
+    handler_class = type("ScenarioBenchHandler", (BenchHandler,), {"state": state})
+    server = BenchServer(("127.0.0.1", 0), handler_class)
+    threading.Thread(target=server.serve_forever, name="bench-server", daemon=True).start()
+    return server
+
+
+def run_pipeline_once(server, work_dir, scenario, extra_env):
+    """au-p.py را یک‌بار در Process جداگانه اجرا و زمان، CPU، اوج حافظه و متریک‌های مراحل را برمی‌گرداند."""
+    proxy_url = f"http://127.0.0.1:{server.server_port}"
+    run_env = {key: value for key, value in os.environ.items() if key.lower() not in ("http_proxy", "https_proxy", "no_proxy", "all_proxy")}
+    run_env.update({
+        "GEMAPI": "bench", "WORDPRESS_URL": f"http://{WORDPRESS_HOST}", "WORDPRESS_USER": "bench", "WORDPRESS_PASS": "bench",
+        "RSS_FEED_URL": f"http://{NEWSBTC_HOST}/feed/",
+        "GEMINI_API_BASE_URL": f"http://{GEMINI_HOST}/v1beta",
+        "HTTP_PROXY": proxy_url, "http_proxy": proxy_url,
+        "STATE_DIR": os.path.join(work_dir, ".state"),
+        "BACKLOG_MODE": "1", "BACKLOG_MAX_WORKERS": str(scenario["workers"]),
+        "GEMINI_STREAMING": "1" if scenario["streaming"] else "0",
+        "GEMINI_RPM_LIMIT": str(scenario["gemini_rpm"]), "GEMINI_TPM_LIMIT": "100000000",
+    })
+    run_env.update(extra_env)
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "au-p.py")
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    wall_start = time.perf_counter()
+    with open(os.path.join(work_dir, "bench_run_output.txt"), "w", encoding="utf-8") as run_output:
+        completed = subprocess.run([sys.executable, script_path], cwd=work_dir, env=run_env, stdout=run_output, stderr=subprocess.STDOUT)
+    wall_seconds = time.perf_counter() - wall_start
+    usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    run_metrics = {}
+    metrics_path = os.path.join(work_dir, ".state", "metrics.jsonl")
+    if os.path.exists(metrics_path):
+        with open(metrics_path, "r", encoding="utf-8") as metrics_file:
+            metric_lines = metrics_file.read().splitlines()
+        if metric_lines: run_metrics = json.loads(metric_lines[-1])
+    return {
+        "exit_code": completed.returncode,
+        "wall": wall_seconds,
+        "cpu": (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime),
+        # ru_maxrss در لینوکس بر حسب کیلوبایت و بیشینه بین تمام Processهای فرزند تا این لحظه است
+        "peak_rss_mb": usage_after.ru_maxrss / 1024,
+        "metrics": run_metrics,
+        "requests": dict(server.RequestHandlerClass.state.request_counts),
+        "injected_errors": dict(server.RequestHandlerClass.state.injected_errors),
+    }
+
+
+def print_report(scenario, runs):
+    print("=" * 78)
+    print(f"سناریو: {scenario['feed_size']} مقاله، {scenario['paragraphs']} پاراگراف و {scenario['figures']} عکس در هر مقاله، "
+          f"{scenario['workers']} Worker، استریم: {'بله' if scenario['streaming'] else 'خیر'}")
+    print(f"تأخیر (ms): {scenario['latencies_ms']}  نرخ خطا: {scenario['error_rates']}")
+    print("=" * 78)
+    for run_idx, run in enumerate(runs):
+        articles = run["metrics"].get("articles", [])
+        ok_articles = sum(1 for article in articles if article.get("status") == "ok")
+        print(f"اجرای {run_idx + 1}: کد خروج {run['exit_code']}، Wall {run['wall']:.2f}s، CPU {run['cpu']:.2f}s، "
+              f"مقاله موفق {ok_articles}/{len(articles)}، درخواست‌ها {run['requests']}، خطای تزریق‌شده {run['injected_errors']}")
+    stage_names = sorted({stage_name for run in runs for stage_name in run["metrics"].get("stages", {})})
+    if stage_names:
+        print("-" * 78)
+        print(f"{'مرحله':<46}{'میانه مجموع (s)':>18}{'میانه بیشینه (s)':>18}")
+        stage_rows = []
+        for stage_name in stage_names:
+            stage_stats = [run["metrics"]["stages"][stage_name] for run in runs if stage_name in run["metrics"].get("stages", {})]
+            stage_rows.append((statistics.median(stats["total_seconds"] for stats in stage_stats), statistics.median(stats["max_seconds"] for stats in stage_stats), stage_name))
+        for total_seconds, max_seconds, stage_name in sorted(stage_rows, reverse=True):
+            print(f"{stage_name:<46}{total_seconds:>18.3f}{max_seconds:>18.3f}")
+    print("-" * 78)
+    print(f"میانه Wall: {statistics.median(run['wall'] for run in runs):.2f}s   میانه CPU: {statistics.median(run['cpu'] for run in runs):.2f}s   "
+          f"اوج حافظه (RSS): {max(run['peak_rss_mb'] for run in runs):.1f} MB")
+    print("=" * 78)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="بنچمارک آفلاین پایپ‌لاین au-p.py با سرویس‌های ساختگی محلی")
+    parser.add_argument("--feed-size", type=int, default=5, help="تعداد ورودی‌های فید (همه در حالت بک‌لاگ پردازش می‌شوند)")
+    parser.add_argument("--paragraphs", type=int, default=120, help="تعداد پاراگراف هر مقاله")
+    parser.add_argument("--figures", type=int, default=8, help="تعداد عکس هر مقاله (نیمی TradingView)")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--streaming", type=int, default=1, choices=(0, 1))
+    parser.add_argument("--gemini-rpm", type=int, default=10000, help="سهمیه RPM زمان‌بند Gemini در au-p.py")
+    parser.add_argument("--gemini-tokens-per-second", type=float, default=400.0, help="سرعت تولید پاسخ Gemini ساختگی")
+    parser.add_argument("--gemini-latency-ms", type=int, default=300)
+    parser.add_argument("--wordpress-latency-ms", type=int, default=100)
+    parser.add_argument("--scraper-latency-ms", type=int, default=150)
+    parser.add_argument("--tradingview-latency-ms", type=int, default=200)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="نسبت درخواست‌هایی که 429 می‌گیرند")
+    parser.add_argument("--gemini-untranslated-rate", type=float, default=0.02, help="نسبت پاراگراف‌هایی که ترجمه‌نشده برمی‌گردند و ترمیم می‌شوند")
+    parser.add_argument("--wordpress-error-rate", type=float, default=0.0, help="نسبت درخواست‌های ساخت پست که 503 می‌گیرند")
+    parser.add_argument("--scraper-error-rate", type=float, default=0.0)
+    parser.add_argument("--keep-state", action="store_true", help="STATE_DIR بین تکرارها حفظ شود (اندازه‌گیری اجرای گرم)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--env", action="append", default=[], help="متغیر محیطی اضافه برای au-p.py به شکل KEY=VALUE")
+    args = parser.parse_args()
+
+    scenario = {
+        "feed_size": args.feed_size, "paragraphs": args.paragraphs, "figures": args.figures, "workers": args.workers,
+        "streaming": bool(args.streaming), "gemini_rpm": args.gemini_rpm, "gemini_tokens_per_second": args.gemini_tokens_per_second,
+        "gemini_untranslated_rate": args.gemini_untranslated_rate,
+        "seed": args.seed,
+        "latencies_ms": {"gemini": args.gemini_latency_ms, "wordpress": args.wordpress_latency_ms, "scraper": args.scraper_latency_ms, "tradingview": args.tradingview_latency_ms},
+        "error_rates": {"gemini": args.gemini_error_rate, "wordpress": args.wordpress_error_rate, "scraper": args.scraper_error_rate},
+    }
+    extra_env = dict(env_pair.split("=", 1) for env_pair in args.env)
+
+    bench_state = BenchState(scenario)
+    bench_server = start_bench_server(bench_state)
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    runs = []
+    try:
+        for run_idx in range(args.repeat):
+            bench_state.reset_run()
+            if not args.keep_state: shutil.rmtree(os.path.join(work_dir, ".state"), ignore_errors=True)
+            run = run_pipeline_once(bench_server, work_dir, scenario, extra_env)
+            runs.append(run)
+            if run["exit_code"] != 0:
+                with open(os.path.join(work_dir, "bench_run_output.txt"), "r", encoding="utf-8") as run_output:
+                    print(f"--- اجرای {run_idx + 1} با کد {run['exit_code']} تمام شد؛ انتهای خروجی:\n" + "".join(run_output.readlines()[-20:]))
+        print_report(scenario, runs)
+    finally:
+        bench_server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -1,14 +1,18 @@
 # -*- coding: utf-8 -*-
-from bs4 import BeautifulSoup
 import sys
 
+from bench_dom_pipeline import load_aup_module
+
+# همان make_soup کد اصلی (au-p.py) تا تست با پارسر پایپ‌لاین اجرا شود
+make_soup = load_aup_module().make_soup
+
 # تابع پراکسی که در کد اصلی قرار دادیم
 def replace_filtered_images_with_proxy(content_html):
     if not content_html:
         return ""
     print(">>> بررسی و بازنویسی آدرس عکس‌های فیلتر شده با پراکسی...")
     sys.stdout.flush()
-    soup = BeautifulSoup(content_html, "html.parser")
+    soup = make_soup(content_html)
     images = soup.find_all("img")
     modified_flag = False
     processed_count = 0
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# ابزار مشترک تست‌ها: سرور HTTP محلی که نقش Gemini یا وردپرس را بازی می‌کند
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class LocalTestServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # کلاینت در تست‌های timeout اتصال را وسط پاسخ می‌بندد؛ قطع اتصال از سمت کلاینت خطا نیست
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)): return
+        super().handle_error(request, client_address)
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    """start(handler_class) یک سرور محلی روی پورت آزاد اجرا و آدرس پایه آن را برمی‌گرداند؛ پس از تست بسته می‌شود."""
+    servers = []
+
+    def start(handler_class):
+        server = LocalTestServer(("127.0.0.1", 0), handler_class)
+        threading.Thread(target=server.serve_forever, name="test-server", daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
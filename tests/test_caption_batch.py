@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# ترجمه دسته‌ای کپشن‌ها: پاسخ بر اساس id (نه ترتیب) به کپشن‌ها نسبت داده می‌شود و فقط کپشن‌هایی که در پاسخ نیستند
+# (یا id تکراری یا متن خالی دارند) جداگانه ترجمه می‌شوند
+import contextlib
+import io
+import json
+import re
+
+import pytest
+
+from bench_dom_pipeline import load_aup_module
+
+aup = load_aup_module()
+
+CAPTIONS = ["<b>BTC</b> hourly chart", "ETH daily chart", "Source: TradingView"]
+TRANSLATIONS = {"<b>BTC</b> hourly chart": "<b>BTC</b> نمودار ساعتی", "ETH daily chart": "نمودار روزانه ETH", "Source: TradingView": "منبع: TradingView"}
+
+
+class ScriptedGemini:
+    """پاسخ دسته‌ای از batch_reply(items) ساخته می‌شود؛ درخواست‌های تکی کپشن با ترجمه ثابت پاسخ داده و ثبت می‌شوند."""
+
+    def __init__(self, batch_reply):
+        self.batch_reply = batch_reply
+        self.single_requests = []
+
+    def __call__(self, payload, priority, label):
+        prompt = payload["contents"][0]["parts"][0]["text"]
+        if label == "ترجمه دسته‌ای کپشن‌ها":
+            batch_items = json.loads(prompt.split("کپشن‌های اصلی:\n", 1)[1])
+            reply_text = json.dumps(self.batch_reply(batch_items), ensure_ascii=False)
+        else:
+            source_caption = re.search(r'کپشن اصلی: "(.*)"\n', prompt).group(1)
+            self.single_requests.append(source_caption)
+            reply_text = TRANSLATIONS[source_caption]
+        return {"candidates": [{"content": {"parts": [{"text": reply_text}]}, "finishReason": "STOP"}]}
+
+
+@pytest.fixture
+def scripted_gemini(monkeypatch):
+    def install(batch_reply):
+        fake_gemini = ScriptedGemini(batch_reply)
+        monkeypatch.setattr(aup, "gemini_generate", fake_gemini)
+        return fake_gemini
+
+    monkeypatch.setattr(aup, "get_translation_memory", lambda: None)
+    return install
+
+
+def translated(item):
+    return {"id": item["id"], "html": TRANSLATIONS[item["html"]]}
+
+
+def translate_captions(captions):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return aup.translate_captions_batch_with_gemini(captions)
+
+
+def test_reordered_reply_is_matched_by_id(scripted_gemini):
+    fake_gemini = scripted_gemini(lambda items: [translated(item) for item in reversed(items)])
+    assert translate_captions(CAPTIONS) == [TRANSLATIONS[caption] for caption in CAPTIONS]
+    assert fake_gemini.single_requests == []
+
+
+def test_reordered_reply_with_missing_and_extra_ids_falls_back_only_for_missing(scripted_gemini):
+    # آیتم id=1 در پاسخ نیست، ترتیب بقیه برعکس است و یک id ناشناخته و یک آیتم بدون id هم اضافه شده است
+    fake_gemini = scripted_gemini(lambda items: [translated(items[2]), {"id": 7, "html": "کپشن اضافی"}, {"html": "بدون شناسه"}, translated(items[0])])
+    assert translate_captions(CAPTIONS) == [TRANSLATIONS[caption] for caption in CAPTIONS]
+    assert fake_gemini.single_requests == [CAPTIONS[1]]
+
+
+def test_duplicated_and_empty_items_fall_back_to_single_translation(scripted_gemini):
+    fake_gemini = scripted_gemini(lambda items: [translated(items[0]), translated(items[1]), {"id": 1, "html": "ترجمه دوم"}, {"id": 2, "html": "  "}])
+    assert translate_captions(CAPTIONS) == [TRANSLATIONS[caption] for caption in CAPTIONS]
+    assert fake_gemini.single_requests == [CAPTIONS[1], CAPTIONS[2]]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# ادامه ترجمه محتوا از checkpoint: Placeholderهای متن ذخیره‌شده باید بر اساس آدرس عکس (نه ترتیب) به Placeholderهای
+# اجرای جاری وصل شوند، حتی اگر در این اجرا عکسی حذف یا اضافه شده باشد
+import contextlib
+import io
+
+from bench_dom_pipeline import load_aup_module
+
+aup = load_aup_module()
+
+
+def article_html(image_names):
+    # هر عکس بعد از پاراگرافی می‌آید که نامش را دارد تا جابه‌جایی عکس‌ها در خروجی دیده شود
+    return "".join(f'<p>Paragraph {name}</p><figure><img src="https://www.example.com/{name}.png"></figure>' for name in image_names)
+
+
+def prepare_body(image_names):
+    # مانند prepare_content_for_translation: نقشه Placeholder خود تگ‌های img را نگه می‌دارد
+    soup = aup.make_soup(article_html(image_names))
+    placeholder_map = aup.replace_images_with_placeholders_in_soup(soup)
+    return str(soup), placeholder_map
+
+
+def checkpoint_translation(image_names):
+    """اجرای اول: متن با Placeholder ترجمه (ساختگی) و در قالب checkpoint مرحله translate_body ذخیره می‌شود."""
+    content_with_placeholders, placeholder_map = prepare_body(image_names)
+    placeholder_ids = aup.canonicalize_placeholder_ids(content_with_placeholders)[1]
+    translated_html = content_with_placeholders.replace("Paragraph ", "پاراگراف ")
+    return {
+        "html": aup.canonicalize_placeholder_ids(translated_html, placeholder_ids)[0],
+        "images": aup.placeholder_image_keys(placeholder_ids, placeholder_map),
+    }
+
+
+def resume_translation(checkpointed_body, image_names):
+    """اجرای دوم: Placeholderهای تازه ساخته و متن checkpoint به آن‌ها وصل و عکس‌ها بازگردانده می‌شوند."""
+    placeholder_map = prepare_body(image_names)[1]
+    resumed_html = aup.remap_checkpointed_placeholders(checkpointed_body, placeholder_map)
+    soup = aup.make_soup(aup.restore_images_from_placeholders(resumed_html, placeholder_map))
+    return [tag.get_text() if tag.name == "p" else tag["src"].rsplit("/", 1)[-1] for tag in soup.find_all(["p", "img"])]
+
+
+def run_quietly(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+
+def test_same_images_are_restored_in_place():
+    checkpointed_body = run_quietly(checkpoint_translation, ["a", "b", "c"])
+    assert run_quietly(resume_translation, checkpointed_body, ["a", "b", "c"]) == ["پاراگراف a", "a.png", "پاراگراف b", "b.png", "پاراگراف c", "c.png"]
+
+
+def test_image_missing_in_resumed_run_does_not_shift_the_others():
+    # بررسی عکس در اجرای دوم b را حذف کرده است؛ با تطبیق ترتیبی c جای b و کپشن‌ها جابه‌جا می‌شدند
+    checkpointed_body = run_quietly(checkpoint_translation, ["a", "b", "c"])
+    assert run_quietly(resume_translation, checkpointed_body, ["a", "c"]) == ["پاراگراف a", "a.png", "پاراگراف b", "پاراگراف c", "c.png"]
+
+
+def test_image_new_in_resumed_run_is_not_inserted():
+    checkpointed_body = run_quietly(checkpoint_translation, ["a", "c"])
+    assert run_quietly(resume_translation, checkpointed_body, ["a", "b", "c"]) == ["پاراگراف a", "a.png", "پاراگراف c", "c.png"]
+
+
+def test_repeated_image_is_matched_in_order():
+    checkpointed_body = run_quietly(checkpoint_translation, ["a", "b", "a"])
+    assert run_quietly(resume_translation, checkpointed_body, ["a", "b", "a"]) == ["پاراگراف a", "a.png", "پاراگراف b", "b.png", "پاراگراف a", "a.png"]
+
+
+def test_unmatched_placeholder_is_removed_from_html():
+    checkpointed_body = run_quietly(checkpoint_translation, ["a", "b"])
+    placeholder_map = run_quietly(prepare_body, ["a"])[1]
+    resumed_html = run_quietly(aup.remap_checkpointed_placeholders, checkpointed_body, placeholder_map)
+    assert "00000000-0000-0000-0000-" not in resumed_html
+    assert resumed_html.count("image-placeholder-container") == 1
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# استریم Gemini در برابر یک سرور SSE محلی: سر هم شدن بخش‌ها، قطع زودهنگام استریم متوقف‌مانده یا بیش از حد طولانی
+# و تلاش مجدد آن، و کنار گذاشتن پاسخ بریده‌شده (بدون finishReason=STOP) از حافظه ترجمه
+import contextlib
+import io
+import json
+import time
+
+import pytest
+import requests
+
+from bench_dom_pipeline import load_aup_module
+from conftest import QuietHandler
+
+aup = load_aup_module()
+
+PAYLOAD = {"contents": [{"parts": [{"text": "Translate"}]}]}
+
+
+def sse_event(text, finish_reason=None, usage_metadata=None):
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}}
+    if finish_reason: candidate["finishReason"] = finish_reason
+    stream_chunk = {"candidates": [candidate]}
+    if usage_metadata: stream_chunk["usageMetadata"] = usage_metadata
+    return stream_chunk
+
+
+def complete_stream(texts, delay=0.0):
+    # اسکریپت هر پاسخ: لیست (مکث پیش از ارسال، رویداد SSE)
+    return [(delay, sse_event(text, "STOP" if idx == len(texts) - 1 else None, {"totalTokenCount": 10} if idx == len(texts) - 1 else None))
+            for idx, text in enumerate(texts)]
+
+
+class FakeGeminiStreamHandler(QuietHandler):
+    """هر درخواست streamGenerateContent اسکریپت بعدی از stream_scripts را به صورت chunked پخش می‌کند."""
+    stream_scripts = []
+    requests_seen = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.requests_seen.append(self.path)
+        stream_script = self.stream_scripts.pop(0)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for delay_seconds, stream_chunk in stream_script:
+            time.sleep(delay_seconds)
+            event_bytes = b"data: " + json.dumps(stream_chunk, ensure_ascii=False).encode("utf-8") + b"\r\n\r\n"
+            self.wfile.write(b"%x\r\n" % len(event_bytes) + event_bytes + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+@pytest.fixture
+def fake_gemini(local_server, monkeypatch):
+    """سرور SSE محلی به جای API Gemini، بدون سهمیه RPM و با فاصله کوتاه بین تلاش‌ها؛ خروجی کلاس handler برای تعیین اسکریپت‌هاست."""
+    handler_class = type("ScriptedGeminiHandler", (FakeGeminiStreamHandler,), {"stream_scripts": [], "requests_seen": []})
+    monkeypatch.setattr(aup, "GEMINI_API_BASE_URL", local_server(handler_class) + "/v1beta")
+    monkeypatch.setattr(aup, "gemini_scheduler", aup.GeminiScheduler(100000, 100000000))
+    monkeypatch.setitem(aup.RETRY_POLICIES, "gemini_body", aup.RetryPolicy("gemini", max_attempts=3, base_delay=0.01, max_delay=0.02))
+    monkeypatch.setitem(aup.CIRCUIT_BREAKERS, "gemini", aup.CircuitBreaker("gemini"))
+    monkeypatch.setattr(aup, "retry_budget", aup.RetryBudget(60))
+    return handler_class
+
+
+class RecordingTranslationMemory:
+    def __init__(self):
+        self.puts = []
+
+    def get(self, source_text, prompt_version, model):
+        return None
+
+    def put(self, source_text, prompt_version, translated_text, model):
+        self.puts.append(translated_text)
+
+
+def quiet(func, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def test_stream_chunks_are_assembled_in_order(fake_gemini):
+    fake_gemini.stream_scripts.append(complete_stream(["<p>قیمت ", "بیت‌کوین ", "افزایش یافت.</p>"]))
+    result = quiet(aup.gemini_generate_stream, PAYLOAD, aup.GEMINI_PRIORITY_BODY, "تست استریم", idle_timeout=5)
+    candidate = result["candidates"][0]
+    assert candidate["content"]["parts"][0]["text"] == "<p>قیمت بیت‌کوین افزایش یافت.</p>"
+    assert candidate["finishReason"] == "STOP"
+    assert result["usageMetadata"] == {"totalTokenCount": 10}
+    assert fake_gemini.requests_seen == ["/v1beta/models/gemini-2.5-pro:streamGenerateContent?alt=sse"]
+
+
+def test_stalled_stream_is_aborted_by_idle_timeout(fake_gemini):
+    fake_gemini.stream_scripts.append([(0, sse_event("<p>اول")), (3, sse_event("دوم</p>", "STOP"))])
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.Timeout):
+        quiet(aup.gemini_generate_stream, PAYLOAD, aup.GEMINI_PRIORITY_BODY, "تست استریم", idle_timeout=0.3)
+    assert time.monotonic() - started < 2
+
+
+def test_stalled_stream_is_retried(fake_gemini):
+    fake_gemini.stream_scripts.append([(0, sse_event("<p>اول")), (3, sse_event("دوم</p>", "STOP"))])
+    fake_gemini.stream_scripts.append(complete_stream(["<p>اول", "دوم</p>"]))
+    started = time.monotonic()
+    result = quiet(aup.call_with_retry, "gemini_body",
+                   lambda: aup.gemini_generate_stream(PAYLOAD, aup.GEMINI_PRIORITY_BODY, "تست استریم", idle_timeout=0.3), "تست استریم")
+    assert time.monotonic() - started < 2
+    assert len(fake_gemini.requests_seen) == 2
+    assert result["candidates"][0]["content"]["parts"][0]["text"] == "<p>اولدوم</p>"
+
+
+def test_trickling_stream_is_cut_off_by_total_timeout_and_retried(fake_gemini):
+    # هر بخش زودتر از timeout بیکاری می‌رسد ولی کل پاسخ از سقف total_timeout طولانی‌تر است
+    fake_gemini.stream_scripts.append([(0.05, sse_event(f"<p>{idx}</p>")) for idx in range(60)] + [(0, sse_event("", "STOP"))])
+    fake_gemini.stream_scripts.append(complete_stream(["<p>کامل</p>"]))
+    started = time.monotonic()
+    result = quiet(aup.call_with_retry, "gemini_body",
+                   lambda: aup.gemini_generate_stream(PAYLOAD, aup.GEMINI_PRIORITY_BODY, "تست استریم", total_timeout=0.5, idle_timeout=2), "تست استریم")
+    assert time.monotonic() - started < 2
+    assert len(fake_gemini.requests_seen) == 2
+    assert result["candidates"][0]["content"]["parts"][0]["text"] == "<p>کامل</p>"
+
+
+@pytest.mark.parametrize("truncated_script", [
+    [(0, sse_event("<p>متن بریده"))],
+    [(0, sse_event("<p>متن بریده")), (0, sse_event("", "MAX_TOKENS"))],
+    [(0, sse_event("<p>متن بریده", "SAFETY"))],
+], ids=["no_finish_reason", "max_tokens", "safety"])
+def test_truncated_body_is_retried_and_only_complete_reply_is_memorized(fake_gemini, monkeypatch, truncated_script):
+    translation_memory = RecordingTranslationMemory()
+    monkeypatch.setattr(aup, "get_translation_memory", lambda: translation_memory)
+    monkeypatch.setattr(aup, "GEMINI_STREAMING", True)
+    fake_gemini.stream_scripts.append(truncated_script)
+    fake_gemini.stream_scripts.append(complete_stream(["<p>متن ", "کامل</p>"]))
+    assert quiet(aup.translate_body_fragment_with_gemini, "<p>Full text</p>") == "<p>متن کامل</p>"
+    assert len(fake_gemini.requests_seen) == 2
+    assert translation_memory.puts == ["<p>متن کامل</p>"]
+
+
+def test_truncated_body_is_never_memorized(fake_gemini, monkeypatch):
+    translation_memory = RecordingTranslationMemory()
+    monkeypatch.setattr(aup, "get_translation_memory", lambda: translation_memory)
+    monkeypatch.setattr(aup, "GEMINI_STREAMING", True)
+    fake_gemini.stream_scripts.extend([[(0, sse_event("<p>متن بریده", "MAX_TOKENS"))]] * 3)
+    with pytest.raises(ValueError):
+        quiet(aup.translate_body_fragment_with_gemini, "<p>Full text</p>")
+    assert len(fake_gemini.requests_seen) == 3
+    assert translation_memory.puts == []
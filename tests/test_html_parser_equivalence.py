@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# مجموعه نمونه هم‌ارزی backendهای پارسر HTML: خروجی منتشرشده پایپ‌لاین DOM و متن‌هایی که فقط get_text می‌شوند
+# با هر مقدار HTML_PARSER_BACKEND باید با html.parser یکسان باشد. اجرا: python -m pytest -q tests
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_dom_pipeline import build_long_article, load_aup_module, normalize_output  # noqa: E402
+
+aup = load_aup_module()
+
+# نمونه‌هایی از ساختارهایی که در فید NewsBTC و پاسخ Gemini دیده می‌شوند، به اضافه چند مورد HTML نادرست
+EQUIVALENCE_CORPUS = [
+    ("paragraphs", '<p>Bitcoin price started a fresh increase above the <strong>$65,500</strong> zone.</p>\n\n<h2>Key level</h2>\n<p>BTC is now trading above <a href="https://www.newsbtc.com/analysis/btc/">the 100 hourly SMA</a>.</p>'),
+    ("image_in_paragraph", '<p>Intro text.</p><p><img src="https://www.newsbtc.com/wp-content/uploads/2025/05/chart.png?resize=800%2C450" alt="" /></p><p>After image.</p>'),
+    ("image_inline_with_text", '<p>Chart below <img src="https://i0.wp.com/www.newsbtc.com/wp-content/uploads/a.png" alt="a"> and more text.</p>'),
+    ("figure_with_caption", '<figure class="wp-block-image"><img src="https://www.newsbtc.com/wp-content/uploads/b.png" srcset="https://www.newsbtc.com/wp-content/uploads/b.png 800w" alt="" /><figcaption>BTC/USD chart</figcaption></figure>'),
+    ("tweet_embed", '<blockquote class="twitter-tweet"><p lang="en" dir="ltr">Bitcoin is up</p>&mdash; Analyst (@analyst) <a href="https://twitter.com/analyst/status/1">May 1, 2025</a></blockquote><script async src="https://platform.twitter.com/widgets.js" charset="utf-8"></script>'),
+    ("lists_and_table", '<ul><li>First support at $64,000</li><li>Second support at $63,200</li></ul><table><tr><td>RSI</td><td>55</td></tr></table>'),
+    ("entities_and_persian", '<p>قیمت بیت‌کوین &amp; اتریوم&nbsp;امروز &laquo;افزایش&raquo; یافت — 5%&gt;3%</p>'),
+    ("comments_and_breaks", '<!-- wp:paragraph --><p>Line one<br>Line two<br/>Line three</p><!-- /wp:paragraph -->'),
+    ("edge_whitespace", '\n  <p>Leading and trailing whitespace</p>  \n'),
+    ("bare_text", 'Bare text before <em>markup</em> and after'),
+    ("iframe_embed", '<p>Watch:</p><iframe src="https://www.youtube.com/embed/x" width="560" height="315" allowfullscreen></iframe>'),
+    ("boilerplate", '<p>Main body.</p><p>Related Reading: Bitcoin Price Could Surge</p><p>Featured image from Unsplash, chart from TradingView.com</p><p>Disclaimer: The article is provided for educational purposes only.</p>'),
+    ("unclosed_list_items", '<ul><li>one<li>two</ul><p>after'),
+    ("block_inside_paragraph", '<p>Text <div class="note">block</div> tail</p>'),
+]
+LONG_ARTICLE_HTML, LONG_ARTICLE_CAPTIONS = build_long_article(120, 12)
+CORPUS_WITH_LONG_ARTICLE = EQUIVALENCE_CORPUS + [("long_article", LONG_ARTICLE_HTML)]
+BACKEND_SETTINGS = ["auto", "lxml", "html.parser"]
+
+
+def run_published_path(raw_html, captions):
+    # همان مسیر __main__ با ترجمه ساختگی: کوچک‌سازی پرامپت، بازگردانی و ساخت محتوای نهایی
+    with contextlib.redirect_stdout(io.StringIO()):
+        content_with_placeholders, placeholder_map = aup.prepare_content_for_translation(raw_html)
+        minimized_html, markup_stash = aup.minimize_markup_for_prompt(content_with_placeholders)
+        translated_html, _ = aup.restore_minimized_markup(minimized_html, markup_stash)
+        return normalize_output(aup.build_final_content(translated_html, placeholder_map, captions, "عنوان"))
+
+
+@pytest.fixture(params=BACKEND_SETTINGS)
+def backend_setting(request, monkeypatch):
+    with contextlib.redirect_stdout(io.StringIO()):
+        document_parser = aup.resolve_html_document_parser(request.param)
+    monkeypatch.setattr(aup, "HTML_DOCUMENT_PARSER", document_parser)
+    return request.param
+
+
+def html_parser_baseline(func):
+    original_parser = aup.HTML_DOCUMENT_PARSER
+    aup.HTML_DOCUMENT_PARSER = "html.parser"
+    try:
+        return func()
+    finally:
+        aup.HTML_DOCUMENT_PARSER = original_parser
+
+
+@pytest.mark.parametrize("case_name,raw_html", CORPUS_WITH_LONG_ARTICLE, ids=[case[0] for case in CORPUS_WITH_LONG_ARTICLE])
+def test_published_output_matches_html_parser(backend_setting, case_name, raw_html):
+    baseline = html_parser_baseline(lambda: run_published_path(raw_html, LONG_ARTICLE_CAPTIONS))
+    assert run_published_path(raw_html, LONG_ARTICLE_CAPTIONS) == baseline
+
+
+@pytest.mark.parametrize("case_name,raw_html", CORPUS_WITH_LONG_ARTICLE, ids=[case[0] for case in CORPUS_WITH_LONG_ARTICLE])
+def test_fingerprint_text_matches_html_parser(backend_setting, case_name, raw_html):
+    feed_source = aup.DEFAULT_FEED_SOURCE
+    baseline = html_parser_baseline(lambda: aup.extract_fingerprint_text(raw_html, feed_source))
+    assert aup.extract_fingerprint_text(raw_html, feed_source) == baseline
+
+
+def test_crawled_page_figures_match_html_parser(backend_setting):
+    # crawl_captions صفحه کامل را با HTML_DOCUMENT_PARSER parse می‌کند؛ figureها و کپشن‌ها باید یکسان پیدا شوند
+    page_html = f"<!DOCTYPE html><html><head><title>t</title><script>var x = '<p>';</script></head><body><nav><ul><li>a<li>b</ul></nav><article>{LONG_ARTICLE_HTML}<figure><img src=\"https://x/c.png\"><figcaption>Chart <a href=\"https://x\">source</a></figcaption></figure></article></body></html>"
+
+    def figure_summary():
+        soup = aup.make_soup(page_html, document=True)
+        return [(figure.find("img") or {}).get("src") for figure in soup.find_all("figure")], [str(figcaption) for figcaption in soup.find_all("figcaption")]
+
+    assert figure_summary() == html_parser_baseline(figure_summary)
+
+
+def test_lxml_setting_keeps_fragments_on_html_parser():
+    with contextlib.redirect_stdout(io.StringIO()):
+        aup.resolve_html_document_parser("lxml")
+    assert aup.make_soup("<p>a<div>b</div></p>").decode() == "<p>a<div>b</div></p>"
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# تشخیص خبر تقریباً تکراری: SimHash، شباهت بر اساس فاصله همینگ، آستانه و حذف اثر انگشت‌های خارج از بازه زمانی
+import time
+
+import pytest
+
+from bench_dom_pipeline import load_aup_module
+
+aup = load_aup_module()
+
+BASE_TEXT = " ".join(f"Bitcoin price started a fresh increase above the {idx} zone and traders watched the hourly chart closely." for idx in range(20))
+# فقط یک کلمه در یکی از جمله‌ها عوض شده است (بازنشر همان خبر با ویرایش جزئی)
+NEAR_TEXT = BASE_TEXT.replace("Bitcoin price started a fresh increase above the 7 ", "Bitcoin price began a fresh increase above the 7 ")
+DISTINCT_TEXT = " ".join(f"Ethereum developers scheduled network upgrade number {idx} after long testnet discussions with validators." for idx in range(20))
+
+
+@pytest.fixture
+def near_duplicate_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(aup, "STATE_DIR", str(tmp_path))
+    return aup.NearDuplicateIndex(window_seconds=2 * 3600)
+
+
+def stored_links(index):
+    return sorted(row[0] for row in index._execute("SELECT link FROM article_fingerprints"))
+
+
+def test_simhash_ignores_case_and_returns_none_for_empty_text():
+    assert aup.compute_simhash(BASE_TEXT) == aup.compute_simhash(BASE_TEXT.upper())
+    assert aup.compute_simhash("") is None
+    assert aup.compute_simhash("  ,. ") is None
+
+
+def test_similarity_is_one_minus_hamming_fraction():
+    simhash = aup.compute_simhash(BASE_TEXT)
+    assert aup.simhash_similarity(simhash, simhash) == 1.0
+    assert aup.simhash_similarity(simhash, simhash ^ 0b111) == 1 - 3 / aup.SIMHASH_BITS
+    assert aup.simhash_similarity(0, (1 << aup.SIMHASH_BITS) - 1) == 0.0
+
+
+def test_near_identical_pair_is_above_and_distinct_pair_below_threshold():
+    assert NEAR_TEXT != BASE_TEXT
+    base_hash = aup.compute_simhash(BASE_TEXT)
+    assert aup.simhash_similarity(base_hash, aup.compute_simhash(NEAR_TEXT)) >= 0.9
+    assert aup.simhash_similarity(base_hash, aup.compute_simhash(DISTINCT_TEXT)) < 0.9
+
+
+def test_check_and_add_flags_near_duplicate_and_keeps_distinct_article(near_duplicate_index):
+    assert near_duplicate_index.check_and_add("https://x/base", aup.compute_simhash(BASE_TEXT), "Base", 0.9) is None
+    duplicate_match = near_duplicate_index.check_and_add("https://x/near", aup.compute_simhash(NEAR_TEXT), "Near", 0.9)
+    assert duplicate_match["link"] == "https://x/base" and duplicate_match["title"] == "Base"
+    assert duplicate_match["similarity"] >= 0.9
+    assert near_duplicate_index.check_and_add("https://x/distinct", aup.compute_simhash(DISTINCT_TEXT), "Distinct", 0.9) is None
+    # تکراری ثبت نمی‌شود تا زنجیره‌ای از بازنشرها همه به اولین مقاله نسبت داده شوند
+    assert stored_links(near_duplicate_index) == ["https://x/base", "https://x/distinct"]
+
+
+def test_check_and_add_respects_threshold(near_duplicate_index):
+    base_hash, near_hash = aup.compute_simhash(BASE_TEXT), aup.compute_simhash(NEAR_TEXT)
+    near_duplicate_index.check_and_add("https://x/base", base_hash, "Base", 0.9)
+    stricter_threshold = aup.simhash_similarity(base_hash, near_hash) + 1 / aup.SIMHASH_BITS
+    assert near_duplicate_index.check_and_add("https://x/near", near_hash, "Near", stricter_threshold) is None
+
+
+def test_same_link_is_not_its_own_duplicate(near_duplicate_index):
+    base_hash = aup.compute_simhash(BASE_TEXT)
+    near_duplicate_index.check_and_add("https://x/base", base_hash, "Base", 0.9)
+    assert near_duplicate_index.check_and_add("https://x/base", base_hash, "Base", 0.9) is None
+
+
+def test_fingerprint_outside_window_is_evicted(near_duplicate_index):
+    near_duplicate_index.add("https://x/base", aup.compute_simhash(BASE_TEXT), "Base")
+    near_duplicate_index._execute("UPDATE article_fingerprints SET added_at = ?", (time.time() - 3 * 3600,))
+    assert near_duplicate_index.check_and_add("https://x/near", aup.compute_simhash(NEAR_TEXT), "Near", 0.9) is None
+    assert stored_links(near_duplicate_index) == ["https://x/near"]
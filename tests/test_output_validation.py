@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# اعتبارسنجی خروجی Gemini و ترمیم موضعی: بلوک گم‌شده یا تکراری، div خلاصه و نتیجه‌گیری، اسکلت تگ‌ها و نسبت حروف لاتین.
+# درخواست‌های ترمیم به Gemini با پاسخ‌های ثابت جایگزین می‌شوند تا فقط منطق تشخیص و جای‌گذاری بررسی شود
+import contextlib
+import io
+
+import pytest
+
+from bench_dom_pipeline import load_aup_module
+
+aup = load_aup_module()
+
+SUMMARY = '<div class="summary" style="font-weight: bold;">خلاصه کوتاه خبر</div>'
+CONCLUSION = '<div class="conclusion"><strong>جمع‌بندی:</strong><br/>نتیجه‌گیری خبر.</div>'
+PERSIAN_PARAGRAPH = "<p>قیمت بیت‌کوین پس از عبور از مقاومت ۶۵ هزار دلاری افزایش یافت و معامله‌گران منتظر حرکت بعدی هستند.</p>"
+ENGLISH_PARAGRAPH = "<p>Bitcoin price started a fresh increase above the resistance zone and traders are waiting.</p>"
+PLACEHOLDER = '<div class="image-placeholder-container" id="placeholder-1"></div>'
+TRADINGVIEW_FIGURE = '<figure><img src="https://s3.tradingview.com/x/abc.png"><figcaption>BTCUSD chart from TradingView showing the hourly trend</figcaption></figure>'
+
+SOURCE_HTML = f"{ENGLISH_PARAGRAPH}<h2>Key level</h2>{PLACEHOLDER}{ENGLISH_PARAGRAPH}"
+TRANSLATED_HTML = f"{SUMMARY}{PERSIAN_PARAGRAPH}<h2>سطح کلیدی</h2>{PLACEHOLDER}{PERSIAN_PARAGRAPH}{CONCLUSION}"
+
+
+def validate(source_html, translated_html):
+    return aup.validate_translated_soup(aup.make_soup(source_html), aup.make_soup(translated_html))
+
+
+def checks_of(issues):
+    return [issue["check"] for issue in issues]
+
+
+@pytest.fixture
+def repair_replies(monkeypatch):
+    """پاسخ ثابت هر نوع درخواست ترمیم (بر اساس label)؛ درخواست‌های ارسال‌شده در calls ثبت می‌شوند."""
+    replies = {
+        "ترمیم summary": SUMMARY,
+        "ترمیم conclusion": CONCLUSION,
+        "ترمیم بخش ترجمه‌نشده": PERSIAN_PARAGRAPH,
+    }
+    calls = []
+
+    def fake_request_repair(prompt, label, model_name):
+        calls.append((label, prompt))
+        return replies[label]
+
+    monkeypatch.setattr(aup, "request_repair_from_gemini", fake_request_repair)
+    monkeypatch.setattr(aup, "OUTPUT_VALIDATION_ENABLED", True)
+    return replies, calls
+
+
+def validate_and_repair(source_html, translated_html):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return aup.validate_and_repair_translation(source_html, translated_html)
+
+
+def test_faithful_translation_has_no_issues():
+    assert validate(SOURCE_HTML, TRANSLATED_HTML) == []
+
+
+@pytest.mark.parametrize("required_div", [SUMMARY, CONCLUSION], ids=["summary", "conclusion"])
+def test_missing_required_div_is_reported(required_div):
+    assert checks_of(validate(SOURCE_HTML, TRANSLATED_HTML.replace(required_div, ""))) == ["conclusion" if required_div == CONCLUSION else "summary"]
+
+
+def test_dropped_and_duplicated_anchors_are_reported():
+    source_html = SOURCE_HTML + '<figure data-k="b2"></figure>'
+    dropped_issues = validate(source_html, TRANSLATED_HTML.replace(PLACEHOLDER, ""))
+    assert dropped_issues == [{"check": "anchors", "missing": ["placeholder-1", "b2"], "duplicated": []}]
+    duplicated_html = TRANSLATED_HTML.replace(PLACEHOLDER, PLACEHOLDER * 2) + '<figure data-k="b2"></figure>'
+    assert validate(source_html, duplicated_html) == [{"check": "anchors", "missing": [], "duplicated": ["placeholder-1"]}]
+
+
+def test_skeleton_difference_is_reported():
+    issues = validate(SOURCE_HTML, TRANSLATED_HTML.replace("<h2>سطح کلیدی</h2>", "<p>سطح کلیدی</p>"))
+    assert issues == [{"check": "skeleton", "diff": {"h2": (1, 0)}}]
+
+
+def test_untranslated_paragraph_is_reported():
+    issues = validate(SOURCE_HTML, TRANSLATED_HTML.replace(PERSIAN_PARAGRAPH, ENGLISH_PARAGRAPH, 1))
+    assert checks_of(issues) == ["latin"]
+    assert [str(text_tag) for text_tag in issues[0]["elements"]] == [ENGLISH_PARAGRAPH]
+
+
+@pytest.mark.parametrize("minimizer_enabled", [True, False], ids=["minimizer_on", "minimizer_off"])
+def test_link_and_tradingview_text_is_not_counted_as_untranslated(minimizer_enabled):
+    # متن لینک‌ها و بلوک TradingView عمداً انگلیسی می‌ماند؛ با کوچک‌سازی خاموش هم نباید ترجمه‌نشده حساب شود
+    link_paragraph = '<p>به گزارش <a href="https://www.example.com/a">Bitcoin Price Prediction Weekly Technical Analysis Report</a> قیمت بالا رفت.</p>'
+    source_html = SOURCE_HTML + TRADINGVIEW_FIGURE + link_paragraph
+    if minimizer_enabled:
+        with contextlib.redirect_stdout(io.StringIO()):
+            source_html = aup.minimize_markup_for_prompt(source_html)[0]
+    # پاسخ Gemini همان ورودی (کوچک‌شده یا کامل) است که پاراگراف‌ها و تیتر آن ترجمه و خلاصه و نتیجه‌گیری به آن اضافه شده است
+    translated_html = SUMMARY + source_html.replace(ENGLISH_PARAGRAPH, PERSIAN_PARAGRAPH).replace("<h2>Key level</h2>", "<h2>سطح کلیدی</h2>") + CONCLUSION
+    assert validate(source_html, translated_html) == []
+
+
+def test_repair_restores_required_divs_and_anchors(repair_replies):
+    _, calls = repair_replies
+    broken_html = f"{PERSIAN_PARAGRAPH}<h2>سطح کلیدی</h2>{PERSIAN_PARAGRAPH}"
+    repaired_soup = aup.make_soup(validate_and_repair(SOURCE_HTML, broken_html))
+    assert sorted(label for label, _ in calls) == ["ترمیم conclusion", "ترمیم summary"]
+    top_level_tags = [tag for tag in repaired_soup.contents if getattr(tag, "name", None)]
+    assert top_level_tags[0].get("class") == ["summary"]
+    assert top_level_tags[-1].get("class") == ["conclusion"]
+    # Placeholder گم‌شده بدون درخواست و پس از خلاصه (نزدیک‌ترین جای معتبر) برگردانده می‌شود
+    assert [tag.get("id") for tag in repaired_soup.find_all(aup._anchor_key)] == ["placeholder-1"]
+    assert validate(SOURCE_HTML, str(repaired_soup)) == []
+
+
+def test_repair_removes_duplicated_anchor_without_request(repair_replies):
+    _, calls = repair_replies
+    repaired_html = validate_and_repair(SOURCE_HTML, TRANSLATED_HTML.replace(PLACEHOLDER, PLACEHOLDER * 3))
+    assert calls == []
+    assert repaired_html.count('id="placeholder-1"') == 1
+
+
+def test_repair_replaces_only_untranslated_paragraphs(repair_replies):
+    _, calls = repair_replies
+    translated_html = TRANSLATED_HTML.replace(PERSIAN_PARAGRAPH, ENGLISH_PARAGRAPH, 1)
+    repaired_html = validate_and_repair(SOURCE_HTML, translated_html)
+    assert [label for label, _ in calls] == ["ترمیم بخش ترجمه‌نشده"]
+    assert ENGLISH_PARAGRAPH in calls[0][1]
+    assert repaired_html == TRANSLATED_HTML
+
+
+def test_repair_reply_still_in_english_is_rejected(repair_replies):
+    replies, calls = repair_replies
+    replies["ترمیم بخش ترجمه‌نشده"] = ENGLISH_PARAGRAPH
+    translated_html = TRANSLATED_HTML.replace(PERSIAN_PARAGRAPH, ENGLISH_PARAGRAPH, 1)
+    assert validate_and_repair(SOURCE_HTML, translated_html) == translated_html
+    assert len(calls) == 1
+
+
+def test_repair_requests_are_capped_to_largest_fragments(repair_replies, monkeypatch):
+    _, calls = repair_replies
+    monkeypatch.setattr(aup, "OUTPUT_REPAIR_MAX_FRAGMENTS", 1)
+    longer_english_paragraph = "<p>Ethereum developers scheduled another network upgrade after long discussions with validators and client teams.</p>"
+    translated_html = TRANSLATED_HTML.replace(PERSIAN_PARAGRAPH, ENGLISH_PARAGRAPH, 1).replace(PERSIAN_PARAGRAPH, longer_english_paragraph, 1)
+    repaired_html = validate_and_repair(SOURCE_HTML, translated_html)
+    assert len(calls) == 1 and longer_english_paragraph in calls[0][1]
+    assert ENGLISH_PARAGRAPH in repaired_html and longer_english_paragraph not in repaired_html
+
+
+def test_validation_disabled_returns_reply_unchanged(repair_replies, monkeypatch):
+    _, calls = repair_replies
+    monkeypatch.setattr(aup, "OUTPUT_VALIDATION_ENABLED", False)
+    assert validate_and_repair(SOURCE_HTML, ENGLISH_PARAGRAPH) == ENGLISH_PARAGRAPH
+    assert calls == []
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# استعلام لینک‌های پردازش شده در برابر endpointهای محلی پلاگین وردپرس: استعلام دسته‌ای processed-links/check،
+# دانلود کامل لیست وقتی پلاگین آن endpoint را ندارد (404) و پر شدن ایندکس محلی برای اجراهای بعدی
+import contextlib
+import io
+import json
+
+import pytest
+
+from bench_dom_pipeline import load_aup_module
+from conftest import QuietHandler
+
+aup = load_aup_module()
+
+FEED_LINKS = ["https://news.example/a", "https://news.example/b", "https://news.example/c"]
+
+
+class FakeProcessedLinksHandler(QuietHandler):
+    """لینک‌های processed_links پردازش شده‌اند؛ با check_supported=False endpoint دسته‌ای 404 می‌دهد."""
+    processed_links = []
+    check_supported = True
+    requests_seen = []
+
+    def send_json(self, status_code, response_data):
+        response_bytes = json.dumps(response_data).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response_bytes)))
+        self.end_headers()
+        self.wfile.write(response_bytes)
+
+    def do_GET(self):
+        self.requests_seen.append(("GET", self.path, None))
+        self.send_json(200, self.processed_links)
+
+    def do_POST(self):
+        request_data = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        self.requests_seen.append(("POST", self.path, request_data))
+        if not self.path.endswith("/check"):
+            self.processed_links.append(request_data["link"])
+            self.send_json(200, {"message": "ok"})
+        elif self.check_supported:
+            self.send_json(200, {"known": [link for link in request_data["links"] if link in self.processed_links]})
+        else:
+            self.send_json(404, {"code": "rest_no_route"})
+
+
+@pytest.fixture
+def fake_wordpress(local_server, tmp_path, monkeypatch):
+    """endpointهای processed-links روی سرور محلی و ایندکس محلی تازه در پوشه موقت؛ خروجی کلاس handler است."""
+    handler_class = type("ScriptedProcessedLinksHandler", (FakeProcessedLinksHandler,), {"processed_links": [], "requests_seen": []})
+    endpoint_url = local_server(handler_class) + "/wp-json/my-poster/v1/processed-links"
+    monkeypatch.setattr(aup, "WORDPRESS_PROCESSED_LINKS_GET_API_ENDPOINT", endpoint_url)
+    monkeypatch.setattr(aup, "WORDPRESS_PROCESSED_LINKS_ADD_API_ENDPOINT", endpoint_url)
+    monkeypatch.setattr(aup, "WORDPRESS_PROCESSED_LINKS_CHECK_API_ENDPOINT", endpoint_url + "/check")
+    monkeypatch.setattr(aup, "STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(aup, "_processed_links_index", aup.ProcessedLinksIndex())
+    return handler_class
+
+
+def find_processed_links(candidate_links):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return aup.find_processed_links(candidate_links)
+
+
+def request_paths(handler_class):
+    return [(method, path.rsplit("/", 1)[-1]) for method, path, _ in handler_class.requests_seen]
+
+
+def test_batch_check_returns_known_links_and_fills_local_index(fake_wordpress):
+    fake_wordpress.processed_links.extend([FEED_LINKS[0], "https://news.example/old"])
+    assert find_processed_links(FEED_LINKS) == {FEED_LINKS[0]}
+    assert fake_wordpress.requests_seen == [("POST", "/wp-json/my-poster/v1/processed-links/check", {"links": FEED_LINKS})]
+    assert aup.get_processed_links_index().known_links(FEED_LINKS) == {FEED_LINKS[0]}
+
+
+def test_links_in_local_index_are_not_sent_to_wordpress(fake_wordpress):
+    fake_wordpress.processed_links.append(FEED_LINKS[0])
+    find_processed_links(FEED_LINKS)
+    fake_wordpress.requests_seen.clear()
+    assert find_processed_links(FEED_LINKS) == {FEED_LINKS[0]}
+    assert fake_wordpress.requests_seen[0][2] == {"links": FEED_LINKS[1:]}
+    # وقتی همه لینک‌ها در ایندکس محلی باشند هیچ درخواستی ارسال نمی‌شود
+    fake_wordpress.requests_seen.clear()
+    assert find_processed_links(FEED_LINKS[:1]) == {FEED_LINKS[0]}
+    assert fake_wordpress.requests_seen == []
+
+
+def test_saved_link_is_added_to_local_index(fake_wordpress):
+    with contextlib.redirect_stdout(io.StringIO()):
+        aup.save_processed_link_to_wordpress(FEED_LINKS[1])
+    fake_wordpress.requests_seen.clear()
+    assert find_processed_links(FEED_LINKS[1:2]) == {FEED_LINKS[1]}
+    assert fake_wordpress.requests_seen == []
+
+
+def test_missing_check_endpoint_falls_back_to_full_download(fake_wordpress):
+    fake_wordpress.check_supported = False
+    fake_wordpress.processed_links.extend([FEED_LINKS[2], "https://news.example/old"])
+    assert find_processed_links(FEED_LINKS) == {FEED_LINKS[2]}
+    assert request_paths(fake_wordpress) == [("POST", "check"), ("GET", "processed-links")]
+    # کل لیست دانلود شده در ایندکس محلی ذخیره می‌شود تا اجرای بعدی به دانلود کامل نیاز نداشته باشد
+    assert aup.get_processed_links_index().known_links(FEED_LINKS + ["https://news.example/old"]) == {FEED_LINKS[2], "https://news.example/old"}
+
+
+def test_check_endpoint_error_is_raised(fake_wordpress):
+    fake_wordpress.do_POST = lambda self: self.send_json(500, {"code": "internal_error"})
+    with pytest.raises(ValueError):
+        find_processed_links(FEED_LINKS)